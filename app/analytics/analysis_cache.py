@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+from datetime import datetime
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional, Tuple
+from .database import analysis_result_collection
+
+# Results for screenshot sets that are no longer current are removed after this long
+ANALYSIS_CACHE_TTL_DAYS = int(os.getenv("ANALYSIS_CACHE_TTL_DAYS", "30"))
+
+
+@lru_cache(maxsize=None)
+def _function_source(fn: Callable) -> str:
+    try:
+        return inspect.getsource(fn)
+    except (OSError, TypeError):
+        return repr(fn.__code__.co_consts)
+
+
+def prompt_version(*parts) -> str:
+    """
+    Version of the prompts used by an analysis: a hash of the functions'
+    source and any prompt templates they read, so editing a prompt changes
+    the version and invalidates earlier results without a manual bump.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        source = _function_source(part) if callable(part) else json.dumps(part, sort_keys=True, default=str)
+        digest.update(source.encode())
+    return digest.hexdigest()[:16]
+
+
+def analysis_key(kind: str, analysis_type: str, screenshot_ids: List[str], template_version: str, model: str) -> str:
+    """Cache key for an analysis of an ordered screenshot set"""
+    payload = json.dumps([kind, analysis_type, list(screenshot_ids), template_version, model])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Persistent memo of Gemini analysis results in Mongo. Keys include the
+    ordered screenshot ids, so a newer screenshot changes the key of
+    "latest N" analyses and old entries simply stop matching; they expire
+    through a TTL index. Concurrent identical requests share one call.
+    """
+    def __init__(self):
+        self._inflight = {}
+        self._index_ready = False
+        self.hits = 0
+        self.misses = 0
+
+    async def _ensure_index(self):
+        if self._index_ready:
+            return
+        try:
+            await analysis_result_collection.create_index("created_at", expireAfterSeconds=ANALYSIS_CACHE_TTL_DAYS * 86400)
+        except Exception as e:
+            print(f"Analysis cache: could not create TTL index: {e}")
+        self._index_ready = True
+
+    async def get(self, key: str) -> Optional[dict]:
+        return await analysis_result_collection.find_one({"_id": key}, {"result": 1})
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[dict]],
+                             refresh: bool = False, **fields) -> Tuple[dict, bool]:
+        """Return (result, cached). `fields` are stored alongside for inspection."""
+        await self._ensure_index()
+        if not refresh:
+            doc = await self.get(key)
+            if doc:
+                self.hits += 1
+                return doc["result"], True
+            if key in self._inflight:
+                self.hits += 1
+                return await asyncio.shield(self._inflight[key]), True
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+            await analysis_result_collection.replace_one(
+                {"_id": key},
+                {"_id": key, "result": result, "created_at": datetime.utcnow(), **fields},
+                upsert=True
+            )
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # Nobody may be waiting on the future; don't warn about an unretrieved exception
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "in_flight": len(self._inflight)
+        }
+
+
+analysis_cache = AnalysisCache()
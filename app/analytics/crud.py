@@ -1,54 +1,208 @@
-from .database import screenshot_collection
+from .database import screenshot_collection, screenshot_fs
 from .schemas import ScreenshotModel
+from .image_prep import decode_image_data, describe_image, is_image_url, make_preview, parse_image_payload
+from .url_fetcher import url_fetcher
+from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
+from bson.binary import Binary
 from bson.objectid import ObjectId
 from datetime import datetime
-from typing import List
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import os
+
+# Images larger than this go to GridFS instead of inline in the document (16MB BSON limit)
+GRIDFS_THRESHOLD = int(os.getenv("SCREENSHOT_GRIDFS_THRESHOLD", str(8 * 1024 * 1024)))
+
+# Everything except the image payloads, for list and metadata queries
+METADATA_PROJECTION = {"image": 0, "image_data": 0, "preview": 0, "analysis_data": 0}
+# Just what is needed to load the original image
+IMAGE_PROJECTION = {"storage": 1, "image": 1, "image_data": 1, "gridfs_id": 1, "source_url": 1, "content_type": 1}
+# The prepared analysis version where it exists, the original otherwise
+ANALYSIS_PROJECTION = {**IMAGE_PROJECTION, "analysis_data": 1}
+
+
+def to_public(screenshot: dict) -> dict:
+    """JSON-safe metadata with links to the image and its preview"""
+    screenshot_id = str(screenshot.pop("_id"))
+    for field in ("image", "image_data", "preview", "analysis_data", "gridfs_id"):
+        screenshot.pop(field, None)
+    screenshot["id"] = screenshot_id
+    screenshot["image_url"] = f"/analytics/screenshots/{screenshot_id}/image"
+    screenshot["preview_url"] = f"/analytics/screenshots/{screenshot_id}/preview"
+    return jsonable_encoder(screenshot)
+
+
+def _object_id(id: str) -> Optional[ObjectId]:
+    return ObjectId(id) if ObjectId.is_valid(id) else None
+
 
 async def add_screenshot(screenshot: ScreenshotModel) -> dict:
-    """Save a screenshot to MongoDB"""
+    """
+    Save a screenshot to MongoDB. The image is stored as raw bytes (BSON
+    Binary, or GridFS above GRIDFS_THRESHOLD) with its content type,
+    dimensions and a small preview as separate fields; image URLs are kept
+    as a reference.
+    """
     screenshot_dict = screenshot.dict()
-    
+    image_data = screenshot_dict.pop("image")
+
     # Set timestamp if not provided
     if not screenshot_dict.get("timestamp"):
         screenshot_dict["timestamp"] = datetime.utcnow()
-    
+
+    image_bytes, declared_type = parse_image_payload(image_data)
+    if image_bytes is None:
+        screenshot_dict.update({"storage": "url", "source_url": image_data})
+    else:
+        info = await run_in_threadpool(describe_image, image_bytes)
+        screenshot_dict.update({
+            "content_type": info["content_type"] or declared_type,
+            "width": info["width"],
+            "height": info["height"],
+            "size": len(image_bytes),
+            "preview": Binary(info["preview"]),
+            # Cropped, downscaled copy that analyses send to Gemini
+            "analysis_data": Binary(info["analysis"]),
+            "prep": info["prep"]
+        })
+        print(f"Prepared screenshot for analysis: {info['prep']['original_bytes']} -> "
+              f"{info['prep']['prepared_bytes']} bytes, {info['prep']['original_tokens']} -> "
+              f"{info['prep']['prepared_tokens']} image tokens")
+        if len(image_bytes) > GRIDFS_THRESHOLD:
+            screenshot_dict["storage"] = "gridfs"
+            screenshot_dict["gridfs_id"] = await screenshot_fs.upload_from_stream(
+                f"screenshot-{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}",
+                image_bytes,
+                metadata={"content_type": screenshot_dict["content_type"]}
+            )
+        else:
+            screenshot_dict["storage"] = "binary"
+            screenshot_dict["image_data"] = Binary(image_bytes)
+
     # Insert into database
     result = await screenshot_collection.insert_one(screenshot_dict)
-    
-    # Build the response
-    response = {**screenshot_dict, "id": str(result.inserted_id)}
-    
-    # Use jsonable_encoder with a custom encoder for ObjectId
-    return jsonable_encoder(response, custom_encoder={ObjectId: str})
+
+    # Build the response from the metadata only
+    return to_public({**screenshot_dict, "_id": result.inserted_id})
 
 async def retrieve_screenshots(limit: int = 10) -> List[dict]:
-    """Get most recent screenshots"""
-    screenshots = await screenshot_collection.find().sort("timestamp", -1).limit(limit).to_list(length=limit)
-    
-    # Process results
-    processed_screenshots = []
-    for screenshot in screenshots:
-        # Convert _id to string id
-        screenshot["id"] = str(screenshot["_id"])
-        del screenshot["_id"]
-        processed_screenshots.append(screenshot)
-    
-    return jsonable_encoder(processed_screenshots)
+    """Get metadata of the most recent screenshots, without image payloads"""
+    screenshots = await screenshot_collection.find({}, METADATA_PROJECTION).sort("timestamp", -1).limit(limit).to_list(length=limit)
+    return [to_public(screenshot) for screenshot in screenshots]
 
 async def get_screenshot_by_id(id: str) -> dict:
-    """Get a specific screenshot by ID"""
+    """Get a specific screenshot's metadata by ID"""
     try:
         # Convert string ID to ObjectId
         obj_id = ObjectId(id)
-        screenshot = await screenshot_collection.find_one({"_id": obj_id})
-        
+        screenshot = await screenshot_collection.find_one({"_id": obj_id}, METADATA_PROJECTION)
+
         if screenshot:
-            # Convert _id to string id
-            screenshot["id"] = str(screenshot["_id"])
-            del screenshot["_id"]
-            return jsonable_encoder(screenshot)
+            return to_public(screenshot)
         return None
     except Exception as e:
         print(f"Error retrieving screenshot by ID: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+async def get_screenshot_storage(id: str) -> Optional[dict]:
+    """Storage fields of a screenshot, used to serve the original image"""
+    obj_id = _object_id(id)
+    if not obj_id:
+        return None
+    return await screenshot_collection.find_one({"_id": obj_id}, IMAGE_PROJECTION)
+
+async def stream_gridfs_image(gridfs_id) -> AsyncIterator[bytes]:
+    grid_out = await screenshot_fs.open_download_stream(gridfs_id)
+    while True:
+        chunk = await grid_out.readchunk()
+        if not chunk:
+            break
+        yield chunk
+
+async def _image_payload(doc: dict):
+    """Bytes of a stored image, or the URL / base64 string of legacy documents"""
+    storage = doc.get("storage")
+    if storage == "binary":
+        return bytes(doc["image_data"])
+    if storage == "gridfs":
+        grid_out = await screenshot_fs.open_download_stream(doc["gridfs_id"])
+        return await grid_out.read()
+    if storage == "url":
+        return doc["source_url"]
+    # Documents saved before binary storage keep the data URL in "image"
+    return doc.get("image")
+
+async def load_screenshot_images(ids: List[str], prepared: bool = True) -> Dict[str, Tuple[object, bool]]:
+    """
+    Image payloads for the given screenshot ids, fetched in one query, as
+    {id: (payload, is_prepared)}. With prepared=True the analysis version is
+    returned where one was stored at ingestion.
+    """
+    obj_ids = [obj_id for obj_id in map(_object_id, ids) if obj_id]
+    payloads = {}
+    projection = ANALYSIS_PROJECTION if prepared else IMAGE_PROJECTION
+    async for doc in screenshot_collection.find({"_id": {"$in": obj_ids}}, projection):
+        if prepared and doc.get("analysis_data"):
+            payloads[str(doc["_id"])] = (bytes(doc["analysis_data"]), True)
+            continue
+        payload = await _image_payload(doc)
+        if payload:
+            payloads[str(doc["_id"])] = (payload, False)
+    return payloads
+
+async def save_prepared_image(id: str, analysis_bytes: bytes, prep: dict):
+    """Store the analysis version of a screenshot saved before ingestion-time preparation"""
+    obj_id = _object_id(id)
+    if obj_id:
+        await screenshot_collection.update_one(
+            {"_id": obj_id},
+            {"$set": {"analysis_data": Binary(analysis_bytes), "prep": prep}}
+        )
+
+async def get_prep_savings() -> dict:
+    """Total bytes and estimated Gemini image tokens saved by image preparation"""
+    pipeline = [
+        {"$match": {"prep": {"$exists": True}}},
+        {"$group": {
+            "_id": None,
+            "screenshots": {"$sum": 1},
+            "original_bytes": {"$sum": "$prep.original_bytes"},
+            "prepared_bytes": {"$sum": "$prep.prepared_bytes"},
+            "original_tokens": {"$sum": "$prep.original_tokens"},
+            "prepared_tokens": {"$sum": "$prep.prepared_tokens"}
+        }}
+    ]
+    totals = await screenshot_collection.aggregate(pipeline).to_list(1)
+    if not totals:
+        return {"screenshots": 0}
+    totals = totals[0]
+    totals.pop("_id")
+    totals["bytes_saved"] = totals["original_bytes"] - totals["prepared_bytes"]
+    totals["tokens_saved"] = totals["original_tokens"] - totals["prepared_tokens"]
+    if totals["original_bytes"]:
+        totals["bytes_ratio"] = round(totals["prepared_bytes"] / totals["original_bytes"], 3)
+    if totals["original_tokens"]:
+        totals["tokens_ratio"] = round(totals["prepared_tokens"] / totals["original_tokens"], 3)
+    return totals
+
+async def get_screenshot_preview(id: str) -> Optional[bytes]:
+    """Stored preview bytes; created and saved on first request for older documents"""
+    obj_id = _object_id(id)
+    if not obj_id:
+        return None
+    doc = await screenshot_collection.find_one({"_id": obj_id}, {"preview": 1})
+    if not doc:
+        return None
+    if doc.get("preview"):
+        return bytes(doc["preview"])
+
+    payload = (await load_screenshot_images([id], prepared=False)).get(id)
+    if not payload:
+        return None
+    payload = payload[0]
+    if isinstance(payload, str) and is_image_url(payload):
+        payload = await url_fetcher.fetch(payload)
+    image = await run_in_threadpool(decode_image_data, payload)
+    preview = await run_in_threadpool(make_preview, image)
+    await screenshot_collection.update_one({"_id": obj_id}, {"$set": {"preview": Binary(preview)}})
+    return preview
@@ -1,4 +1,5 @@
 import motor.motor_asyncio
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
 from dotenv import load_dotenv
 import os
 
@@ -14,4 +15,12 @@ client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
 
 # Database and collections
 db = client.alphagen_db
-screenshot_collection = db.get_collection("youtube_studio_screenshots") 
\ No newline at end of file
+screenshot_collection = db.get_collection("youtube_studio_screenshots") 
+# Screenshots too large to store inline
+screenshot_fs = AsyncIOMotorGridFSBucket(db, bucket_name="screenshots")
+# Text and metrics extracted from each screenshot, with embeddings for retrieval
+screenshot_chunk_collection = db.get_collection("screenshot_chunks")
+# Memoized Gemini analysis results, see analysis_cache.py
+analysis_result_collection = db.get_collection("analysis_results")
+# Stored per-window summaries used by the incremental comprehensive report
+window_summary_collection = db.get_collection("window_summaries")
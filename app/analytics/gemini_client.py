@@ -0,0 +1,220 @@
+import asyncio
+import os
+import random
+import time
+from dotenv import load_dotenv
+from typing import AsyncIterator, Dict, List, Optional
+
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "8"))
+# Requests started per minute across the process, to stay under the API quota
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "2.0"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "60"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "300"))
+
+
+class GeminiError(Exception):
+    """Raised when a Gemini call fails after all retries"""
+
+
+class RateLimiter:
+    """Token bucket: `per_minute` acquisitions per minute, bursts of up to `burst`"""
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Wait for a token; returns the seconds spent waiting"""
+        waited = 0.0
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Quota (429) and transient server errors are worth retrying"""
+    from google.api_core import exceptions
+
+    return isinstance(error, (exceptions.ResourceExhausted, exceptions.TooManyRequests,
+                              exceptions.ServiceUnavailable, exceptions.InternalServerError,
+                              exceptions.DeadlineExceeded, asyncio.TimeoutError))
+
+
+def _retry_delay(error: Exception) -> Optional[float]:
+    """Server-suggested delay from a quota error, if it carries one"""
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and getattr(delay, "seconds", None):
+            return float(delay.seconds)
+    return None
+
+
+class GeminiClient:
+    """
+    Shared async client for the Gemini API. The SDK is configured once and
+    model objects are reused; calls use the async generation API, are
+    limited per process by a semaphore and a requests-per-minute token
+    bucket, retry quota and 5xx errors with jittered exponential backoff,
+    and record latency and token totals per model.
+    """
+    def __init__(self):
+        self._configured = False
+        self._models: Dict[str, object] = {}
+        self._semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+        self._limiter = RateLimiter(GEMINI_REQUESTS_PER_MINUTE, burst=GEMINI_CONCURRENCY)
+        self.rate_limited_seconds = 0.0
+        self.stats: Dict[str, dict] = {}
+
+    def _model(self, name: str):
+        if name not in self._models:
+            # Imported on first use, google.generativeai is slow to import
+            import google.generativeai as genai
+
+            if not self._configured:
+                if not GEMINI_API_KEY:
+                    raise GeminiError("GEMINI_API_KEY not configured")
+                genai.configure(api_key=GEMINI_API_KEY)
+                self._configured = True
+            self._models[name] = genai.GenerativeModel(name)
+        return self._models[name]
+
+    def _model_stats(self, model: str) -> dict:
+        if model not in self.stats:
+            self.stats[model] = {
+                "requests": 0,
+                "failures": 0,
+                "retries": 0,
+                "in_flight": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_latency": 0.0,
+                "max_latency": 0.0
+            }
+        return self.stats[model]
+
+    def _record(self, model: str, latency: float, usage=None):
+        stats = self._model_stats(model)
+        stats["requests"] += 1
+        stats["total_latency"] += latency
+        stats["max_latency"] = max(stats["max_latency"], latency)
+        if usage is not None:
+            stats["prompt_tokens"] += getattr(usage, "prompt_token_count", 0) or 0
+            stats["completion_tokens"] += getattr(usage, "candidates_token_count", 0) or 0
+
+    @staticmethod
+    def _backoff(attempt: int, suggested: Optional[float] = None) -> float:
+        if suggested:
+            return min(suggested, GEMINI_BACKOFF_MAX)
+        # Full jitter so retries from concurrent requests spread out
+        return random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * (2 ** attempt)))
+
+    async def _start(self, model: str, parts: List, stream: bool, generation_config: Optional[dict]):
+        """Send a request, retrying quota and transient errors until it is accepted"""
+        stats = self._model_stats(model)
+        last_error = None
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            self.rate_limited_seconds += await self._limiter.acquire()
+            try:
+                return await asyncio.wait_for(
+                    self._model(model).generate_content_async(
+                        parts, generation_config=generation_config, stream=stream),
+                    timeout=GEMINI_TIMEOUT
+                )
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+                last_error = e
+            if attempt < GEMINI_MAX_RETRIES:
+                stats["retries"] += 1
+                delay = self._backoff(attempt, _retry_delay(last_error))
+                print(f"Gemini call to {model} failed ({type(last_error).__name__}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        raise GeminiError(f"Gemini request failed after {GEMINI_MAX_RETRIES + 1} attempts: {last_error}")
+
+    async def generate(self, parts: List, model: str, generation_config: Optional[dict] = None) -> str:
+        """Generate content and return the response text"""
+        stats = self._model_stats(model)
+        async with self._semaphore:
+            stats["in_flight"] += 1
+            start = time.perf_counter()
+            try:
+                response = await self._start(model, parts, False, generation_config)
+                text = response.text
+            except Exception:
+                stats["failures"] += 1
+                raise
+            finally:
+                stats["in_flight"] -= 1
+
+        latency = time.perf_counter() - start
+        usage = getattr(response, "usage_metadata", None)
+        self._record(model, latency, usage)
+        print(f"Gemini {model}: {latency:.2f}s, usage={getattr(usage, 'total_token_count', None)} tokens")
+        return text
+
+    async def stream(self, parts: List, model: str, generation_config: Optional[dict] = None) -> AsyncIterator[str]:
+        """
+        Generate content and yield text deltas as they arrive. Retries only
+        apply before the first chunk is received.
+        """
+        stats = self._model_stats(model)
+        async with self._semaphore:
+            stats["in_flight"] += 1
+            start = time.perf_counter()
+            usage = None
+            try:
+                response = await self._start(model, parts, True, generation_config)
+                async for chunk in response:
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunks without text parts (e.g. only a finish reason)
+                        continue
+                    if text:
+                        yield text
+            except Exception:
+                stats["failures"] += 1
+                raise
+            finally:
+                stats["in_flight"] -= 1
+
+        latency = time.perf_counter() - start
+        self._record(model, latency, usage)
+        print(f"Gemini {model} (stream): {latency:.2f}s, usage={getattr(usage, 'total_token_count', None)} tokens")
+
+    def get_stats(self) -> dict:
+        report = {}
+        for model, stats in self.stats.items():
+            report[model] = {
+                **stats,
+                "avg_latency": round(stats["total_latency"] / stats["requests"], 3) if stats["requests"] else None,
+                "total_latency": round(stats["total_latency"], 3),
+                "max_latency": round(stats["max_latency"], 3)
+            }
+        return {
+            "models": report,
+            "max_concurrency": GEMINI_CONCURRENCY,
+            "requests_per_minute": GEMINI_REQUESTS_PER_MINUTE,
+            "rate_limited_seconds": round(self.rate_limited_seconds, 1)
+        }
+
+
+gemini = GeminiClient()
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from PIL import Image
+from .crud import load_screenshot_images, save_prepared_image
+from .image_prep import decode_image_data, is_image_url, prepare_for_analysis
+from .url_fetcher import url_fetcher
+
+DECODE_WORKERS = int(os.getenv("SCREENSHOT_DECODE_WORKERS", "4"))
+# Budget for decoded pixels kept in memory, in megabytes
+DECODE_CACHE_MB = int(os.getenv("SCREENSHOT_DECODE_CACHE_MB", "512"))
+
+_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="screenshot-decode")
+
+
+def image_nbytes(image: Image.Image) -> int:
+    """Approximate memory held by a decoded image"""
+    return image.width * image.height * len(image.getbands())
+
+
+class DecodedImageCache:
+    """
+    LRU cache of decoded PIL images keyed by screenshot id. Entries are
+    evicted oldest first once the decoded pixels exceed the byte budget.
+    Cached images are shared between requests and must not be modified.
+    """
+    def __init__(self, max_bytes: int = DECODE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, image: Image.Image):
+        size = image_nbytes(image)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (image, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def discard(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self.current_bytes -= entry[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+decoded_images = DecodedImageCache()
+
+
+def screenshot_metadata(screenshot: dict) -> dict:
+    return {
+        "id": screenshot.get("id"),
+        "timestamp": screenshot.get("timestamp"),
+        "source": screenshot.get("source", "YouTube Studio")
+    }
+
+
+def _decode_screenshot(screenshot_id: str, payload, prepared: bool):
+    """
+    Decode the analysis version of a screenshot. Screenshots stored before
+    ingestion-time preparation are prepared here; the prepared bytes are
+    returned so they can be saved. Returns (image, prepared_bytes, prep).
+    """
+    try:
+        image = decode_image_data(payload)
+        prepared_bytes, prep = None, None
+        if not prepared:
+            prepared_bytes, prep = prepare_for_analysis(image, len(payload) if isinstance(payload, bytes) else None)
+            image = decode_image_data(prepared_bytes)
+    except Exception as e:
+        print(f"Error processing image {screenshot_id}: {str(e)}")
+        return None, None, None
+    decoded_images.put(screenshot_id, image)
+    return image, prepared_bytes, prep
+
+
+async def decode_screenshots(screenshots: List[dict]) -> Tuple[List[Image.Image], List[dict]]:
+    """
+    Decode screenshots for Gemini, returning (images, metadata) in the
+    original order. Takes screenshot metadata (as returned by
+    retrieve_screenshots); image bytes are only fetched from Mongo for
+    screenshots that are not in the decoded cache, and those are decoded
+    concurrently in the decode thread pool. Screenshots that fail to load or
+    decode are skipped.
+    """
+    images = {}
+    for screenshot in screenshots:
+        image = decoded_images.get(screenshot["id"])
+        if image is not None:
+            images[screenshot["id"]] = image
+
+    missing = [screenshot["id"] for screenshot in screenshots if screenshot["id"] not in images]
+    if missing:
+        payloads = await load_screenshot_images(missing)
+
+        # Screenshots stored as URLs are downloaded concurrently on the event loop
+        urls = {screenshot_id: payload for screenshot_id, (payload, _) in payloads.items()
+                if isinstance(payload, str) and is_image_url(payload)}
+        if urls:
+            fetched = await url_fetcher.fetch_many(list(urls.values()))
+            for screenshot_id, url in urls.items():
+                if url in fetched:
+                    payloads[screenshot_id] = (fetched[url], False)
+                else:
+                    del payloads[screenshot_id]
+
+        loop = asyncio.get_running_loop()
+        ids = [screenshot_id for screenshot_id in missing if screenshot_id in payloads]
+        decoded = await asyncio.gather(*(
+            loop.run_in_executor(_executor, _decode_screenshot, screenshot_id, *payloads[screenshot_id])
+            for screenshot_id in ids
+        ))
+        for screenshot_id, (image, prepared_bytes, prep) in zip(ids, decoded):
+            images[screenshot_id] = image
+            if prepared_bytes:
+                # Prepare older screenshots once, like new ones are at ingestion
+                await save_prepared_image(screenshot_id, prepared_bytes, prep)
+
+    processed_images = []
+    image_metadata = []
+    for screenshot in screenshots:
+        image = images.get(screenshot["id"])
+        if image is None:
+            continue
+        processed_images.append(image)
+        image_metadata.append(screenshot_metadata(screenshot))
+
+    return processed_images, image_metadata
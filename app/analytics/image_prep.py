@@ -0,0 +1,167 @@
+import base64
+import math
+import os
+from io import BytesIO
+from typing import Optional, Tuple
+import numpy as np
+from PIL import Image
+
+PREVIEW_MAX_EDGE = int(os.getenv("SCREENSHOT_PREVIEW_EDGE", "320"))
+PREVIEW_CONTENT_TYPE = "image/webp"
+
+# Version of each screenshot that is sent to Gemini
+ANALYSIS_MAX_EDGE = int(os.getenv("SCREENSHOT_ANALYSIS_MAX_EDGE", "1536"))
+ANALYSIS_QUALITY = int(os.getenv("SCREENSHOT_ANALYSIS_QUALITY", "82"))
+ANALYSIS_CONTENT_TYPE = "image/webp"
+CROP_BROWSER_CHROME = os.getenv("SCREENSHOT_CROP_CHROME", "1") == "1"
+# Browser toolbars are only looked for in this top fraction of the capture
+CHROME_MAX_FRACTION = 0.12
+
+# Gemini image token accounting: small images cost one tile, larger ones are
+# split into square tiles of up to 768px (the shorter side / 1.5)
+GEMINI_TOKENS_PER_TILE = 258
+
+
+def split_data_url(image_data: str) -> Tuple[Optional[str], str]:
+    """("image/png", base64 part) for a data URL, (None, image_data) otherwise"""
+    if image_data.startswith("data:"):
+        header, _, payload = image_data.partition(",")
+        return header[len("data:"):].split(";")[0] or None, payload
+    return None, image_data
+
+
+def is_image_url(image_data: str) -> bool:
+    return image_data.startswith(("http://", "https://"))
+
+
+def parse_image_payload(image_data: str) -> Tuple[Optional[bytes], Optional[str]]:
+    """Raw bytes and declared content type of an uploaded image, or (None, None) for a URL"""
+    if is_image_url(image_data):
+        return None, None
+    content_type, payload = split_data_url(image_data)
+    return base64.b64decode(payload), content_type
+
+
+def make_preview(image: Image.Image) -> bytes:
+    """Small WebP preview for list views"""
+    preview = image.copy()
+    preview.thumbnail((PREVIEW_MAX_EDGE, PREVIEW_MAX_EDGE), Image.LANCZOS)
+    if preview.mode not in ("RGB", "RGBA"):
+        preview = preview.convert("RGBA" if "A" in preview.getbands() else "RGB")
+    output = BytesIO()
+    preview.save(output, "WEBP", quality=70)
+    return output.getvalue()
+
+
+def describe_image(image_bytes: bytes) -> dict:
+    """Content type, dimensions, preview and analysis version of an uploaded screenshot"""
+    with Image.open(BytesIO(image_bytes)) as image:
+        image.load()
+        analysis_bytes, prep_stats = prepare_for_analysis(image, len(image_bytes))
+        return {
+            "content_type": Image.MIME.get(image.format, "application/octet-stream"),
+            "width": image.width,
+            "height": image.height,
+            "preview": make_preview(image),
+            "analysis": analysis_bytes,
+            "prep": prep_stats
+        }
+
+
+def decode_image_data(image_data) -> Image.Image:
+    """
+    Decode a stored screenshot (raw bytes, base64 or data URL) into a loaded
+    PIL image. Image URLs must be downloaded first, see url_fetcher.
+    """
+    if isinstance(image_data, (bytes, bytearray)):
+        image_bytes = BytesIO(image_data)
+    elif is_image_url(image_data):
+        raise ValueError("Image URLs must be fetched before decoding")
+    else:
+        _, payload = split_data_url(image_data)
+        image_bytes = BytesIO(base64.b64decode(payload))
+
+    image = Image.open(image_bytes)
+    # Decode the pixels now (in the calling worker thread) rather than lazily on first use
+    image.load()
+    return image
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Approximate Gemini input tokens for an image of the given size"""
+    if width <= 384 and height <= 384:
+        return GEMINI_TOKENS_PER_TILE
+    tile = min(max(int(min(width, height) / 1.5), 256), 768)
+    return GEMINI_TOKENS_PER_TILE * math.ceil(width / tile) * math.ceil(height / tile)
+
+
+def find_chrome_height(image: Image.Image) -> int:
+    """
+    Height of the browser toolbar at the top of a full-window capture, or 0.
+    The toolbar ends at a full-width separator line: a row of one colour,
+    different from the rows below it, with non-uniform content (tabs,
+    address bar) above it.
+    """
+    gray = np.asarray(image.convert("L"), dtype=np.int16)
+    band = gray[:int(gray.shape[0] * CHROME_MAX_FRACTION)]
+    if band.shape[0] < 20:
+        return 0
+
+    row_spread = band.max(axis=1) - band.min(axis=1)
+    uniform = row_spread <= 6
+    row_mean = band.mean(axis=1)
+
+    chrome_height = 0
+    for y in range(10, band.shape[0] - 1):
+        is_separator = uniform[y] and abs(row_mean[y] - row_mean[y + 1]) >= 8
+        if is_separator and not uniform[:y].all():
+            chrome_height = y + 1
+    return chrome_height
+
+
+def trim_uniform_border(image: Image.Image) -> Tuple[int, int, int, int]:
+    """Bounding box of the image without solid margins matching the corner colour"""
+    pixels = np.asarray(image.convert("RGB"), dtype=np.int16)
+    differs = (np.abs(pixels - pixels[-1, -1]).max(axis=2) > 8)
+    rows = np.flatnonzero(differs.any(axis=1))
+    cols = np.flatnonzero(differs.any(axis=0))
+    if len(rows) == 0 or len(cols) == 0:
+        return (0, 0, image.width, image.height)
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def prepare_for_analysis(image: Image.Image, original_size: Optional[int] = None) -> Tuple[bytes, dict]:
+    """
+    The version of a screenshot sent to Gemini: browser chrome and solid
+    margins cropped, scaled down to ANALYSIS_MAX_EDGE and re-encoded as
+    WebP. Returns the encoded bytes and stats comparing it with the original.
+    """
+    left, top, right, bottom = 0, 0, image.width, image.height
+    if CROP_BROWSER_CHROME:
+        top = find_chrome_height(image)
+    trim = trim_uniform_border(image.crop((left, top, right, bottom)))
+    crop_box = (left + trim[0], top + trim[1], left + trim[2], top + trim[3])
+    # Never crop away most of the image because of a misdetection
+    if (crop_box[2] - crop_box[0]) * (crop_box[3] - crop_box[1]) < 0.5 * image.width * image.height:
+        crop_box = (0, 0, image.width, image.height)
+
+    prepared = image.crop(crop_box)
+    if max(prepared.size) > ANALYSIS_MAX_EDGE:
+        prepared.thumbnail((ANALYSIS_MAX_EDGE, ANALYSIS_MAX_EDGE), Image.LANCZOS)
+    if prepared.mode != "RGB":
+        prepared = prepared.convert("RGB")
+
+    output = BytesIO()
+    prepared.save(output, "WEBP", quality=ANALYSIS_QUALITY, method=4)
+    prepared_bytes = output.getvalue()
+
+    stats = {
+        "crop": list(crop_box),
+        "width": prepared.width,
+        "height": prepared.height,
+        "original_bytes": original_size,
+        "prepared_bytes": len(prepared_bytes),
+        "original_tokens": estimate_image_tokens(image.width, image.height),
+        "prepared_tokens": estimate_image_tokens(prepared.width, prepared.height)
+    }
+    return prepared_bytes, stats
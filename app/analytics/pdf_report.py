@@ -0,0 +1,249 @@
+import re
+from datetime import datetime
+
+
+def process_markdown_formatting(text):
+    """
+    Comprehensive function to process markdown formatting for PDFs
+    """
+    # First, standardize line endings and clean any existing HTML
+    text = text.replace('\r\n', '\n')
+    text = re.sub(r'<[^>]+>', '', text)
+    
+    # Create a dictionary to store parsed sections with their formatting
+    parsed_sections = []
+    
+    # Process headers first (important to do this before other formatting)
+    lines = text.split('\n')
+    current_paragraph = []
+    
+    for line in lines:
+        line = line.rstrip()
+        
+        # Skip empty lines but add them as paragraph separators
+        if not line.strip():
+            if current_paragraph:
+                parsed_sections.append({
+                    'type': 'paragraph',
+                    'content': ' '.join(current_paragraph),
+                    'format': 'normal'
+                })
+                current_paragraph = []
+            continue
+            
+        # Check for headers
+        header_match = re.match(r'^(#{1,6})\s+(.+)$', line)
+        if header_match:
+            # Add any current paragraph first
+            if current_paragraph:
+                parsed_sections.append({
+                    'type': 'paragraph',
+                    'content': ' '.join(current_paragraph),
+                    'format': 'normal'
+                })
+                current_paragraph = []
+                
+            # Add the header
+            level = len(header_match.group(1))
+            parsed_sections.append({
+                'type': 'header',
+                'content': header_match.group(2),
+                'level': level
+            })
+            continue
+            
+        # Check for bullet points
+        bullet_match = re.match(r'^([\*\-])\s+(.+)$', line)
+        if bullet_match:
+            # Add any current paragraph first
+            if current_paragraph:
+                parsed_sections.append({
+                    'type': 'paragraph',
+                    'content': ' '.join(current_paragraph),
+                    'format': 'normal'
+                })
+                current_paragraph = []
+                
+            # Add the bullet point
+            parsed_sections.append({
+                'type': 'bullet',
+                'content': bullet_match.group(2)
+            })
+            continue
+            
+        # Regular paragraph content
+        current_paragraph.append(line)
+    
+    # Add any remaining paragraph
+    if current_paragraph:
+        parsed_sections.append({
+            'type': 'paragraph',
+            'content': ' '.join(current_paragraph),
+            'format': 'normal'
+        })
+    
+    # Process inline formatting for all sections
+    for section in parsed_sections:
+        content = section['content']
+        
+        # Process bold text
+        content = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', content)
+        
+        # Process italic text - handling both *text* and _text_ formats
+        content = re.sub(r'(?<!\*)\*([^\*]+)\*(?!\*)', r'<i>\1</i>', content)
+        content = re.sub(r'_([^_]+)_', r'<i>\1</i>', content)
+        
+        section['content'] = content
+    
+    return parsed_sections
+
+
+def create_clean_pdf_report(content, analysis_type, image_count, filepath):
+    """
+    Create a cleaner, single-page PDF report with improved formatting.
+    Runs in the report worker processes, see report_jobs.py
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib import colors
+
+    # Create PDF document with minimal margins
+    doc = SimpleDocTemplate(
+        filepath,
+        pagesize=letter,
+        rightMargin=30,
+        leftMargin=30,
+        topMargin=30,
+        bottomMargin=30
+    )
+    
+    # Styles
+    styles = getSampleStyleSheet()
+    
+    # Create custom styles optimized for a single page
+    styles.add(ParagraphStyle(
+        name='CompactTitle',
+        parent=styles['Heading1'],
+        fontSize=14,
+        alignment=TA_CENTER,
+        spaceAfter=2
+    ))
+    styles.add(ParagraphStyle(
+        name='CompactSubtitle',
+        parent=styles['Heading2'],
+        fontSize=8,
+        alignment=TA_CENTER,
+        textColor=colors.darkblue,
+        spaceAfter=6
+    ))
+    styles.add(ParagraphStyle(
+        name='Header1',
+        parent=styles['Heading1'],
+        fontSize=12,
+        textColor=colors.darkblue,
+        spaceBefore=6,
+        spaceAfter=2
+    ))
+    styles.add(ParagraphStyle(
+        name='Header2',
+        parent=styles['Heading2'],
+        fontSize=11,
+        textColor=colors.darkblue,
+        spaceBefore=6,
+        spaceAfter=2
+    ))
+    styles.add(ParagraphStyle(
+        name='Header3',
+        parent=styles['Heading3'],
+        fontSize=10,
+        textColor=colors.darkblue,
+        spaceBefore=4,
+        spaceAfter=1
+    ))
+    styles.add(ParagraphStyle(
+        name='CompactParagraph',
+        parent=styles['Normal'],
+        fontSize=9,
+        spaceBefore=0,
+        spaceAfter=3,
+        leading=11
+    ))
+    styles.add(ParagraphStyle(
+        name='CompactBullet',
+        parent=styles['Normal'],
+        fontSize=9,
+        leftIndent=10,
+        firstLineIndent=0,
+        spaceBefore=0,
+        spaceAfter=1,
+        leading=11,
+        bulletIndent=5
+    ))
+    
+    # Content elements
+    elements = []
+    
+    # Title
+    title_mapping = {
+        "youtube_analytics": "YouTube Analytics Insights",
+        "thumbnail_analysis": "Thumbnail Analysis",
+        "content_strategy": "Content Strategy Insights",
+        "audience_engagement": "Audience Engagement Analysis",
+        "monetization": "Monetization Insights"
+    }
+    title = title_mapping.get(analysis_type, "YouTube Channel Analysis")
+    
+    # Add title and metadata
+    elements.append(Paragraph(title, styles['CompactTitle']))
+    elements.append(Paragraph(f"Generated: {datetime.now().strftime('%b %d, %Y')} | {image_count} screenshots analyzed", 
+                             styles['CompactSubtitle']))
+    
+    # Process the content with improved formatting
+    try:
+        # Parse markdown into structured sections
+        parsed_sections = process_markdown_formatting(content)
+        
+        # Add each section to the PDF with proper formatting
+        for section in parsed_sections:
+            if section['type'] == 'header':
+                # Map header level to appropriate style
+                if section['level'] == 1:
+                    elements.append(Paragraph(section['content'], styles['Header1']))
+                elif section['level'] == 2:
+                    elements.append(Paragraph(section['content'], styles['Header2']))
+                else:
+                    elements.append(Paragraph(section['content'], styles['Header3']))
+            
+            elif section['type'] == 'bullet':
+                elements.append(Paragraph("• " + section['content'], styles['CompactBullet']))
+            
+            elif section['type'] == 'paragraph':
+                elements.append(Paragraph(section['content'], styles['CompactParagraph']))
+        
+        # If no sections were processed, fall back to simple formatting
+        if len(elements) <= 2:  # Only title and subtitle
+            fallback_content = content.replace('**', '<b>').replace('**', '</b>')
+            fallback_content = fallback_content.replace('*', '<i>').replace('*', '</i>')
+            elements.append(Paragraph(fallback_content, styles['CompactParagraph']))
+    
+    except Exception as e:
+        # Fallback to simple text if there's an error in processing
+        print(f"Error processing content: {str(e)}")
+        print("Using fallback formatting")
+        
+        # Strip all HTML/markdown and use plain text
+        plain_text = re.sub(r'<[^>]+>', '', content)
+        plain_text = re.sub(r'[*#_]+', '', plain_text)
+        
+        # Split into paragraphs
+        paragraphs = plain_text.split('\n\n')
+        for para in paragraphs:
+            if para.strip():
+                elements.append(Paragraph(para.strip(), styles['CompactParagraph']))
+    
+    # Build the PDF
+    doc.build(elements)
+    
+    return filepath
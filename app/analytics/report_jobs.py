@@ -0,0 +1,216 @@
+import asyncio
+import glob
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional
+from .analysis_cache import prompt_version
+from .pdf_report import create_clean_pdf_report, process_markdown_formatting
+
+TEMP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "temp")
+REPORT_DIR = os.path.join(TEMP_DIR, "reports")
+os.makedirs(REPORT_DIR, exist_ok=True)
+
+# Processes that render PDFs with reportlab, started on first use
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+# Cached PDFs kept on disk; the least recently downloaded ones are removed first
+REPORT_CACHE_MAX_FILES = int(os.getenv("REPORT_CACHE_MAX_FILES", "50"))
+REPORT_CACHE_TTL_HOURS = float(os.getenv("REPORT_CACHE_TTL_HOURS", "72"))
+REPORT_CLEANUP_INTERVAL = float(os.getenv("REPORT_CLEANUP_INTERVAL", "3600"))
+# Finished job records are forgotten after this long; their PDFs stay cached
+REPORT_JOB_TTL_SECONDS = float(os.getenv("REPORT_JOB_TTL_SECONDS", "3600"))
+
+
+def template_version() -> str:
+    """Version of the PDF layout, part of the cache key of every report"""
+    return prompt_version(create_clean_pdf_report, process_markdown_formatting)
+
+
+class ReportJobs:
+    """
+    Background PDF report jobs. A job awaits the (memoized) Gemini analysis,
+    then renders the PDF in a process pool so reportlab never blocks the
+    event loop. PDFs are cached on disk by a key over analysis type,
+    screenshot set and prompt/template versions: a repeat request for the
+    same report is done immediately, and concurrent requests share one job.
+    Old and excess PDFs, and the per-request files of earlier versions,
+    are deleted periodically.
+    """
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._by_key: Dict[str, str] = {}
+        self._executor = None
+        self._cleaner = None
+        self.stats = {"submitted": 0, "cache_hits": 0, "rendered": 0, "failed": 0, "files_removed": 0}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: workers don't inherit the event loop, Mongo clients or model threads
+            self._executor = ProcessPoolExecutor(max_workers=REPORT_WORKERS,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    @staticmethod
+    def report_path(key: str) -> str:
+        return os.path.join(REPORT_DIR, f"report_{key[:32]}.pdf")
+
+    def cached_report(self, key: str) -> Optional[str]:
+        path = self.report_path(key)
+        if not os.path.exists(path):
+            return None
+        # mtime records the last use, for least-recently-used eviction
+        os.utime(path)
+        return path
+
+    def submit(self, key: str, analysis_type: str, analyze: Callable[[], Awaitable[dict]],
+               refresh: bool = False) -> dict:
+        """
+        Start (or join) the job for a report. `analyze` returns the analysis
+        result ({"insights", "image_count", ...}) and is only called when the
+        PDF isn't cached.
+        """
+        existing = self._jobs.get(self._by_key.get(key))
+        if existing and existing["status"] not in ("done", "failed"):
+            return existing
+        if existing and existing["status"] == "done" and not refresh and self.cached_report(key):
+            return existing
+
+        self.stats["submitted"] += 1
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "key": key,
+            "analysis_type": analysis_type,
+            "status": "queued",
+            "cached": False,
+            "image_count": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None
+        }
+        self._jobs[job_id] = job
+        self._by_key[key] = job_id
+
+        if not refresh and self.cached_report(key):
+            self.stats["cache_hits"] += 1
+            job.update(status="done", cached=True, finished_at=time.time())
+        else:
+            task = asyncio.create_task(self._run(job, analyze))
+            self._tasks[job_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return job
+
+    async def _run(self, job: dict, analyze: Callable[[], Awaitable[dict]]):
+        start = time.perf_counter()
+        try:
+            job["status"] = "analyzing"
+            result = await analyze()
+            job["image_count"] = result["image_count"]
+            job["cached"] = result.get("cached", False)
+
+            job["status"] = "rendering"
+            path = self.report_path(job["key"])
+            tmp_path = f"{path}.{job['job_id']}.tmp"
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._pool(), create_clean_pdf_report, result["insights"],
+                                       job["analysis_type"], result["image_count"], tmp_path)
+            os.replace(tmp_path, path)
+
+            job.update(status="done", finished_at=time.time())
+            self.stats["rendered"] += 1
+            print(f"Report job {job['job_id']} done in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            job.update(status="failed", error=getattr(e, "detail", None) or str(e), finished_at=time.time())
+            self.stats["failed"] += 1
+            print(f"Report job {job['job_id']} failed: {job['error']}")
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id: str) -> dict:
+        """Wait for a job to finish and return it"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.shield(task)
+        return self._jobs[job_id]
+
+    def public(self, job: dict) -> dict:
+        return {k: v for k, v in job.items() if k != "key"}
+
+    def cleanup(self) -> int:
+        """Delete expired or excess cached PDFs and forget old finished jobs"""
+        now = time.time()
+        active = {self.report_path(job["key"]) for job in self._jobs.values()
+                  if job["status"] not in ("done", "failed")}
+        removed = 0
+
+        # Files from before reports were cached were written once per request and never reused
+        stale = glob.glob(os.path.join(TEMP_DIR, "youtube_report_*.pdf"))
+        stale += [path for path in glob.glob(os.path.join(REPORT_DIR, "*.tmp"))
+                  if now - os.path.getmtime(path) > REPORT_CACHE_TTL_HOURS * 3600]
+
+        reports = sorted(glob.glob(os.path.join(REPORT_DIR, "report_*.pdf")), key=os.path.getmtime, reverse=True)
+        for i, path in enumerate(reports):
+            if path in active:
+                continue
+            if i >= REPORT_CACHE_MAX_FILES or now - os.path.getmtime(path) > REPORT_CACHE_TTL_HOURS * 3600:
+                stale.append(path)
+
+        for path in stale:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+
+        for job_id, job in list(self._jobs.items()):
+            if job["finished_at"] and now - job["finished_at"] > REPORT_JOB_TTL_SECONDS:
+                del self._jobs[job_id]
+                if self._by_key.get(job["key"]) == job_id:
+                    del self._by_key[job["key"]]
+
+        self.stats["files_removed"] += removed
+        if removed:
+            print(f"Report cleanup removed {removed} files")
+        return removed
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                self.cleanup()
+            except Exception as e:
+                print(f"Report cleanup failed: {str(e)}")
+            await asyncio.sleep(REPORT_CLEANUP_INTERVAL)
+
+    def start_cleaner(self):
+        if self._cleaner is None:
+            self._cleaner = asyncio.create_task(self._cleanup_loop())
+
+    async def stop(self):
+        if self._cleaner is not None:
+            self._cleaner.cancel()
+            try:
+                await self._cleaner
+            except asyncio.CancelledError:
+                pass
+            self._cleaner = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> dict:
+        statuses = {}
+        for job in self._jobs.values():
+            statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+        return {
+            **self.stats,
+            "jobs": statuses,
+            "cached_files": len(glob.glob(os.path.join(REPORT_DIR, "report_*.pdf"))),
+            "workers": REPORT_WORKERS
+        }
+
+
+report_jobs = ReportJobs()
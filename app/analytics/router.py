@@ -1,38 +1,56 @@
 from fastapi import APIRouter, Body, HTTPException, Query
-from fastapi.responses import FileResponse
-from typing import List, Optional
+from fastapi.responses import FileResponse, RedirectResponse, Response, StreamingResponse
+from typing import List, Literal, Optional
+import asyncio
 import base64
-from io import BytesIO
-import requests
-import google.generativeai as genai
-from PIL import Image
+import json
 import os
-import re
+import time
 from dotenv import load_dotenv
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_LEFT
-from reportlab.lib import colors
-import uuid
 import markdown
 from datetime import datetime
-from .schemas import ScreenshotModel, ScreenshotResponse, BatchAnalysisRequest, SimpleAnalysisResponse
-from .crud import add_screenshot, retrieve_screenshots
+from .schemas import (ScreenshotModel, ScreenshotResponse, BatchAnalysisRequest, SimpleAnalysisResponse,
+                      ReportJobRequest)
+from .crud import (add_screenshot, retrieve_screenshots, get_screenshot_storage,
+                   get_screenshot_preview, stream_gridfs_image, get_prep_savings)
+from .image_prep import PREVIEW_CONTENT_TYPE, is_image_url, split_data_url
+from .image_decode import decode_screenshots, decoded_images
+from .url_fetcher import url_fetcher
+from .screenshot_index import RAG_QUERY_EXTRACTION_LIMIT, screenshot_index
+from .analysis_cache import analysis_cache, analysis_key, prompt_version
+from .window_summaries import get_window_summaries, split_windows, summarize_batches, window_version
+from .shard_runner import shard_runner, split_shards
+from .gemini_client import GEMINI_API_KEY, gemini
+from .report_jobs import report_jobs, template_version
 
 # Load environment variables
 load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 TEMP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "temp")
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+ANALYSIS_MODEL = 'gemini-2.0-flash'
+# Screenshots attached to a retrieval answer when include_images is set
+RAG_MAX_IMAGES = int(os.getenv("RAG_MAX_IMAGES", "3"))
+# History covered by analyze-comprehensive; older windows are summarized once and stored
+COMPREHENSIVE_MAX_SCREENSHOTS = int(os.getenv("COMPREHENSIVE_MAX_SCREENSHOTS", "500"))
+# analyze-recent takes up to 10 screenshots in one call, more when sharded
+SHARDED_MAX_SCREENSHOTS = int(os.getenv("SHARDED_MAX_SCREENSHOTS", "200"))
+
 router = APIRouter(prefix="/analytics", tags=["Analytics APIs"])
 
+# Fire-and-forget tasks are referenced until done so they aren't garbage collected mid-run
+_background_tasks = set()
+
 @router.post("/screenshots", response_model=ScreenshotResponse)
 async def save_screenshot(screenshot: ScreenshotModel = Body(...)):
     """Save a screenshot to MongoDB"""
     try:
         result = await add_screenshot(screenshot)
+        if GEMINI_API_KEY:
+            # Extract the screenshot's text for retrieval while nobody is waiting on it
+            task = asyncio.create_task(screenshot_index.index_screenshots([result]))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
         return {"success": True, "id": result["id"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving screenshot: {str(e)}")
@@ -45,6 +63,172 @@ async def get_screenshots(limit: int = 10):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving screenshots: {str(e)}")
 
+IMMUTABLE_CACHE = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+@router.get("/screenshots/{screenshot_id}/image")
+async def get_screenshot_image(screenshot_id: str):
+    """Original screenshot bytes; large GridFS images are streamed in chunks"""
+    doc = await get_screenshot_storage(screenshot_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+
+    content_type = doc.get("content_type") or "application/octet-stream"
+    storage = doc.get("storage")
+    if storage == "gridfs":
+        return StreamingResponse(stream_gridfs_image(doc["gridfs_id"]), media_type=content_type, headers=IMMUTABLE_CACHE)
+    if storage == "binary":
+        return Response(content=bytes(doc["image_data"]), media_type=content_type, headers=IMMUTABLE_CACHE)
+    if storage == "url":
+        return RedirectResponse(doc["source_url"])
+
+    # Documents saved before binary storage keep a data URL or image URL in "image"
+    image_data = doc.get("image") or ""
+    if is_image_url(image_data):
+        return RedirectResponse(image_data)
+    declared_type, payload = split_data_url(image_data)
+    try:
+        image_bytes = base64.b64decode(payload)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Stored image could not be decoded")
+    return Response(content=image_bytes, media_type=declared_type or "image/png", headers=IMMUTABLE_CACHE)
+
+@router.get("/screenshots/{screenshot_id}/preview")
+async def get_screenshot_preview_image(screenshot_id: str):
+    """Small WebP preview for list views"""
+    try:
+        preview = await get_screenshot_preview(screenshot_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating preview: {str(e)}")
+    if preview is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    return Response(content=preview, media_type=PREVIEW_CONTENT_TYPE, headers=IMMUTABLE_CACHE)
+
+@router.get("/image-prep/stats")
+async def image_prep_stats():
+    """Bytes and estimated Gemini image tokens saved by preparing screenshots at ingestion"""
+    try:
+        return await get_prep_savings()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing image prep stats: {str(e)}")
+
+@router.get("/rag-index/stats")
+async def rag_index_stats():
+    """Screenshots and chunks in the retrieval index"""
+    return screenshot_index.get_stats()
+
+@router.get("/decode-cache/stats")
+async def decode_cache_stats():
+    """Hit rate and memory use of the decoded screenshot cache, and URL fetch totals"""
+    return {**decoded_images.stats(), "url_fetcher": url_fetcher.get_stats()}
+
+@router.get("/analysis-cache/stats")
+async def analysis_cache_stats():
+    return analysis_cache.stats()
+
+@router.get("/shard-runner/stats")
+async def shard_runner_stats():
+    return shard_runner.get_stats()
+
+@router.get("/gemini/stats")
+async def gemini_stats():
+    return gemini.get_stats()
+
+def analysis_version(analyze_fn) -> str:
+    """
+    Prompt version of a multi-image analysis: its source and the module-level
+    prompt templates it reads (listed in REDUCE_PROMPTS by function name)
+    """
+    return prompt_version(analyze_fn, REDUCE_PROMPTS[analyze_fn.__name__])
+
+async def run_analysis(analyze_fn, screenshots: List[dict], analysis_type: str, refresh: bool = False) -> dict:
+    """
+    Run a multi-image Gemini analysis over the screenshots, memoized by
+    (analysis function, analysis_type, ordered screenshot ids, prompt
+    version, model). A stored result is returned without decoding anything.
+    """
+    key = analysis_key(analyze_fn.__name__, analysis_type, [s["id"] for s in screenshots],
+                       analysis_version(analyze_fn), ANALYSIS_MODEL)
+
+    async def compute():
+        # Decode images (cached by screenshot id, misses decoded in the thread pool)
+        processed_images, image_metadata = await decode_screenshots(screenshots)
+        if not processed_images:
+            raise HTTPException(status_code=400, detail="None of the screenshots could be processed")
+        insights = await analyze_fn(processed_images, image_metadata, analysis_type)
+        return {
+            "insights": insights,
+            "image_count": len(processed_images),
+            "image_ids": [meta["id"] for meta in image_metadata]
+        }
+
+    result, cached = await analysis_cache.get_or_compute(
+        key, compute, refresh=refresh, kind=analyze_fn.__name__, analysis_type=analysis_type)
+    return {**result, "cached": cached}
+
+async def run_sharded_analysis(analyze_fn, screenshots: List[dict], analysis_type: str, refresh: bool = False) -> dict:
+    """
+    Sharded version of run_analysis: the screenshots are split into
+    chronological shards that are summarized concurrently (bounded by the
+    shard runner's concurrency and rate limit), then one reduce call merges
+    the shard summaries in the format of analyze_fn. Latency is roughly one
+    shard plus the reduce instead of one call over every image.
+    """
+    shards = split_shards(screenshots)
+    if len(shards) <= 1:
+        return await run_analysis(analyze_fn, screenshots, analysis_type, refresh)
+
+    kind = f"{analyze_fn.__name__}_sharded"
+    version = prompt_version(analysis_version(analyze_fn), reduce_report, window_version(), len(shards[0]))
+    key = analysis_key(kind, analysis_type, [s["id"] for s in screenshots], version, ANALYSIS_MODEL)
+
+    async def compute():
+        summaries = [summary for summary in
+                     await summarize_batches(shards, analysis_type, ANALYSIS_MODEL) if summary]
+        if not summaries:
+            raise HTTPException(status_code=400, detail="None of the screenshots could be processed")
+        insights = await reduce_report(summaries, [], [], analysis_type, analyze_fn.__name__)
+        return {
+            "insights": insights,
+            "image_count": sum(len(summary["image_ids"]) for summary in summaries),
+            "image_ids": [image_id for summary in summaries for image_id in summary["image_ids"]],
+            "shards": len(shards),
+            "failed_shards": len(shards) - len(summaries)
+        }
+
+    result, cached = await analysis_cache.get_or_compute(
+        key, compute, refresh=refresh, kind=kind, analysis_type=analysis_type)
+    return {**result, "cached": cached}
+
+async def run_incremental_comprehensive(screenshots: List[dict], analysis_type: str, refresh: bool = False) -> dict:
+    """
+    Comprehensive report as a reduce over per-window summaries. Sealed
+    windows (a full batch, or a day that is over) are summarized once and
+    stored; only screenshots of the open window are sent as images. The
+    reduce itself is memoized like run_analysis.
+    """
+    sealed, open_window = split_windows(screenshots)
+    version = prompt_version(reduce_report, REDUCE_PROMPTS["analyze_all_images_comprehensive"], window_version())
+    key = analysis_key("comprehensive_incremental", analysis_type, [s["id"] for s in screenshots],
+                       version, ANALYSIS_MODEL)
+
+    async def compute():
+        summaries = await get_window_summaries(sealed, analysis_type, ANALYSIS_MODEL)
+        images, metadata = await decode_screenshots(open_window) if open_window else ([], [])
+        if not summaries and not images:
+            raise HTTPException(status_code=400, detail="None of the screenshots could be processed")
+        insights = await reduce_report(summaries, images, metadata, analysis_type)
+        return {
+            "insights": insights,
+            "image_count": sum(len(summary["image_ids"]) for summary in summaries) + len(images),
+            "image_ids": [image_id for summary in summaries for image_id in summary["image_ids"]]
+                         + [meta["id"] for meta in metadata],
+            "summarized_windows": len(summaries)
+        }
+
+    result, cached = await analysis_cache.get_or_compute(
+        key, compute, refresh=refresh, kind="comprehensive_incremental", analysis_type=analysis_type)
+    return {**result, "cached": cached}
+
 @router.post("/analyze-recent", response_model=SimpleAnalysisResponse)
 async def analyze_recent_images(analysis_request: BatchAnalysisRequest = Body(...)):
     """
@@ -57,72 +241,29 @@ async def analyze_recent_images(analysis_request: BatchAnalysisRequest = Body(..
             raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
         
         # Get the most recent screenshots
-        count = min(analysis_request.count, 10)  # Limit to 10 to prevent abuse
+        sharded = analysis_request.mode == "sharded"
+        count = min(analysis_request.count, SHARDED_MAX_SCREENSHOTS if sharded else 10)  # Limit to prevent abuse
         recent_screenshots = await retrieve_screenshots(count)
         
         if not recent_screenshots:
             raise HTTPException(status_code=404, detail="No screenshots found")
         
-        # Process images for Gemini
-        processed_images = []
-        image_metadata = []
-        
-        for screenshot in recent_screenshots:
-            try:
-                # Get image data
-                image_data = screenshot.get("image")
-                if not image_data:
-                    continue
-                
-                # Check if image is base64 encoded
-                if isinstance(image_data, str) and image_data.startswith('data:image'):
-                    # Extract the base64 part
-                    image_data = image_data.split(',')[1]
-                
-                # Convert base64 to bytes
-                try:
-                    image_bytes = BytesIO(base64.b64decode(image_data))
-                except Exception as e:
-                    # If not base64, try to get image from URL
-                    try:
-                        response = requests.get(image_data)
-                        response.raise_for_status()
-                        image_bytes = BytesIO(response.content)
-                    except Exception as url_error:
-                        continue
-                
-                # Add image to processed images
-                processed_images.append(Image.open(image_bytes))
-                
-                # Add metadata
-                image_metadata.append({
-                    "id": screenshot.get("id"),
-                    "timestamp": screenshot.get("timestamp"),
-                    "source": screenshot.get("source", "YouTube Studio")
-                })
-                
-            except Exception as img_error:
-                print(f"Error processing image {screenshot.get('id')}: {str(img_error)}")
-                continue
-        
-        if not processed_images:
-            raise HTTPException(status_code=400, detail="None of the screenshots could be processed")
-        
-        # Get a single comprehensive analysis from Gemini
-        insights = analyze_multiple_images(
-            processed_images,
-            image_metadata,
+        # Get a single comprehensive analysis from Gemini (or the stored one for these screenshots)
+        result = await (run_sharded_analysis if sharded else run_analysis)(
+            analyze_multiple_images,
+            recent_screenshots,
             analysis_request.analysis_type,
-            GEMINI_API_KEY
+            analysis_request.refresh
         )
         
         # Format the response
         return {
-            "image_count": len(processed_images),
+            "image_count": result["image_count"],
             "analysis_type": analysis_request.analysis_type,
-            "insights": insights,
-            "image_ids": [meta["id"] for meta in image_metadata],
-            "success": True
+            "insights": result["insights"],
+            "image_ids": result["image_ids"],
+            "success": True,
+            "cached": result["cached"]
         }
         
     except Exception as e:
@@ -139,79 +280,73 @@ async def analyze_all_images(analysis_request: BatchAnalysisRequest = Body(...))
         if not GEMINI_API_KEY:
             raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
         
-        # Get all screenshots from database instead of just recent ones
-        all_screenshots = await retrieve_screenshots(limit=10)  # Set high limit to get all images
+        # Get the screenshot history, summarized incrementally in windows
+        all_screenshots = await retrieve_screenshots(limit=COMPREHENSIVE_MAX_SCREENSHOTS)
         
         if not all_screenshots:
             raise HTTPException(status_code=404, detail="No screenshots found")
         
-        # Process images for Gemini
-        processed_images = []
-        image_metadata = []
-        
-        for screenshot in all_screenshots:
-            try:
-                # Get image data
-                image_data = screenshot.get("image")
-                if not image_data:
-                    continue
-                
-                # Check if image is base64 encoded
-                if isinstance(image_data, str) and image_data.startswith('data:image'):
-                    # Extract the base64 part
-                    image_data = image_data.split(',')[1]
-                
-                # Convert base64 to bytes
-                try:
-                    image_bytes = BytesIO(base64.b64decode(image_data))
-                except Exception as e:
-                    # If not base64, try to get image from URL
-                    try:
-                        response = requests.get(image_data)
-                        response.raise_for_status()
-                        image_bytes = BytesIO(response.content)
-                    except Exception as url_error:
-                        continue
-                
-                # Add image to processed images
-                processed_images.append(Image.open(image_bytes))
-                
-                # Add metadata
-                image_metadata.append({
-                    "id": screenshot.get("id"),
-                    "timestamp": screenshot.get("timestamp"),
-                    "source": screenshot.get("source", "YouTube Studio")
-                })
-                
-            except Exception as img_error:
-                print(f"Error processing image {screenshot.get('id')}: {str(img_error)}")
-                continue
-        
-        if not processed_images:
-            raise HTTPException(status_code=400, detail="None of the screenshots could be processed")
-        
-        # Get a comprehensive analysis from Gemini
-        insights = analyze_all_images_comprehensive(
-            processed_images,
-            image_metadata,
+        # Reduce over stored window summaries plus the not yet summarized screenshots
+        result = await run_incremental_comprehensive(
+            all_screenshots,
             analysis_request.analysis_type,
-            GEMINI_API_KEY
+            analysis_request.refresh
         )
         
         # Format the response
         return {
-            "image_count": len(processed_images),
+            "image_count": result["image_count"],
             "analysis_type": analysis_request.analysis_type,
-            "insights": insights,
-            "image_ids": [meta["id"] for meta in image_metadata],
-            "success": True
+            "insights": result["insights"],
+            "image_ids": result["image_ids"],
+            "success": True,
+            "cached": result["cached"]
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error analyzing images: {str(e)}")
 
+async def build_chat_request(query: str, screenshots: List[dict], analysis_type: str, include_images: bool):
+    """
+    Gemini request parts for a chat query and the metadata sent with the
+    answer: the top-k retrieved chunks when the index has any, otherwise
+    every screenshot as an image. Used by the streaming and non-streaming
+    chat endpoints alike.
+    """
+    # Screenshots are extracted once, normally at upload; a query only waits for the newest few
+    await screenshot_index.index_screenshots(screenshots, wait_for=RAG_QUERY_EXTRACTION_LIMIT)
+    chunks = await screenshot_index.search(query, screenshot_ids=[s["id"] for s in screenshots])
+    if chunks:
+        images, image_metadata = [], []
+        if include_images:
+            source_ids = list(dict.fromkeys(chunk["screenshot_id"] for chunk in chunks))[:RAG_MAX_IMAGES]
+            images, image_metadata = await decode_screenshots([s for s in screenshots if s["id"] in source_ids])
+        return rag_chunks_request(query, chunks, images, analysis_type), {
+            "context_images": len(images),
+            "context_chunks": len(chunks),
+            "sources": list(dict.fromkeys(chunk["screenshot_id"] for chunk in chunks)),
+            "image_ids": [meta["id"] for meta in image_metadata]
+        }
+
+    processed_images, image_metadata = await decode_screenshots(screenshots)
+    if not processed_images:
+        raise HTTPException(status_code=400, detail="No images available to process for context")
+    return rag_chatbot_request(query, processed_images, image_metadata, analysis_type), {
+        "context_images": len(processed_images),
+        "context_chunks": 0,
+        "sources": [meta["id"] for meta in image_metadata],
+        "image_ids": [meta["id"] for meta in image_metadata]
+    }
+
+async def answer_chat_query(query: str, screenshots: List[dict], analysis_type: str, include_images: bool) -> dict:
+    """Non-streaming chat answer, from the same request as the streaming endpoints"""
+    request_parts, context = await build_chat_request(query, screenshots, analysis_type, include_images)
+    response = await gemini.generate(request_parts, model=ANALYSIS_MODEL)
+    return {"query": query, "response": response, **context, "success": True}
+
 @router.post("/chatbot-query", response_model=dict)
-async def chatbot_query(query: str = Body(..., embed=True), analysis_type: Optional[str] = Body("youtube_analytics")):
+async def chatbot_query(query: str = Body(..., embed=True), analysis_type: Optional[str] = Body("youtube_analytics"),
+                        include_images: bool = Body(False)):
     """
     RAG-based chatbot that uses the analyzed YouTube data to answer user queries
     """
@@ -226,163 +361,123 @@ async def chatbot_query(query: str = Body(..., embed=True), analysis_type: Optio
         if not all_screenshots:
             raise HTTPException(status_code=404, detail="No screenshots found to use as context")
         
-        # Process images
-        processed_images = []
-        image_metadata = []
-        
-        for screenshot in all_screenshots:
-            try:
-                # Get image data
-                image_data = screenshot.get("image")
-                if not image_data:
-                    continue
-                
-                # Check if image is base64 encoded
-                if isinstance(image_data, str) and image_data.startswith('data:image'):
-                    # Extract the base64 part
-                    image_data = image_data.split(',')[1]
-                
-                # Convert base64 to bytes
-                try:
-                    image_bytes = BytesIO(base64.b64decode(image_data))
-                except Exception as e:
-                    # If not base64, try to get image from URL
-                    try:
-                        response = requests.get(image_data)
-                        response.raise_for_status()
-                        image_bytes = BytesIO(response.content)
-                    except Exception as url_error:
-                        continue
-                
-                # Add image to processed images
-                processed_images.append(Image.open(image_bytes))
-                
-                # Add metadata
-                image_metadata.append({
-                    "id": screenshot.get("id"),
-                    "timestamp": screenshot.get("timestamp"),
-                    "source": screenshot.get("source", "YouTube Studio")
-                })
-                
-            except Exception as img_error:
-                print(f"Error processing image {screenshot.get('id')}: {str(img_error)}")
-                continue
-        
-        if not processed_images:
-            raise HTTPException(status_code=400, detail="No images available to process for context")
-        
-        # Use the RAG approach to answer the query
-        response = rag_chatbot_response(
-            query,
-            processed_images,
-            image_metadata,
-            analysis_type,
-            GEMINI_API_KEY
-        )
-        
-        return {
-            "query": query,
-            "response": response,
-            "context_images": len(processed_images),
-            "success": True
-        }
+        # Answer from the retrieved chunks, or every image if nothing is indexed
+        return await answer_chat_query(query, all_screenshots, analysis_type, include_images)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing chatbot query: {str(e)}")
 
+async def submit_report_job(analysis_type: str, refresh: bool = False, mode: str = "single") -> dict:
+    """
+    Start (or join) the background job for a one-page PDF report of the
+    latest screenshots. The PDF is cached by analysis type, screenshot set,
+    prompt version and PDF template version.
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
+
+    # Get screenshots from database (limit to 30 for better performance and concise analysis)
+    all_screenshots = await retrieve_screenshots(limit=30)
+    if not all_screenshots:
+        raise HTTPException(status_code=404, detail="No screenshots found")
+
+    sharded = mode == "sharded"
+    run = run_sharded_analysis if sharded else run_analysis
+    version = prompt_version(analysis_version(analyze_images_one_page),
+                             *([reduce_report, window_version()] if sharded else []), template_version())
+    key = analysis_key(f"pdf_report_{mode}", analysis_type, [s["id"] for s in all_screenshots],
+                       version, ANALYSIS_MODEL)
+
+    # Get a concise one-page analysis from Gemini (or the stored one for these screenshots)
+    return report_jobs.submit(
+        key, analysis_type,
+        lambda: run(analyze_images_one_page, all_screenshots, analysis_type, refresh),
+        refresh=refresh
+    )
+
+def report_job_response(job: dict) -> dict:
+    return {
+        **report_jobs.public(job),
+        "status_url": f"/analytics/reports/{job['job_id']}",
+        "download_url": f"/analytics/reports/{job['job_id']}/download"
+    }
+
+def report_file_response(job: dict) -> FileResponse:
+    pdf_path = report_jobs.cached_report(job["key"])
+    if not pdf_path:
+        raise HTTPException(status_code=410, detail="Report file has expired, submit the report again")
+
+    # Create a readable filename for the report
+    report_type_name = job["analysis_type"].replace("_", "-")
+    readable_date = datetime.fromtimestamp(job["finished_at"]).strftime('%b-%d-%Y')
+    download_filename = f"YT-{report_type_name}-report-{readable_date}.pdf"
+
+    # Return the PDF file for download
+    return FileResponse(
+        path=pdf_path,
+        filename=download_filename,
+        media_type="application/pdf"
+    )
+
+@router.post("/reports", response_model=dict)
+async def create_report_job(report_request: ReportJobRequest = Body(...)):
+    """
+    Start generating a one-page PDF report in the background. Poll the
+    status URL, then fetch the download URL once the status is "done".
+    A report that is already cached is done immediately.
+    """
+    try:
+        job = await submit_report_job(report_request.analysis_type, report_request.refresh, report_request.mode)
+        return report_job_response(job)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error starting report: {str(e)}")
+
+@router.get("/reports/stats")
+async def report_job_stats():
+    return report_jobs.get_stats()
+
+@router.get("/reports/{job_id}", response_model=dict)
+async def get_report_job(job_id: str):
+    job = report_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return report_job_response(job)
+
+@router.get("/reports/{job_id}/download", response_class=FileResponse)
+async def download_report(job_id: str):
+    job = report_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Error generating report: {job['error']}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Report is not ready yet (status: {job['status']})")
+    return report_file_response(job)
+
 @router.get("/generate-report", response_class=FileResponse)
-async def generate_pdf_report(analysis_type: str = "youtube_analytics"):
+async def generate_pdf_report(analysis_type: str = "youtube_analytics", refresh: bool = False,
+                              mode: Literal["single", "sharded"] = "single"):
     """
-    Generate a clean one-page PDF report from all screenshots without requiring any parameters
+    Generate a clean one-page PDF report from all screenshots without requiring any parameters.
+    Waits for the report job; use POST /reports to generate without holding the request open.
     """
     try:
-        # Validate API key
-        if not GEMINI_API_KEY:
-            raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
-        
-        # Get screenshots from database (limit to 30 for better performance and concise analysis)
-        all_screenshots = await retrieve_screenshots(limit=30)
-        
-        if not all_screenshots:
-            raise HTTPException(status_code=404, detail="No screenshots found")
-        
-        # Process images for Gemini
-        processed_images = []
-        image_metadata = []
-        
-        for screenshot in all_screenshots:
-            try:
-                # Get image data
-                image_data = screenshot.get("image")
-                if not image_data:
-                    continue
-                
-                # Check if image is base64 encoded
-                if isinstance(image_data, str) and image_data.startswith('data:image'):
-                    # Extract the base64 part
-                    image_data = image_data.split(',')[1]
-                
-                # Convert base64 to bytes
-                try:
-                    image_bytes = BytesIO(base64.b64decode(image_data))
-                except Exception as e:
-                    # If not base64, try to get image from URL
-                    try:
-                        response = requests.get(image_data)
-                        response.raise_for_status()
-                        image_bytes = BytesIO(response.content)
-                    except Exception as url_error:
-                        continue
-                
-                # Add image to processed images
-                processed_images.append(Image.open(image_bytes))
-                
-                # Add metadata
-                image_metadata.append({
-                    "id": screenshot.get("id"),
-                    "timestamp": screenshot.get("timestamp"),
-                    "source": screenshot.get("source", "YouTube Studio")
-                })
-                
-            except Exception as img_error:
-                print(f"Error processing image {screenshot.get('id')}: {str(img_error)}")
-                continue
-        
-        if not processed_images:
-            raise HTTPException(status_code=400, detail="None of the screenshots could be processed")
-        
-        # Get a concise one-page analysis from Gemini
-        insights = analyze_images_one_page(
-            processed_images,
-            image_metadata,
-            analysis_type,
-            GEMINI_API_KEY
-        )
-        
-        # Generate clean PDF from insights
-        pdf_path = create_clean_pdf_report(
-            insights, 
-            analysis_type,
-            len(processed_images)
-        )
-        
-        # Create a readable filename for the report
-        report_type_name = analysis_type.replace("_", "-")
-        readable_date = datetime.now().strftime('%b-%d-%Y')
-        download_filename = f"YT-{report_type_name}-report-{readable_date}.pdf"
-        
-        # Return the PDF file for download
-        return FileResponse(
-            path=pdf_path,
-            filename=download_filename,
-            media_type="application/pdf"
-        )
-        
+        job = await submit_report_job(analysis_type, refresh, mode)
+        job = await report_jobs.wait(job["job_id"])
+        if job["status"] == "failed":
+            raise HTTPException(status_code=500, detail=f"Error generating report: {job['error']}")
+        return report_file_response(job)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
 
 @router.post("/rag-chat", response_model=dict)
-async def rag_chat(query: str = Body(...), analysis_type: Optional[str] = Query("youtube_analytics")):
+async def rag_chat(query: str = Body(...), analysis_type: Optional[str] = Query("youtube_analytics"),
+                   include_images: bool = Query(False)):
     """
     RAG-based chatbot that uses YouTube analytics screenshots as knowledge base
     """
@@ -397,97 +492,87 @@ async def rag_chat(query: str = Body(...), analysis_type: Optional[str] = Query(
         if not all_screenshots:
             raise HTTPException(status_code=404, detail="No screenshots found to use as context")
         
-        # Process images
-        processed_images = []
-        image_metadata = []
-        
-        for screenshot in all_screenshots:
-            try:
-                # Get image data
-                image_data = screenshot.get("image")
-                if not image_data:
-                    continue
-                
-                # Check if image is base64 encoded
-                if isinstance(image_data, str) and image_data.startswith('data:image'):
-                    # Extract the base64 part
-                    image_data = image_data.split(',')[1]
-                
-                # Convert base64 to bytes
-                try:
-                    image_bytes = BytesIO(base64.b64decode(image_data))
-                except Exception as e:
-                    # If not base64, try to get image from URL
-                    try:
-                        response = requests.get(image_data)
-                        response.raise_for_status()
-                        image_bytes = BytesIO(response.content)
-                    except Exception as url_error:
-                        continue
-                
-                # Add image to processed images
-                processed_images.append(Image.open(image_bytes))
-                
-                # Add metadata
-                image_metadata.append({
-                    "id": screenshot.get("id"),
-                    "timestamp": screenshot.get("timestamp"),
-                    "source": screenshot.get("source", "YouTube Studio")
-                })
-                
-            except Exception as img_error:
-                print(f"Error processing image {screenshot.get('id')}: {str(img_error)}")
-                continue
-        
-        if not processed_images:
-            raise HTTPException(status_code=400, detail="No images available to process for context")
-        
-        # Use the RAG approach to answer the query
-        response = rag_chatbot_response(
-            query,
-            processed_images,
-            image_metadata,
-            analysis_type,
-            GEMINI_API_KEY
-        )
-        
-        return {
-            "query": query,
-            "response": response,
-            "context_images": len(processed_images),
-            "success": True
-        }
+        # Answer from the retrieved chunks, or every image if nothing is indexed
+        return await answer_chat_query(query, all_screenshots, analysis_type, include_images)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing chatbot query: {str(e)}")
 
-def analyze_multiple_images(images, metadata, analysis_type, api_key):
-    """Send multiple images to Gemini API for a single comprehensive analysis"""
-    # Configure the API
-    genai.configure(api_key=api_key)
+def sse_event(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
 
-    # Create a model instance
-    model = genai.GenerativeModel('gemini-2.0-flash')
+async def stream_chat_answer(query: str, screenshot_limit: int, analysis_type: str, include_images: bool):
+    """
+    Server-sent events for a chat answer: {"type": "token", "text"} as
+    Gemini generates, then {"type": "done", ...context metadata} or
+    {"type": "error", "detail"}. Context is gathered before the response
+    starts so lookup errors still get a proper status code.
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
+
+    screenshots = await retrieve_screenshots(limit=screenshot_limit)
+    if not screenshots:
+        raise HTTPException(status_code=404, detail="No screenshots found to use as context")
+
+    request_parts, context = await build_chat_request(query, screenshots, analysis_type, include_images)
+
+    async def events():
+        start = time.perf_counter()
+        first_token = None
+        try:
+            async for text in gemini.stream(request_parts, model=ANALYSIS_MODEL):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                    print(f"First chat token after {first_token:.2f}s")
+                yield sse_event({"type": "token", "text": text})
+        except Exception as e:
+            yield sse_event({"type": "error", "detail": f"Error processing chatbot query: {str(e)}"})
+            return
+        yield sse_event({"type": "done", "query": query, **context, "success": True})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/chatbot-query/stream")
+async def chatbot_query_stream(query: str = Body(..., embed=True), analysis_type: Optional[str] = Body("youtube_analytics"),
+                               include_images: bool = Body(False)):
+    """
+    Streaming variant of /chatbot-query: the answer is sent token by token
+    as server-sent events, followed by a closing "done" event
+    """
+    return await stream_chat_answer(query, 100, analysis_type, include_images)
 
-    # Prepare the prompt based on analysis type
-    prompt_templates = {
-        "youtube_analytics": "I'm showing you {count} YouTube analytics screenshots from my channel. Analyze these screenshots together to provide a comprehensive understanding of my channel performance. Identify key metrics, trends, opportunities, and what's working vs. what needs improvement. Give me actionable insights to improve my channel.",
-        
-        "thumbnail_analysis": "I'm showing you {count} YouTube thumbnails from my channel. Analyze these thumbnails together to evaluate their design consistency, appeal, clickability, and effectiveness. Identify strengths, weaknesses, and provide specific suggestions to improve my thumbnail strategy.",
-        
-        "content_strategy": "I'm showing you {count} screenshots from YouTube Studio related to my content strategy. Analyze these images collectively to provide insights on what's working well in my content approach and what could be improved. Give me specific recommendations to optimize my content strategy.",
-        
-        "audience_engagement": "I'm showing you {count} audience engagement screenshots from YouTube. Analyze these collectively to identify patterns in viewer behavior, engagement trends, and opportunities for improvement. Provide actionable advice to increase my audience engagement.",
-        
-        "monetization": "I'm showing you {count} YouTube monetization data screenshots. Analyze these together to identify revenue patterns, opportunities, and strategies for optimization. What's working well and what could be improved to maximize my revenue?",
-        
-        "competitor_analysis": "I'm showing you {count} screenshots from competitor YouTube channels. Analyze these collectively to identify their strategies, strengths, and weaknesses. What can I learn from them to improve my own channel?"
-    }
+@router.post("/rag-chat/stream")
+async def rag_chat_stream(query: str = Body(...), analysis_type: Optional[str] = Query("youtube_analytics"),
+                          include_images: bool = Query(False)):
+    """
+    Streaming variant of /rag-chat: the answer is sent token by token as
+    server-sent events, followed by a closing "done" event
+    """
+    return await stream_chat_answer(query, 50, analysis_type, include_images)
+
+# Prompt templates for analyze-recent, by analysis type
+MULTIPLE_PROMPT_TEMPLATES = {
+    "youtube_analytics": "I'm showing you {count} YouTube analytics screenshots from my channel. Analyze these screenshots together to provide a comprehensive understanding of my channel performance. Identify key metrics, trends, opportunities, and what's working vs. what needs improvement. Give me actionable insights to improve my channel.",
     
-    default_prompt = "I'm showing you {count} YouTube Studio screenshots. Analyze these images collectively to provide a comprehensive understanding of my channel performance. What's working well? What needs improvement? Give me specific, actionable recommendations to optimize my YouTube strategy."
+    "thumbnail_analysis": "I'm showing you {count} YouTube thumbnails from my channel. Analyze these thumbnails together to evaluate their design consistency, appeal, clickability, and effectiveness. Identify strengths, weaknesses, and provide specific suggestions to improve my thumbnail strategy.",
     
+    "content_strategy": "I'm showing you {count} screenshots from YouTube Studio related to my content strategy. Analyze these images collectively to provide insights on what's working well in my content approach and what could be improved. Give me specific recommendations to optimize my content strategy.",
+    
+    "audience_engagement": "I'm showing you {count} audience engagement screenshots from YouTube. Analyze these collectively to identify patterns in viewer behavior, engagement trends, and opportunities for improvement. Provide actionable advice to increase my audience engagement.",
+    
+    "monetization": "I'm showing you {count} YouTube monetization data screenshots. Analyze these together to identify revenue patterns, opportunities, and strategies for optimization. What's working well and what could be improved to maximize my revenue?",
+    
+    "competitor_analysis": "I'm showing you {count} screenshots from competitor YouTube channels. Analyze these collectively to identify their strategies, strengths, and weaknesses. What can I learn from them to improve my own channel?"
+}
+
+DEFAULT_MULTIPLE_PROMPT = "I'm showing you {count} YouTube Studio screenshots. Analyze these images collectively to provide a comprehensive understanding of my channel performance. What's working well? What needs improvement? Give me specific, actionable recommendations to optimize my YouTube strategy."
+
+async def analyze_multiple_images(images, metadata, analysis_type):
+    """Send multiple images to Gemini API for a single comprehensive analysis"""
     # Select and format the prompt template
-    prompt_template = prompt_templates.get(analysis_type, default_prompt)
+    prompt_template = MULTIPLE_PROMPT_TEMPLATES.get(analysis_type, DEFAULT_MULTIPLE_PROMPT)
     prompt = prompt_template.format(count=len(images))
     
     # Add metadata context to the prompt if available
@@ -507,21 +592,11 @@ def analyze_multiple_images(images, metadata, analysis_type, api_key):
     request_parts = [prompt] + images
     
     # Generate content
-    response = model.generate_content(request_parts)
-    
-    return response.text
+    return await gemini.generate(request_parts, model=ANALYSIS_MODEL)
 
-def analyze_all_images_comprehensive(images, metadata, analysis_type, api_key):
-    """Send all images to Gemini API for a comprehensive structured analysis report"""
-    # Configure the API
-    genai.configure(api_key=api_key)
-
-    # Create a model instance
-    model = genai.GenerativeModel('gemini-2.0-flash')
-
-    # Enhanced comprehensive prompt templates
-    comprehensive_prompt_templates = {
-        "youtube_analytics": """I'm showing you {count} YouTube analytics screenshots from my channel's history. Create a COMPREHENSIVE REPORT analyzing these screenshots together. 
+# Enhanced comprehensive prompt templates, shared by the single-call and incremental reports
+COMPREHENSIVE_PROMPT_TEMPLATES = {
+    "youtube_analytics": """I'm showing you {count} YouTube analytics screenshots from my channel's history. Create a COMPREHENSIVE REPORT analyzing these screenshots together. 
 
 The report should include:
 1. EXECUTIVE SUMMARY: Brief overview of channel performance and key insights
@@ -535,8 +610,8 @@ The report should include:
 9. FORECAST & TARGETS: Projected performance based on current trends
 
 Format your response in clear sections with bullet points for key insights and bold text for critical findings. Provide specific, data-backed recommendations I can implement immediately.""",
-        
-        "thumbnail_analysis": """I'm analyzing {count} YouTube thumbnails from my channel. Create a COMPREHENSIVE THUMBNAIL ANALYSIS REPORT.
+    
+    "thumbnail_analysis": """I'm analyzing {count} YouTube thumbnails from my channel. Create a COMPREHENSIVE THUMBNAIL ANALYSIS REPORT.
 
 Include:
 1. VISUAL CONSISTENCY: Evaluate brand consistency across thumbnails
@@ -550,8 +625,8 @@ Include:
 9. A/B TESTING RECOMMENDATIONS: Suggestions for thumbnail variants to test
 
 Format as a structured report with visual design principles highlighted. Include specific, actionable recommendations for immediate improvement.""",
-        
-        "content_strategy": """I'm showing you {count} screenshots from YouTube Studio related to my content strategy. Create a COMPREHENSIVE CONTENT STRATEGY ANALYSIS.
+    
+    "content_strategy": """I'm showing you {count} screenshots from YouTube Studio related to my content strategy. Create a COMPREHENSIVE CONTENT STRATEGY ANALYSIS.
 
 Include:
 1. CONTENT PORTFOLIO ASSESSMENT: Evaluate the mix and balance of content types
@@ -565,9 +640,9 @@ Include:
 9. STRATEGIC CONTENT CALENDAR: Recommended content mix for future uploads
 
 Format as a structured strategic analysis with specific action items highlighted. Provide data-backed rationale for all recommendations."""
-    }
-    
-    default_comprehensive_prompt = """I'm showing you {count} YouTube Studio screenshots spanning my channel's history. Create a COMPREHENSIVE CHANNEL ANALYSIS REPORT.
+}
+
+DEFAULT_COMPREHENSIVE_PROMPT = """I'm showing you {count} YouTube Studio screenshots spanning my channel's history. Create a COMPREHENSIVE CHANNEL ANALYSIS REPORT.
 
 Include:
 1. EXECUTIVE SUMMARY: Overview of channel performance and key findings
@@ -581,9 +656,11 @@ Include:
 9. FUTURE OUTLOOK: Projected performance based on identified trends
 
 Format as a structured report with clear sections, bullet points for key insights, and bold text for critical findings. Provide specific, actionable recommendations based on the data shown."""
-    
+
+async def analyze_all_images_comprehensive(images, metadata, analysis_type):
+    """Send all images to Gemini API for a comprehensive structured analysis report"""
     # Select and format the prompt template
-    prompt_template = comprehensive_prompt_templates.get(analysis_type, default_comprehensive_prompt)
+    prompt_template = COMPREHENSIVE_PROMPT_TEMPLATES.get(analysis_type, DEFAULT_COMPREHENSIVE_PROMPT)
     prompt = prompt_template.format(count=len(images))
     
     # Add metadata context to the prompt if available
@@ -603,21 +680,11 @@ Format as a structured report with clear sections, bullet points for key insight
     request_parts = [prompt] + images
     
     # Generate content
-    response = model.generate_content(request_parts)
-    
-    return response.text
-
-def analyze_images_one_page(images, metadata, analysis_type, api_key):
-    """Send images to Gemini API for a full one-page analysis with highly personalized recommendations"""
-    # Configure the API
-    genai.configure(api_key=api_key)
+    return await gemini.generate(request_parts, model=ANALYSIS_MODEL)
 
-    # Create a model instance
-    model = genai.GenerativeModel('gemini-2.0-flash')
-
-    # Detailed one-page prompt templates with emphasis on highly specific recommendations
-    one_page_prompt_templates = {
-        "youtube_analytics": """I'm showing you {count} YouTube analytics screenshots. Create a DETAILED one-page report with HIGHLY SPECIFIC insights based ONLY on the actual data visible in these screenshots.
+# Detailed one-page prompt templates with emphasis on highly specific recommendations
+ONE_PAGE_PROMPT_TEMPLATES = {
+    "youtube_analytics": """I'm showing you {count} YouTube analytics screenshots. Create a DETAILED one-page report with HIGHLY SPECIFIC insights based ONLY on the actual data visible in these screenshots.
 
 Include these key areas (aim for a total of about 600-700 words):
 1. Performance summary: Cite specific metrics visible in the screenshots (views, watch time, etc.)
@@ -640,8 +707,8 @@ Use markdown formatting with proper spacing:
 - Use section headers with ## followed by a space for each main section
 
 Format the content to fill ONE FULL PAGE when rendered as a PDF. The recommendations must be data-driven and specific to THIS channel.""",
-        
-        "thumbnail_analysis": """I'm analyzing {count} YouTube thumbnails. Create a DETAILED one-page thumbnail analysis with HIGHLY SPECIFIC recommendations based ONLY on the actual thumbnails visible in these screenshots.
+    
+    "thumbnail_analysis": """I'm analyzing {count} YouTube thumbnails. Create a DETAILED one-page thumbnail analysis with HIGHLY SPECIFIC recommendations based ONLY on the actual thumbnails visible in these screenshots.
 
 Include these areas (aim for about 600-700 words total):
 1. Design assessment: Evaluate specific design elements visible in THESE thumbnails
@@ -664,9 +731,9 @@ Use markdown formatting with proper spacing:
 - Use section headers with ## followed by a space for each main section
 
 Format the content to fill ONE FULL PAGE when rendered as a PDF. The recommendations must be specific to THESE thumbnails."""
-    }
-    
-    default_one_page_prompt = """I'm showing you {count} YouTube screenshots. Create a DETAILED one-page channel analysis with HIGHLY SPECIFIC insights based ONLY on the actual data visible in these screenshots.
+}
+
+DEFAULT_ONE_PAGE_PROMPT = """I'm showing you {count} YouTube screenshots. Create a DETAILED one-page channel analysis with HIGHLY SPECIFIC insights based ONLY on the actual data visible in these screenshots.
 
 Include these key areas (aim for about 600-700 words total):
 1. Channel summary: Cite specific metrics visible in the screenshots
@@ -690,9 +757,11 @@ Use markdown formatting with proper spacing:
 - Use section headers with ## followed by a space for each main section
 
 Format the content to fill ONE FULL PAGE when rendered as a PDF. The recommendations must be data-driven and specific to THIS channel."""
-    
+
+async def analyze_images_one_page(images, metadata, analysis_type):
+    """Send images to Gemini API for a full one-page analysis with highly personalized recommendations"""
     # Select and format the prompt template
-    prompt_template = one_page_prompt_templates.get(analysis_type, default_one_page_prompt)
+    prompt_template = ONE_PAGE_PROMPT_TEMPLATES.get(analysis_type, DEFAULT_ONE_PAGE_PROMPT)
     prompt = prompt_template.format(count=len(images))
     
     # Add minimal metadata context
@@ -712,263 +781,55 @@ Format the content to fill ONE FULL PAGE when rendered as a PDF. The recommendat
     request_parts = [prompt] + images
     
     # Generate content
-    response = model.generate_content(request_parts)
-    
-    return response.text
-
-def process_markdown_formatting(text):
-    """
-    Comprehensive function to process markdown formatting for PDFs
-    """
-    # First, standardize line endings and clean any existing HTML
-    text = text.replace('\r\n', '\n')
-    text = re.sub(r'<[^>]+>', '', text)
-    
-    # Create a dictionary to store parsed sections with their formatting
-    parsed_sections = []
-    
-    # Process headers first (important to do this before other formatting)
-    lines = text.split('\n')
-    current_paragraph = []
-    
-    for line in lines:
-        line = line.rstrip()
-        
-        # Skip empty lines but add them as paragraph separators
-        if not line.strip():
-            if current_paragraph:
-                parsed_sections.append({
-                    'type': 'paragraph',
-                    'content': ' '.join(current_paragraph),
-                    'format': 'normal'
-                })
-                current_paragraph = []
-            continue
-            
-        # Check for headers
-        header_match = re.match(r'^(#{1,6})\s+(.+)$', line)
-        if header_match:
-            # Add any current paragraph first
-            if current_paragraph:
-                parsed_sections.append({
-                    'type': 'paragraph',
-                    'content': ' '.join(current_paragraph),
-                    'format': 'normal'
-                })
-                current_paragraph = []
-                
-            # Add the header
-            level = len(header_match.group(1))
-            parsed_sections.append({
-                'type': 'header',
-                'content': header_match.group(2),
-                'level': level
-            })
-            continue
-            
-        # Check for bullet points
-        bullet_match = re.match(r'^([\*\-])\s+(.+)$', line)
-        if bullet_match:
-            # Add any current paragraph first
-            if current_paragraph:
-                parsed_sections.append({
-                    'type': 'paragraph',
-                    'content': ' '.join(current_paragraph),
-                    'format': 'normal'
-                })
-                current_paragraph = []
-                
-            # Add the bullet point
-            parsed_sections.append({
-                'type': 'bullet',
-                'content': bullet_match.group(2)
-            })
-            continue
-            
-        # Regular paragraph content
-        current_paragraph.append(line)
-    
-    # Add any remaining paragraph
-    if current_paragraph:
-        parsed_sections.append({
-            'type': 'paragraph',
-            'content': ' '.join(current_paragraph),
-            'format': 'normal'
-        })
-    
-    # Process inline formatting for all sections
-    for section in parsed_sections:
-        content = section['content']
-        
-        # Process bold text
-        content = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', content)
-        
-        # Process italic text - handling both *text* and _text_ formats
-        content = re.sub(r'(?<!\*)\*([^\*]+)\*(?!\*)', r'<i>\1</i>', content)
-        content = re.sub(r'_([^_]+)_', r'<i>\1</i>', content)
-        
-        section['content'] = content
-    
-    return parsed_sections
-
-def create_clean_pdf_report(content, analysis_type, image_count):
-    """
-    Create a cleaner, single-page PDF report with improved formatting
-    """
-    # Create a unique filename
-    report_id = uuid.uuid4()
-    filename = f"youtube_report_{report_id}.pdf"
-    filepath = os.path.join(TEMP_DIR, filename)
-    
-    # Create PDF document with minimal margins
-    doc = SimpleDocTemplate(
-        filepath,
-        pagesize=letter,
-        rightMargin=30,
-        leftMargin=30,
-        topMargin=30,
-        bottomMargin=30
+    return await gemini.generate(request_parts, model=ANALYSIS_MODEL)
+
+# Prompt templates and closing instruction of each multi-image analysis, by function
+# name, used when the analysis runs as a reduce over batch summaries
+REDUCE_PROMPTS = {
+    "analyze_multiple_images": (
+        MULTIPLE_PROMPT_TEMPLATES, DEFAULT_MULTIPLE_PROMPT,
+        "Please provide a detailed analysis with specific insights and recommendations."
+    ),
+    "analyze_all_images_comprehensive": (
+        COMPREHENSIVE_PROMPT_TEMPLATES, DEFAULT_COMPREHENSIVE_PROMPT,
+        "Please structure your analysis as a professional report with clear sections and actionable insights. Focus on identifying patterns across all the data shown."
+    ),
+    "analyze_images_one_page": (
+        ONE_PAGE_PROMPT_TEMPLATES, DEFAULT_ONE_PAGE_PROMPT,
+        "Remember: Include enough detail to fill a full page with HIGHLY SPECIFIC insights and recommendations based ONLY on the data in the batch summaries and screenshots."
     )
-    
-    # Styles
-    styles = getSampleStyleSheet()
-    
-    # Create custom styles optimized for a single page
-    styles.add(ParagraphStyle(
-        name='CompactTitle',
-        parent=styles['Heading1'],
-        fontSize=14,
-        alignment=TA_CENTER,
-        spaceAfter=2
-    ))
-    styles.add(ParagraphStyle(
-        name='CompactSubtitle',
-        parent=styles['Heading2'],
-        fontSize=8,
-        alignment=TA_CENTER,
-        textColor=colors.darkblue,
-        spaceAfter=6
-    ))
-    styles.add(ParagraphStyle(
-        name='Header1',
-        parent=styles['Heading1'],
-        fontSize=12,
-        textColor=colors.darkblue,
-        spaceBefore=6,
-        spaceAfter=2
-    ))
-    styles.add(ParagraphStyle(
-        name='Header2',
-        parent=styles['Heading2'],
-        fontSize=11,
-        textColor=colors.darkblue,
-        spaceBefore=6,
-        spaceAfter=2
-    ))
-    styles.add(ParagraphStyle(
-        name='Header3',
-        parent=styles['Heading3'],
-        fontSize=10,
-        textColor=colors.darkblue,
-        spaceBefore=4,
-        spaceAfter=1
-    ))
-    styles.add(ParagraphStyle(
-        name='CompactParagraph',
-        parent=styles['Normal'],
-        fontSize=9,
-        spaceBefore=0,
-        spaceAfter=3,
-        leading=11
-    ))
-    styles.add(ParagraphStyle(
-        name='CompactBullet',
-        parent=styles['Normal'],
-        fontSize=9,
-        leftIndent=10,
-        firstLineIndent=0,
-        spaceBefore=0,
-        spaceAfter=1,
-        leading=11,
-        bulletIndent=5
-    ))
-    
-    # Content elements
-    elements = []
-    
-    # Title
-    title_mapping = {
-        "youtube_analytics": "YouTube Analytics Insights",
-        "thumbnail_analysis": "Thumbnail Analysis",
-        "content_strategy": "Content Strategy Insights",
-        "audience_engagement": "Audience Engagement Analysis",
-        "monetization": "Monetization Insights"
-    }
-    title = title_mapping.get(analysis_type, "YouTube Channel Analysis")
-    
-    # Add title and metadata
-    elements.append(Paragraph(title, styles['CompactTitle']))
-    elements.append(Paragraph(f"Generated: {datetime.now().strftime('%b %d, %Y')} | {image_count} screenshots analyzed", 
-                             styles['CompactSubtitle']))
-    
-    # Process the content with improved formatting
-    try:
-        # Parse markdown into structured sections
-        parsed_sections = process_markdown_formatting(content)
-        
-        # Add each section to the PDF with proper formatting
-        for section in parsed_sections:
-            if section['type'] == 'header':
-                # Map header level to appropriate style
-                if section['level'] == 1:
-                    elements.append(Paragraph(section['content'], styles['Header1']))
-                elif section['level'] == 2:
-                    elements.append(Paragraph(section['content'], styles['Header2']))
-                else:
-                    elements.append(Paragraph(section['content'], styles['Header3']))
-            
-            elif section['type'] == 'bullet':
-                elements.append(Paragraph("• " + section['content'], styles['CompactBullet']))
-            
-            elif section['type'] == 'paragraph':
-                elements.append(Paragraph(section['content'], styles['CompactParagraph']))
-        
-        # If no sections were processed, fall back to simple formatting
-        if len(elements) <= 2:  # Only title and subtitle
-            fallback_content = content.replace('**', '<b>').replace('**', '</b>')
-            fallback_content = fallback_content.replace('*', '<i>').replace('*', '</i>')
-            elements.append(Paragraph(fallback_content, styles['CompactParagraph']))
-    
-    except Exception as e:
-        # Fallback to simple text if there's an error in processing
-        print(f"Error processing content: {str(e)}")
-        print("Using fallback formatting")
-        
-        # Strip all HTML/markdown and use plain text
-        plain_text = re.sub(r'<[^>]+>', '', content)
-        plain_text = re.sub(r'[*#_]+', '', plain_text)
-        
-        # Split into paragraphs
-        paragraphs = plain_text.split('\n\n')
-        for para in paragraphs:
-            if para.strip():
-                elements.append(Paragraph(para.strip(), styles['CompactParagraph']))
-    
-    # Build the PDF
-    doc.build(elements)
-    
-    return filepath
+}
 
-def rag_chatbot_response(query, images, metadata, analysis_type, api_key):
+async def reduce_report(summaries, images, metadata, analysis_type, report="analyze_all_images_comprehensive"):
     """
-    Implement RAG approach to answer queries based on YouTube analytics images
+    Run one of the multi-image analyses as a reduce step: over batch
+    summaries of earlier screenshots plus the images of screenshots that
+    are not summarized yet
     """
-    # Configure the API
-    genai.configure(api_key=api_key)
-
-    # Create a model instance
-    model = genai.GenerativeModel('gemini-2.0-flash')
-    
+    prompt_templates, default_prompt, closing = REDUCE_PROMPTS[report]
+    total = sum(len(summary["image_ids"]) for summary in summaries) + len(images)
+    prompt = prompt_templates.get(analysis_type, default_prompt).format(count=total)
+
+    sections = []
+    for i, summary in enumerate(summaries, 1):
+        period = summary["start"][:10] if summary["start"][:10] == summary["end"][:10] \
+            else f"{summary['start'][:10]} to {summary['end'][:10]}"
+        sections.append(f"### Batch {i} ({period}, {len(summary['image_ids'])} screenshots)\n{summary['summary']}")
+    if sections:
+        reviewed = "The older screenshots were" if images else "The screenshots were"
+        prompt += (f"\n\n{reviewed} already reviewed in batches; here are the batch summaries "
+                   "in chronological order:\n\n" + "\n\n".join(sections))
+    if images:
+        timestamps = sorted(str(meta["timestamp"])[:10] for meta in metadata if meta.get("timestamp"))
+        period = f" from {timestamps[0]} to {timestamps[-1]}" if timestamps else ""
+        prompt += f"\n\nThe {len(images)} most recent screenshots{period} are attached as images."
+
+    prompt += f"\n\n{closing}"
+
+    return await gemini.generate([prompt] + images, model=ANALYSIS_MODEL)
+
+def rag_chatbot_request(query, images, metadata, analysis_type):
+    """Gemini request parts (prompt, every image, query) for a query answered from whole screenshots"""
     # Safely format dates from metadata
     start_date = "various dates"
     end_date = "present"
@@ -1016,9 +877,36 @@ If the data spans a time period, note that the screenshots cover from {start_dat
 """
     
     # Create request with prompt and all images
-    request_parts = [rag_prompt] + images + [query]
-    
-    # Generate content
-    response = model.generate_content(request_parts)
-    
-    return response.text 
\ No newline at end of file
+    return [rag_prompt] + images + [query]
+
+def rag_chunks_request(query, chunks, images, analysis_type):
+    """Gemini request parts (prompt with retrieved chunks, images, query) for a query"""
+    context = "\n\n".join(
+        f"[Source {i + 1} | screenshot {chunk['screenshot_id']} | captured {chunk.get('timestamp') or 'unknown'}]\n{chunk['content']}"
+        for i, chunk in enumerate(chunks)
+    )
+
+    rag_prompt = f"""You are a YouTube Analytics Expert Assistant. Below are excerpts extracted from my channel's YouTube Studio screenshots{f", followed by {len(images)} of the original screenshots" if images else ""}. They are your only knowledge base.
+
+CONTEXT:
+{context}
+
+USER QUERY: "{query}"
+
+RESPONSE STYLE: Begin your response with "Based on data..." and then directly provide insights. Do NOT use phrases like "Based on the screenshot provided" or similar introductions.
+
+Based EXCLUSIVELY on this data, provide a detailed, accurate answer to my query.
+If the data doesn't contain sufficient information to answer fully, explain:
+1. What relevant information IS available
+2. What specific additional data would be needed for a complete answer
+
+Guidelines:
+• Only reference metrics, trends, and patterns that are actually in the context
+• Cite specific numbers and data points
+• Format your response with headers, bullet points, and emphasis for key insights
+• Provide actionable recommendations when appropriate
+• Be honest about limitations of the available data
+• The analysis focus is {analysis_type.replace("_", " ") if analysis_type else "youtube analytics"}
+"""
+
+    return [rag_prompt] + images + [query]
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional, List
+from typing import Literal, Optional, List
 
 class ScreenshotModel(BaseModel):
     image: str
@@ -26,10 +26,18 @@ class AnalysisResponse(BaseModel):
 class BatchAnalysisRequest(BaseModel):
     count: int = 5  # Number of recent images to analyze
     analysis_type: Optional[str] = "youtube_analytics"  # youtube_analytics, thumbnail_analysis, etc.
+    refresh: bool = False  # Ignore a stored result for the same screenshots
+    mode: Literal["single", "sharded"] = "single"  # sharded: analyze shards concurrently, then merge
+
+class ReportJobRequest(BaseModel):
+    analysis_type: str = "youtube_analytics"
+    refresh: bool = False  # Re-run the analysis and re-render instead of using a cached PDF
+    mode: Literal["single", "sharded"] = "single"
 
 class SimpleAnalysisResponse(BaseModel):
     image_count: int
     analysis_type: str
     insights: str
     image_ids: List[str]
-    success: bool
\ No newline at end of file
+    success: bool
+    cached: bool = False
\ No newline at end of file
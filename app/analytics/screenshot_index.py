@@ -0,0 +1,350 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from pymongo.errors import BulkWriteError
+from app.embeddings import EMBEDDING_MODEL, embed_texts
+from .database import screenshot_chunk_collection
+from .gemini_client import gemini
+from .image_decode import decode_screenshots
+
+EXTRACTION_MODEL = os.getenv("SCREENSHOT_EXTRACTION_MODEL", "gemini-2.0-flash")
+EXTRACTION_CONCURRENCY = int(os.getenv("SCREENSHOT_EXTRACTION_CONCURRENCY", "4"))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "8"))
+# Screenshots whose extraction failed are retried after this long
+EXTRACTION_RETRY_HOURS = float(os.getenv("SCREENSHOT_EXTRACTION_RETRY_HOURS", "24"))
+# Extractions a query waits for; the rest of the window is indexed in the background
+RAG_QUERY_EXTRACTION_LIMIT = int(os.getenv("RAG_QUERY_EXTRACTION_LIMIT", "4"))
+# Chunks stored by other workers are picked up at most this often
+SCREENSHOT_INDEX_SYNC_SECONDS = float(os.getenv("SCREENSHOT_INDEX_SYNC_SECONDS", "5"))
+# Overlap when re-reading recent chunks, covering clock skew between workers
+SCREENSHOT_INDEX_SYNC_OVERLAP = timedelta(seconds=float(os.getenv("SCREENSHOT_INDEX_SYNC_OVERLAP", "300")))
+
+EXTRACTION_PROMPT = """You are extracting data from a YouTube Studio screenshot so it can be searched later.
+
+Return JSON only, with this structure:
+{
+  "page": "which YouTube Studio page or report this is (e.g. Channel analytics - Overview)",
+  "date_range": "the date range shown, or null",
+  "chunks": [
+    {
+      "title": "short name of one panel, chart or table",
+      "text": "everything this panel shows, written out in full sentences: every visible number with its label and unit, trends, comparisons and top items in order",
+      "metrics": {"metric name": "value exactly as shown"}
+    }
+  ]
+}
+
+Make one chunk per distinct panel, chart or table. Include every visible number. Do not interpret or give advice."""
+
+
+def parse_extraction(text: str) -> dict:
+    """Parse Gemini's JSON reply, tolerating markdown fences around it"""
+    match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
+    if match:
+        text = match.group(1)
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end == -1:
+        raise ValueError("No JSON object in extraction response")
+    return json.loads(re.sub(r',\s*([\]}])', r'\1', text[start:end + 1]))
+
+
+async def extract_screenshot(image) -> dict:
+    """One Gemini call that turns a screenshot into structured text chunks"""
+    text = await gemini.generate(
+        [EXTRACTION_PROMPT, image],
+        model=EXTRACTION_MODEL,
+        generation_config={"response_mime_type": "application/json", "temperature": 0}
+    )
+    return parse_extraction(text)
+
+
+def chunk_text(chunk: dict) -> str:
+    """The text that is embedded and shown to the model for a chunk"""
+    lines = [f"[{chunk.get('page') or 'YouTube Studio'}] {chunk.get('title', '')}".strip()]
+    if chunk.get("date_range"):
+        lines.append(f"Date range: {chunk['date_range']}")
+    if chunk.get("text"):
+        lines.append(chunk["text"])
+    if chunk.get("metrics"):
+        lines.append("; ".join(f"{name}: {value}" for name, value in chunk["metrics"].items()))
+    return "\n".join(lines)
+
+
+class ScreenshotIndex:
+    """
+    Retrieval index over screenshot contents. Each screenshot is sent to
+    Gemini once to extract its panels as text chunks, which are embedded and
+    stored in Mongo (the persistent copy of the index). Queries are answered
+    from an in-memory FAISS inner-product index built from those chunks, so
+    the context for a question is the top-k chunks, not every screenshot.
+    Each worker loads the stored chunks once and then syncs the ones other
+    workers add; chunk ids are unique per screenshot, so only one extraction
+    of a screenshot is ever stored.
+    """
+    def __init__(self):
+        self._index = None
+        self._loaded = False
+        self._chunks: List[dict] = []
+        # Index rows of each screenshot's chunks, for searching within a set of screenshots
+        self._rows_by_screenshot: Dict[str, List[int]] = {}
+        self._indexed_ids = set()
+        self._doc_ids = set()
+        # Screenshot id -> extraction batch whose chunks are indexed
+        self._batches: Dict[str, object] = {}
+        self._synced_at: Optional[datetime] = None
+        # Screenshot id -> time of the last failed extraction
+        self._failed: Dict[str, datetime] = {}
+        self._load_lock = asyncio.Lock()
+        self._index_lock = threading.Lock()
+        self._semaphore = asyncio.Semaphore(EXTRACTION_CONCURRENCY)
+        self._inflight = {}
+        self.stats = {"extracted": 0, "failed": 0, "chunks": 0, "queries": 0}
+
+    def _add_to_index(self, chunks: List[dict]):
+        import faiss
+
+        vectors = np.asarray([chunk.pop("embedding") for chunk in chunks], dtype=np.float32)
+        # Index rows and self._chunks must stay in the same order
+        with self._index_lock:
+            if self._index is None:
+                self._index = faiss.IndexFlatIP(vectors.shape[1])
+            first_row = self._index.ntotal
+            self._index.add(vectors)
+            self._chunks.extend(chunks)
+            for row, chunk in enumerate(chunks, first_row):
+                self._rows_by_screenshot.setdefault(chunk["screenshot_id"], []).append(row)
+            self.stats["chunks"] = len(self._chunks)
+
+    async def _merge(self, documents: List[dict]) -> int:
+        """Index stored chunk documents not seen yet; returns how many chunks were added"""
+        indexable = []
+        for doc in sorted(documents, key=lambda d: d["created_at"]):
+            screenshot_id = doc["screenshot_id"]
+            if doc.get("failed"):
+                if screenshot_id not in self._indexed_ids:
+                    self._failed[screenshot_id] = max(doc["created_at"], self._failed.get(screenshot_id, doc["created_at"]))
+                continue
+            if doc["_id"] in self._doc_ids:
+                continue
+            self._doc_ids.add(doc["_id"])
+            # Only the first extraction of a screenshot counts; chunks stored twice
+            # before chunk ids were unique would otherwise show up twice in results
+            batch = doc.get("batch") or doc["created_at"]
+            if self._batches.setdefault(screenshot_id, batch) != batch:
+                continue
+            # Screenshots with nothing extractable are recorded with an empty marker chunk
+            self._indexed_ids.add(screenshot_id)
+            self._failed.pop(screenshot_id, None)
+            if doc.get("embedding"):
+                indexable.append({k: v for k, v in doc.items()
+                                  if k not in ("_id", "embedding_model", "created_at", "batch")})
+        if indexable:
+            await run_in_threadpool(self._add_to_index, indexable)
+        return len(indexable)
+
+    async def _sync(self, force: bool = False):
+        """Index chunks stored since the last sync, including other workers' ones"""
+        now = datetime.utcnow()
+        if not force and self._synced_at and (now - self._synced_at).total_seconds() < SCREENSHOT_INDEX_SYNC_SECONDS:
+            return
+        query = {"embedding_model": EMBEDDING_MODEL}
+        if self._synced_at is not None:
+            query["created_at"] = {"$gte": self._synced_at - SCREENSHOT_INDEX_SYNC_OVERLAP}
+        self._synced_at = now
+        documents = await screenshot_chunk_collection.find(query).to_list(length=None)
+        added = await self._merge(documents)
+        if added:
+            print(f"Screenshot index synced {added} chunks")
+
+    async def ensure_loaded(self):
+        """Build the in-memory index from the chunks stored in Mongo, then keep it in sync"""
+        if self._loaded:
+            await self._sync()
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                await screenshot_chunk_collection.create_index([("screenshot_id", 1), ("embedding_model", 1)])
+                await screenshot_chunk_collection.create_index([("embedding_model", 1), ("created_at", 1)])
+            except Exception as e:
+                print(f"Screenshot index: could not create indexes: {e}")
+            await self._sync(force=True)
+            self._loaded = True
+            print(f"Screenshot index loaded: {len(self._chunks)} chunks from {len(self._indexed_ids)} screenshots")
+
+    async def _load_stored(self, screenshot_id: str) -> Optional[int]:
+        """Index a screenshot's stored chunks, if any worker has extracted it; returns the chunk count"""
+        documents = await screenshot_chunk_collection.find(
+            {"screenshot_id": screenshot_id, "embedding_model": EMBEDDING_MODEL, "failed": {"$ne": True}}
+        ).to_list(length=None)
+        if not documents:
+            return None
+        await self._merge(documents)
+        return sum(1 for doc in documents if doc.get("embedding"))
+
+    async def _index_one(self, screenshot: dict) -> int:
+        screenshot_id = screenshot["id"]
+        stored = await self._load_stored(screenshot_id)
+        if stored is not None:
+            return stored
+
+        async with self._semaphore:
+            images, _ = await decode_screenshots([screenshot])
+            if not images:
+                await self._record_failure(screenshot_id, "Screenshot could not be decoded")
+                return 0
+            try:
+                extraction = await extract_screenshot(images[0])
+            except Exception as e:
+                print(f"Error extracting screenshot {screenshot_id}: {str(e)}")
+                await self._record_failure(screenshot_id, str(e))
+                return 0
+
+        chunks = []
+        for chunk in extraction.get("chunks") or []:
+            if not isinstance(chunk, dict) or not (chunk.get("text") or chunk.get("metrics")):
+                continue
+            chunk = {
+                "screenshot_id": screenshot_id,
+                "timestamp": screenshot.get("timestamp"),
+                "source": screenshot.get("source", "YouTube Studio"),
+                "page": extraction.get("page"),
+                "date_range": extraction.get("date_range"),
+                "title": chunk.get("title", ""),
+                "text": chunk.get("text", ""),
+                "metrics": chunk.get("metrics") if isinstance(chunk.get("metrics"), dict) else {}
+            }
+            chunk["content"] = chunk_text(chunk)
+            chunks.append(chunk)
+
+        now = datetime.utcnow()
+        batch = uuid.uuid4().hex
+        if chunks:
+            vectors = await run_in_threadpool(embed_texts, [chunk["content"] for chunk in chunks])
+            documents = [{**chunk, "embedding": vector.tolist(), "embedding_model": EMBEDDING_MODEL,
+                          "extraction_model": EXTRACTION_MODEL, "created_at": now}
+                         for chunk, vector in zip(chunks, vectors)]
+        else:
+            documents = [{"screenshot_id": screenshot_id, "embedding": None,
+                          "embedding_model": EMBEDDING_MODEL, "created_at": now}]
+        # Ids are unique per screenshot and chunk position, so a second worker
+        # extracting the same screenshot can't store another copy
+        documents = [{"_id": f"{screenshot_id}:{EMBEDDING_MODEL}:{i}", **doc, "batch": batch}
+                     for i, doc in enumerate(documents)]
+        try:
+            await screenshot_chunk_collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            # Another worker stored this screenshot first: drop our extra chunks, use theirs
+            await screenshot_chunk_collection.delete_many({"screenshot_id": screenshot_id, "batch": batch})
+            print(f"Screenshot {screenshot_id} was indexed by another worker")
+            return await self._load_stored(screenshot_id) or 0
+        if screenshot_id in self._failed:
+            await screenshot_chunk_collection.delete_many({"screenshot_id": screenshot_id, "failed": True})
+            self._failed.pop(screenshot_id, None)
+
+        await self._merge(documents)
+        self.stats["extracted"] += 1
+        print(f"Indexed screenshot {screenshot_id}: {len(chunks)} chunks")
+        return len(chunks)
+
+    async def _record_failure(self, screenshot_id: str, error: str):
+        """Store a failed-extraction marker so the screenshot isn't retried on every query"""
+        now = datetime.utcnow()
+        self.stats["failed"] += 1
+        self._failed[screenshot_id] = now
+        await screenshot_chunk_collection.replace_one(
+            {"screenshot_id": screenshot_id, "failed": True},
+            {"screenshot_id": screenshot_id, "failed": True, "error": error[:500], "embedding": None,
+             "embedding_model": EMBEDDING_MODEL, "created_at": now},
+            upsert=True
+        )
+
+    def _needs_extraction(self, screenshot_id: str) -> bool:
+        if screenshot_id in self._indexed_ids:
+            return False
+        failed_at = self._failed.get(screenshot_id)
+        return failed_at is None or datetime.utcnow() - failed_at > timedelta(hours=EXTRACTION_RETRY_HOURS)
+
+    def _task_done(self, screenshot_id: str, task: asyncio.Task):
+        self._inflight.pop(screenshot_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error indexing screenshot {screenshot_id}: {str(task.exception())}")
+
+    async def index_screenshots(self, screenshots: List[dict], wait_for: Optional[int] = None) -> int:
+        """
+        Extract and index any of the given screenshots that aren't indexed
+        yet. With wait_for, only the first `wait_for` of them (the newest,
+        for lists from retrieve_screenshots) are awaited; the others keep
+        extracting in the background.
+        """
+        await self.ensure_loaded()
+        tasks = []
+        for screenshot in screenshots:
+            screenshot_id = screenshot["id"]
+            if not self._needs_extraction(screenshot_id):
+                continue
+            # Concurrent requests share one extraction per screenshot
+            if screenshot_id not in self._inflight:
+                task = asyncio.ensure_future(self._index_one(screenshot))
+                self._inflight[screenshot_id] = task
+                task.add_done_callback(lambda t, sid=screenshot_id: self._task_done(sid, t))
+            tasks.append(self._inflight[screenshot_id])
+        if wait_for is not None:
+            tasks = tasks[:wait_for]
+        if not tasks:
+            return 0
+        results = await asyncio.gather(*(asyncio.shield(task) for task in tasks), return_exceptions=True)
+        return sum(result for result in results if isinstance(result, int))
+
+    def _search_index(self, query_vector: np.ndarray, k: int, screenshot_ids: Optional[List[str]]) -> List[dict]:
+        """
+        Runs in the threadpool. FAISS doesn't support adding and searching at
+        the same time, so the selector, search and row lookup all happen
+        under the index lock, against the same rows.
+        """
+        import faiss
+
+        with self._index_lock:
+            params = None
+            candidates = len(self._chunks)
+            if screenshot_ids is not None:
+                # Restrict the search to the given screenshots' rows inside FAISS, so
+                # hits from older screenshots can't crowd out the allowed ones
+                allowed_rows = [row for screenshot_id in set(screenshot_ids)
+                                for row in self._rows_by_screenshot.get(screenshot_id, [])]
+                if not allowed_rows:
+                    return []
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.asarray(allowed_rows, dtype=np.int64)))
+                candidates = len(allowed_rows)
+
+            scores, rows = self._index.search(query_vector, min(k, candidates), params=params)
+            return [{**self._chunks[row], "score": float(score)}
+                    for score, row in zip(scores[0], rows[0]) if row >= 0]
+
+    async def search(self, query: str, k: int = RAG_TOP_K,
+                     screenshot_ids: Optional[List[str]] = None) -> List[dict]:
+        """Top-k chunks for a query, optionally restricted to some screenshots"""
+        await self.ensure_loaded()
+        if self._index is None or not self._chunks:
+            return []
+        self.stats["queries"] += 1
+
+        query_vector = await run_in_threadpool(embed_texts, [query])
+        return await run_in_threadpool(self._search_index, query_vector, k, screenshot_ids)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "screenshots": len(self._indexed_ids), "failed_screenshots": len(self._failed),
+                "in_flight": len(self._inflight)}
+
+
+screenshot_index = ScreenshotIndex()
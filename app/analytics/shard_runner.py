@@ -0,0 +1,51 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, List
+
+# Screenshots per shard when an analysis runs in sharded mode
+SHARD_SIZE = int(os.getenv("ANALYSIS_SHARD_SIZE", "10"))
+# Gemini calls from shard and window analyses that may run at the same time; the
+# process-wide concurrency and requests-per-minute limits are in gemini_client
+SHARD_CONCURRENCY = int(os.getenv("ANALYSIS_SHARD_CONCURRENCY", "4"))
+
+
+def split_shards(screenshots: List[dict], size: int = SHARD_SIZE) -> List[List[dict]]:
+    """Chronological shards of at most `size` screenshots"""
+    ordered = sorted(screenshots, key=lambda s: (str(s.get("timestamp") or ""), s["id"]))
+    return [ordered[start:start + size] for start in range(0, len(ordered), size)]
+
+
+class ShardRunner:
+    """
+    Runs the Gemini calls of shard and window analyses with at most
+    SHARD_CONCURRENCY in flight, so one large analysis fans out without
+    taking every slot of the shared Gemini client.
+    """
+    def __init__(self, concurrency: int = SHARD_CONCURRENCY):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.active = 0
+        self.stats = {"calls": 0, "failed": 0}
+
+    async def run(self, fn: Callable[..., Awaitable], *args):
+        async with self._semaphore:
+            self.active += 1
+            self.stats["calls"] += 1
+            try:
+                return await fn(*args)
+            except Exception:
+                self.stats["failed"] += 1
+                raise
+            finally:
+                self.active -= 1
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "active": self.active,
+            "max_concurrency": self.concurrency,
+            "shard_size": SHARD_SIZE
+        }
+
+
+shard_runner = ShardRunner()
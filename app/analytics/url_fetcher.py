@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional
+import httpx
+
+URL_FETCH_TIMEOUT = float(os.getenv("SCREENSHOT_URL_TIMEOUT", "15"))
+URL_FETCH_CONCURRENCY = int(os.getenv("SCREENSHOT_URL_CONCURRENCY", "8"))
+URL_MAX_BYTES = int(os.getenv("SCREENSHOT_URL_MAX_BYTES", str(25 * 1024 * 1024)))
+URL_CACHE_DIR = os.getenv("SCREENSHOT_URL_CACHE_DIR", os.path.join("temp_outputs", "screenshot_urls"))
+# Cached content younger than this is used without revalidating with the host
+URL_CACHE_FRESH_SECONDS = float(os.getenv("SCREENSHOT_URL_CACHE_FRESH", "3600"))
+
+
+class UrlFetchError(Exception):
+    pass
+
+
+class UrlFetcher:
+    """
+    Async fetcher for screenshots stored as URLs. Uses one pooled HTTP
+    client with timeouts and a cap on concurrent downloads, and keeps a disk
+    cache keyed by URL: fresh entries are served directly, stale ones are
+    revalidated with the stored ETag / Last-Modified so an unchanged image
+    costs a 304 instead of a download.
+    """
+    def __init__(self, cache_dir: str = URL_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._client = None
+        self._semaphore = asyncio.Semaphore(URL_FETCH_CONCURRENCY)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"fetched": 0, "cache_hits": 0, "revalidated": 0, "failed": 0, "bytes_downloaded": 0}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(URL_FETCH_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(max_connections=URL_FETCH_CONCURRENCY * 2,
+                                    max_keepalive_connections=URL_FETCH_CONCURRENCY),
+                follow_redirects=True
+            )
+        return self._client
+
+    def _cache_paths(self, url: str):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.bin"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_cache(self, url: str):
+        data_path, meta_path = self._cache_paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(data_path, "rb") as f:
+                return f.read(), meta
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None, None
+
+    def _write_cache(self, url: str, content: Optional[bytes], meta: dict):
+        data_path, meta_path = self._cache_paths(url)
+        if content is not None:
+            tmp_path = f"{data_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, data_path)
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    async def _fetch(self, url: str) -> bytes:
+        cached, meta = await asyncio.to_thread(self._read_cache, url)
+        if cached is not None and time.time() - meta.get("checked_at", 0) < URL_CACHE_FRESH_SECONDS:
+            self.stats["cache_hits"] += 1
+            return cached
+
+        headers = {}
+        if cached is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        async with self._semaphore:
+            try:
+                async with self._get_client().stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304 and cached is not None:
+                        self.stats["revalidated"] += 1
+                        await asyncio.to_thread(self._write_cache, url, None, {**meta, "checked_at": time.time()})
+                        return cached
+                    response.raise_for_status()
+                    content = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        content.extend(chunk)
+                        if len(content) > URL_MAX_BYTES:
+                            raise UrlFetchError(f"Image at {url} exceeds {URL_MAX_BYTES} bytes")
+                    new_meta = {
+                        "url": url,
+                        "etag": response.headers.get("etag"),
+                        "last_modified": response.headers.get("last-modified"),
+                        "content_type": response.headers.get("content-type"),
+                        "checked_at": time.time()
+                    }
+            except httpx.HTTPError as e:
+                raise UrlFetchError(f"Error fetching {url}: {type(e).__name__}: {e}")
+
+        content = bytes(content)
+        self.stats["fetched"] += 1
+        self.stats["bytes_downloaded"] += len(content)
+        await asyncio.to_thread(self._write_cache, url, content, new_meta)
+        return content
+
+    async def fetch(self, url: str) -> bytes:
+        """Image bytes for a URL; concurrent requests for the same URL share one download"""
+        if url in self._inflight:
+            return await asyncio.shield(self._inflight[url])
+        future = asyncio.ensure_future(self._fetch(url))
+        self._inflight[url] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self._inflight.pop(url, None)
+            else:
+                future.add_done_callback(lambda _: self._inflight.pop(url, None))
+
+    async def fetch_many(self, urls: List[str]) -> Dict[str, bytes]:
+        """Fetch URLs concurrently; failed URLs are logged and left out of the result"""
+        urls = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+        fetched = {}
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                self.stats["failed"] += 1
+                print(f"Error fetching screenshot URL {url}: {result}")
+            else:
+                fetched[url] = result
+        return fetched
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "in_flight": len(self._inflight), "max_concurrency": URL_FETCH_CONCURRENCY}
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+url_fetcher = UrlFetcher()
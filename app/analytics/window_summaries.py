@@ -0,0 +1,125 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from .analysis_cache import analysis_key, prompt_version
+from .database import window_summary_collection
+from .gemini_client import gemini
+from .image_decode import decode_screenshots
+from .shard_runner import shard_runner
+
+# Screenshots per summary window; a day with more screenshots is split into several windows
+SUMMARY_WINDOW_SIZE = int(os.getenv("SUMMARY_WINDOW_SIZE", "10"))
+
+WINDOW_SUMMARY_PROMPT = """I'm showing you {count} YouTube Studio screenshots captured {period}. They are one batch of a larger history that will be analyzed later from batch summaries, so the summary must stand on its own.
+
+Write a dense, factual summary of this batch:
+1. Which pages/reports are shown and the date ranges they cover
+2. Every key metric with its exact value and unit (views, watch time, subscribers, CTR, impressions, revenue, retention...)
+3. Changes and comparisons shown (e.g. "+12% vs previous 28 days")
+4. Top and bottom performing videos with their numbers
+5. Audience and traffic source details
+6. Notable patterns within this batch
+
+Focus on what matters for {focus}. Report only what is visible. Do not give recommendations."""
+
+
+async def summarize_window(images, metadata, analysis_type, model_name):
+    """Gemini summary of one window of screenshots (the map step)"""
+    timestamps = sorted(str(meta["timestamp"])[:10] for meta in metadata if meta.get("timestamp"))
+    period = f"between {timestamps[0]} and {timestamps[-1]}" if timestamps else "at various dates"
+    prompt = WINDOW_SUMMARY_PROMPT.format(
+        count=len(images),
+        period=period,
+        focus=(analysis_type or "youtube_analytics").replace("_", " ")
+    )
+    return await gemini.generate([prompt] + images, model=model_name)
+
+
+def split_windows(screenshots: List[dict]) -> Tuple[List[List[dict]], List[dict]]:
+    """
+    Group screenshots into chronological windows: per UTC day, in chunks of
+    SUMMARY_WINDOW_SIZE. A window is sealed once it is full or its day is
+    over; sealed windows never change, so their summaries can be stored.
+    Returns (sealed windows, screenshots of the still-open window).
+    """
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    by_day = {}
+    for screenshot in sorted(screenshots, key=lambda s: (str(s.get("timestamp") or ""), s["id"])):
+        day = str(screenshot.get("timestamp") or "")[:10] or "undated"
+        by_day.setdefault(day, []).append(screenshot)
+
+    sealed, open_window = [], []
+    for day, day_screenshots in by_day.items():
+        for start in range(0, len(day_screenshots), SUMMARY_WINDOW_SIZE):
+            window = day_screenshots[start:start + SUMMARY_WINDOW_SIZE]
+            if len(window) == SUMMARY_WINDOW_SIZE or day < today:
+                sealed.append(window)
+            else:
+                open_window.extend(window)
+    return sealed, open_window
+
+
+def window_version() -> str:
+    return prompt_version(summarize_window, WINDOW_SUMMARY_PROMPT)
+
+
+async def summarize_batch(window: List[dict], analysis_type: str, model_name: str) -> Optional[dict]:
+    """Decode one window of screenshots and summarize it through the shard runner"""
+    images, metadata = await decode_screenshots(window)
+    if not images:
+        return None
+    summary = await shard_runner.run(summarize_window, images, metadata, analysis_type, model_name)
+    return {
+        "analysis_type": analysis_type,
+        "screenshot_ids": [s["id"] for s in window],
+        "image_ids": [meta["id"] for meta in metadata],
+        "start": str(window[0].get("timestamp") or ""),
+        "end": str(window[-1].get("timestamp") or ""),
+        "summary": summary,
+        "model": model_name,
+        "created_at": datetime.utcnow()
+    }
+
+
+async def summarize_batches(windows: List[List[dict]], analysis_type: str, model_name: str) -> List[Optional[dict]]:
+    """
+    Summaries of several windows, computed concurrently, in window order.
+    A window that fails is logged and returned as None, so one bad batch
+    doesn't lose the rest.
+    """
+    results = await asyncio.gather(
+        *(summarize_batch(window, analysis_type, model_name) for window in windows),
+        return_exceptions=True
+    )
+    summaries = []
+    for window, result in zip(windows, results):
+        if isinstance(result, BaseException):
+            print(f"Error summarizing window starting {str(window[0].get('timestamp'))[:10]}: {str(result)}")
+            result = None
+        summaries.append(result)
+    return summaries
+
+
+async def get_window_summaries(windows: List[List[dict]], analysis_type: str, model_name: str) -> List[dict]:
+    """
+    Summaries of sealed windows, in order. Stored summaries are loaded in
+    one query; windows without one are summarized concurrently and stored.
+    """
+    version = window_version()
+    keys = [analysis_key("window_summary", analysis_type, [s["id"] for s in window], version, model_name)
+            for window in windows]
+    stored = {doc["_id"]: doc async for doc in window_summary_collection.find({"_id": {"$in": keys}})}
+
+    missing = [(key, window) for key, window in zip(keys, windows) if key not in stored]
+    if missing:
+        computed = await summarize_batches([window for _, window in missing], analysis_type, model_name)
+        for (key, _), doc in zip(missing, computed):
+            if doc is None:
+                continue
+            doc = {"_id": key, **doc}
+            await window_summary_collection.replace_one({"_id": key}, doc, upsert=True)
+            stored[key] = doc
+        print(f"Stored {sum(doc is not None for doc in computed)} of {len(missing)} new window summaries")
+
+    return [stored[key] for key in keys if key in stored]
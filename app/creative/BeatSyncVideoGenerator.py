@@ -2,11 +2,13 @@ import librosa
 import numpy as np
 from moviepy import *
 from pydub import AudioSegment
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
+from .streaming_analysis import should_stream, stream_beats
 
 
 class BeatSyncVideoGenerator:
-    def __init__(self, music_path: str, video_clips_paths: List[str], output_path: str, progress_callback=None):
+    def __init__(self, music_path: str, video_clips_paths: List[str], output_path: str, progress_callback=None,
+                 beat_source: str = "mix", streaming: Optional[bool] = None):
 
         self.music_path = music_path
         self.video_clips_paths = video_clips_paths
@@ -16,21 +18,50 @@ class BeatSyncVideoGenerator:
         self.clips = []
         self.music_duration = 0
         self.progress_callback = progress_callback
+        # "drums" tracks beats on a separated drum stem instead of the full mix
+        self.beat_source = beat_source
+        # Block-streaming analysis for long tracks, None decides by duration
+        self.streaming = streaming
 
     def analyze_music(self, hook_sensitivity: float = 0.5) -> List[float]:
         print(f"Analyzing music: {self.music_path}")
 
-        audio = AudioSegment.from_file(self.music_path)
-        self.music_duration = len(audio) / 1000.0  # Convert to seconds
+        streaming = self.streaming
+        if streaming is None:
+            streaming = should_stream(self.music_path)
+
+        if streaming:
+            # Decoding the whole track with pydub would defeat streaming
+            self.music_duration = librosa.get_duration(path=self.music_path)
+        else:
+            audio = AudioSegment.from_file(self.music_path)
+            self.music_duration = len(audio) / 1000.0  # Convert to seconds
+            del audio
         print(f"Music duration: {self.music_duration:.2f} seconds")
 
-        y, sr = librosa.load(self.music_path)
+        analysis_path = self.music_path
+        if self.beat_source == "drums":
+            from .drum_stem import separate_drums
+            analysis_path = separate_drums(self.music_path)
+            print(f"Tracking beats on drum stem: {analysis_path}")
+
+        onset_env = None
+        if streaming:
+            try:
+                print("Using block-streaming analysis")
+                tempo, beat_frames, beat_times, onset_env = stream_beats(analysis_path)
+            except Exception as e:
+                print(f"Streaming analysis failed ({e}), falling back to in-memory analysis")
+
+        if onset_env is None:
+            y, sr = librosa.load(analysis_path)
 
-        tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
+            tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
 
-        beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+            beat_times = librosa.frames_to_time(beat_frames, sr=sr)
 
-        onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+            onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+            del y
 
         onset_env_norm = (onset_env - onset_env.min()) / \
             (onset_env.max() - onset_env.min())
@@ -55,6 +86,20 @@ class BeatSyncVideoGenerator:
         self.hooks = hooks
         return beat_times
 
+    def get_analysis(self) -> Dict:
+        """Export the music analysis so it can be shared with other generators"""
+        return {
+            "music_duration": float(self.music_duration),
+            "beat_times": [float(t) for t in self.beat_times],
+            "hooks": [float(t) for t in self.hooks],
+        }
+
+    def set_analysis(self, analysis: Dict):
+        """Reuse a previous analysis of the same music instead of re-analyzing it"""
+        self.music_duration = analysis["music_duration"]
+        self.beat_times = np.array(analysis["beat_times"])
+        self.hooks = list(analysis["hooks"])
+
     def load_video_clips(self) -> List[VideoFileClip]:
         clips = []
         for path in self.video_clips_paths:
@@ -95,7 +140,7 @@ class BeatSyncVideoGenerator:
         print("Video clips are sufficient for the music duration.")
 
     def create_beat_synchronized_video(self) -> VideoFileClip:
-        if not self.beat_times:
+        if len(self.beat_times) == 0:
             if self.progress_callback:
                 self.progress_callback("Analyzing music...", 15)
             self.analyze_music()
@@ -152,7 +197,8 @@ class BeatSyncVideoGenerator:
             clip_copy = selected_clip.copy()
 
             target_resolution = (1280, 720)  # HD resolution
-            clip_copy = clip_copy.resized(target_resolution)
+            if tuple(clip_copy.size) != target_resolution:
+                clip_copy = clip_copy.resized(target_resolution)
 
             if clip_copy.duration > segment_duration:
                 middle_point = clip_copy.duration / 2
@@ -201,7 +247,7 @@ class BeatSyncVideoGenerator:
 
         return final_video
 
-    def generate(self, save: bool = True) -> VideoFileClip:
+    def generate(self, save: bool = True, close_clips: bool = True) -> VideoFileClip:
         if self.progress_callback:
             self.progress_callback("Preprocessing", 10)
         final_video = self.create_beat_synchronized_video()
@@ -223,7 +269,9 @@ class BeatSyncVideoGenerator:
 
         final_video.close()
 
-        for clip in self.clips:
-            clip.close()
+        # Shared clips (batch renders) are closed by their owner
+        if close_clips:
+            for clip in self.clips:
+                clip.close()
 
         return final_video
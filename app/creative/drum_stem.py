@@ -0,0 +1,92 @@
+import os
+import time
+import soundfile as sf
+import torch
+from demucs.apply import apply_model
+from demucs.audio import AudioFile
+from demucs.pretrained import get_model
+from typing import Optional
+from .media_library import FileLock, hash_file
+
+STEM_CACHE_DIR = os.path.join("temp_outputs", "stems")
+os.makedirs(STEM_CACHE_DIR, exist_ok=True)
+
+DEMUCS_MODEL = os.getenv("DEMUCS_MODEL", "htdemucs")
+# Separation is CPU and memory hungry, so only this many run at once across
+# all worker processes on the host
+DEMUCS_MAX_WORKERS = int(os.getenv("DEMUCS_MAX_WORKERS", "1"))
+DEMUCS_THREADS = int(os.getenv("DEMUCS_THREADS", "2"))
+DEMUCS_SEGMENT_SECONDS = float(os.getenv("DEMUCS_SEGMENT_SECONDS", "7.8"))
+# Locks held by a dead process are taken over at once (see FileLock); this only
+# applies when the holder's PID can't be read from the lock file
+SEPARATION_TIMEOUT = 3600
+
+_model = None
+
+
+def _get_model():
+    """Load the Demucs model once per process"""
+    global _model
+    if _model is None:
+        _model = get_model(DEMUCS_MODEL)
+        _model.cpu()
+        _model.eval()
+    return _model
+
+
+def _acquire_worker_slot() -> FileLock:
+    """Block until one of the DEMUCS_MAX_WORKERS separation slots is free"""
+    while True:
+        for i in range(DEMUCS_MAX_WORKERS):
+            slot = FileLock(os.path.join(STEM_CACHE_DIR, "slots", f"slot_{i}.lock"), timeout=SEPARATION_TIMEOUT)
+            if slot.acquire(blocking=False):
+                return slot
+        time.sleep(0.5)
+
+
+def separate_drums(music_path: str, audio_hash: Optional[str] = None) -> str:
+    """
+    Return the path of a mono drum stem for the track, separating it with
+    Demucs on CPU if it is not cached yet. Stems are cached by the SHA-256 of
+    the audio, so each track is separated only once.
+    """
+    audio_hash = audio_hash or hash_file(music_path)
+    stem_path = os.path.join(STEM_CACHE_DIR, f"{audio_hash}_drums.wav")
+    if os.path.exists(stem_path):
+        print(f"Using cached drum stem: {stem_path}")
+        return stem_path
+
+    # Jobs for the same track wait for a single separation
+    with FileLock(f"{stem_path}.lock", timeout=SEPARATION_TIMEOUT):
+        if os.path.exists(stem_path):
+            return stem_path
+
+        slot = _acquire_worker_slot()
+        try:
+            start = time.time()
+            torch.set_num_threads(DEMUCS_THREADS)
+            model = _get_model()
+
+            wav = AudioFile(music_path).read(
+                streams=0, samplerate=model.samplerate, channels=model.audio_channels)
+            ref = wav.mean(0)
+            wav = (wav - ref.mean()) / ref.std()
+
+            # split=True runs the model over overlapping chunks of the track
+            segment = min(DEMUCS_SEGMENT_SECONDS, float(getattr(model, "segment", DEMUCS_SEGMENT_SECONDS)))
+            with torch.no_grad():
+                sources = apply_model(
+                    model, wav[None], device="cpu", shifts=0, split=True,
+                    segment=segment, overlap=0.25, progress=False
+                )[0]
+            sources = sources * ref.std() + ref.mean()
+            drums = sources[model.sources.index("drums")].mean(0).numpy()
+
+            tmp_path = f"{stem_path}.{os.getpid()}.tmp.wav"
+            sf.write(tmp_path, drums, model.samplerate)
+            os.replace(tmp_path, stem_path)
+            print(f"Separated drum stem in {time.time() - start:.1f}s: {stem_path}")
+        finally:
+            slot.release()
+
+    return stem_path
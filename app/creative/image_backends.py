@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import os
+import random
+import tempfile
+import time
+import uuid
+from typing import Optional
+
+# "stable_cascade" calls the Hugging Face Space, "local" renders placeholder
+# images on this machine so the thumbnail endpoints can be load-tested offline
+IMAGE_BACKEND = os.getenv("IMAGE_BACKEND", "stable_cascade")
+IMAGE_MAX_CONCURRENCY = int(os.getenv("IMAGE_MAX_CONCURRENCY", "2"))
+IMAGE_TIMEOUT = float(os.getenv("IMAGE_TIMEOUT", "180"))
+STABLE_CASCADE_SPACE = os.getenv("STABLE_CASCADE_SPACE", "multimodalart/stable-cascade")
+LOCAL_BACKEND_LATENCY = float(os.getenv("LOCAL_IMAGE_LATENCY", "0"))
+
+
+class ImageGenerationError(Exception):
+    pass
+
+
+class ImageBackend:
+    """
+    Base class for image generators. Calls run concurrently up to
+    max_concurrency; the rest wait in line and are reported as queue depth.
+    """
+    name = "base"
+
+    def __init__(self, max_concurrency: int = IMAGE_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+
+    async def generate(self, prompt: str, negative_prompt: str = "", width: int = 1536,
+                       height: int = 864, seed: Optional[int] = None) -> str:
+        """Generate one image and return the path of the (temporary) file"""
+        seed = seed if seed is not None else random.randint(1, 999999)
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        start = time.perf_counter()
+        try:
+            path = await asyncio.wait_for(
+                self._generate(prompt, negative_prompt, width, height, seed), timeout=IMAGE_TIMEOUT)
+            self.completed += 1
+            self.total_latency += time.perf_counter() - start
+            return path
+        except asyncio.TimeoutError:
+            self.failed += 1
+            raise ImageGenerationError(f"Image generation timed out after {IMAGE_TIMEOUT:.0f}s")
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    async def _generate(self, prompt: str, negative_prompt: str, width: int, height: int, seed: int) -> str:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_latency": round(self.total_latency / self.completed, 2) if self.completed else None
+        }
+
+
+class StableCascadeBackend(ImageBackend):
+    """
+    Stable Cascade on Hugging Face Spaces through a pool of long-lived
+    gradio clients, so the Space config is only fetched when a client is
+    created rather than on every request.
+    """
+    name = "stable_cascade"
+
+    def __init__(self, max_concurrency: int = IMAGE_MAX_CONCURRENCY):
+        super().__init__(max_concurrency)
+        self._clients = []
+
+    async def _acquire_client(self):
+        if self._clients:
+            return self._clients.pop()
+        from gradio_client import Client
+        print(f"Creating gradio client for {STABLE_CASCADE_SPACE}")
+        return await asyncio.to_thread(Client, STABLE_CASCADE_SPACE)
+
+    async def _generate(self, prompt: str, negative_prompt: str, width: int, height: int, seed: int) -> str:
+        # The semaphore bounds concurrency, so the pool never exceeds max_concurrency clients
+        client = await self._acquire_client()
+        try:
+            result = await asyncio.to_thread(
+                client.predict,
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                seed=seed,
+                width=width,
+                height=height,
+                prior_num_inference_steps=20,
+                prior_guidance_scale=4,
+                decoder_num_inference_steps=10,
+                decoder_guidance_scale=0,
+                num_images_per_prompt=1,
+                api_name="/run"
+            )
+        except BaseException:
+            # Don't hand a broken (or timed out and still busy) client to the next request
+            client = None
+            raise
+        finally:
+            if client is not None:
+                self._clients.append(client)
+
+        print(f"Stable Cascade result: {result}")
+        if isinstance(result, str):
+            return result
+        if isinstance(result, list) and len(result) > 0:
+            return result[0]
+        raise ImageGenerationError(f"Unexpected result format: {type(result)}")
+
+
+class LocalBackend(ImageBackend):
+    """Renders a gradient placeholder seeded from the prompt, without any network calls"""
+    name = "local"
+
+    def __init__(self, max_concurrency: int = IMAGE_MAX_CONCURRENCY):
+        super().__init__(max_concurrency)
+        self.output_dir = os.path.join(tempfile.gettempdir(), "alphagen_local_images")
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def _render(self, prompt: str, width: int, height: int, seed: int) -> str:
+        from PIL import Image, ImageDraw
+
+        digest = hashlib.sha256(f"{prompt}{seed}".encode()).digest()
+        start, end = digest[:3], digest[3:6]
+        image = Image.new("RGB", (width, height))
+        draw = ImageDraw.Draw(image)
+        for x in range(width):
+            t = x / max(width - 1, 1)
+            draw.line([(x, 0), (x, height)], fill=tuple(int(a + (b - a) * t) for a, b in zip(start, end)))
+
+        path = os.path.join(self.output_dir, f"{uuid.uuid4()}.webp")
+        image.save(path, "WEBP", quality=80)
+        return path
+
+    async def _generate(self, prompt: str, negative_prompt: str, width: int, height: int, seed: int) -> str:
+        if LOCAL_BACKEND_LATENCY:
+            await asyncio.sleep(LOCAL_BACKEND_LATENCY)
+        return await asyncio.to_thread(self._render, prompt, width, height, seed)
+
+
+BACKENDS = {
+    "stable_cascade": StableCascadeBackend,
+    "local": LocalBackend,
+}
+
+_backend = None
+
+
+def get_image_backend() -> ImageBackend:
+    global _backend
+    if _backend is None:
+        if IMAGE_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown IMAGE_BACKEND {IMAGE_BACKEND}, expected one of {', '.join(BACKENDS)}")
+        _backend = BACKENDS[IMAGE_BACKEND]()
+    return _backend
@@ -0,0 +1,48 @@
+import os
+import pickle
+import threading
+
+JOB_STATUS_DIR = "temp_uploads"
+os.makedirs(JOB_STATUS_DIR, exist_ok=True)
+
+
+# Using a simple file-based storage for job status
+# This avoids multiprocessing Manager issues on Windows
+class JobStorage:
+    @staticmethod
+    def _get_job_path(job_id):
+        return os.path.join(JOB_STATUS_DIR, f"{job_id}_status.pkl")
+
+    @staticmethod
+    def save_job(job_id, job_data):
+        # Written to a temp file first so a concurrent load never sees half a pickle
+        path = JobStorage._get_job_path(job_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(job_data, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load_job(job_id):
+        try:
+            with open(JobStorage._get_job_path(job_id), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def delete_job(job_id):
+        try:
+            os.remove(JobStorage._get_job_path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+class VideoJob:
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.status = "processing"
+        self.progress = 0
+        self.output_path = None
+        self.error = None
+        self.progress_messages = []
@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import List, Optional
+
+MEDIA_DIR = "media_library"
+HASH_CHUNK_SIZE = 1024 * 1024
+LOCK_TIMEOUT = 30  # seconds before a lock file is considered stale
+# Owner of references taken before references had owners, releasable without a token
+LEGACY_OWNER = "upload:legacy"
+PROXY_RESOLUTION = (1280, 720)
+
+
+def pid_alive(pid: int) -> bool:
+    """Whether a process with this PID is running on this host"""
+    if os.name == "nt":
+        import ctypes
+
+        # os.kill would terminate the process on Windows, so ask for its exit code
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FileLock:
+    """
+    Cross-process lock based on exclusive creation of a lock file. Works the
+    same on Windows and Linux, so it is safe to use from worker processes.
+    The file holds the owner's PID: a lock whose owner has died is taken
+    over right away, `timeout` only applies when the owner can't be read.
+    """
+    def __init__(self, path: str, timeout: float = LOCK_TIMEOUT, poll_interval: float = 0.05):
+        self.path = path
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    def acquire(self, blocking: bool = True) -> bool:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return True
+            except FileExistsError:
+                try:
+                    if self._is_stale():
+                        os.remove(self.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if not blocking:
+                    return False
+                time.sleep(self.poll_interval)
+
+    def _owner(self) -> Optional[int]:
+        with open(self.path) as f:
+            content = f.read().strip()
+        return int(content) if content.isdigit() else None
+
+    def _is_stale(self) -> bool:
+        owner = self._owner()
+        if owner == os.getpid():
+            # Held by another thread of this process, which is alive by definition
+            return False
+        if owner is not None:
+            return not pid_alive(owner)
+        # Just created and not written yet, or unreadable
+        return time.time() - os.path.getmtime(self.path) > self.timeout
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_valid_media_id(media_id: str) -> bool:
+    return len(media_id) == 64 and all(c in "0123456789abcdef" for c in media_id)
+
+
+class MediaLibrary:
+    """
+    Content-addressed store for source clips and music. Media is keyed by the
+    SHA-256 of its bytes and reference counted: every upload and every job
+    using the media holds a reference, and the file (with its derived
+    artifacts) is removed when the last reference is released. Each
+    reference has an owner ("upload:{token}" or "job:{job_id}") and only
+    that owner can release it.
+
+    Layout:
+        objects/{id[:2]}/{id}{ext}   original bytes
+        meta/{id}.json               metadata and reference count
+        derived/{id}/...             proxies, probes, beat analysis
+    """
+    def __init__(self, root: str = MEDIA_DIR):
+        self.root = root
+        for sub in ("objects", "meta", "derived", "locks", "incoming"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def _meta_path(self, media_id: str) -> str:
+        return os.path.join(self.root, "meta", f"{media_id}.json")
+
+    def _lock(self, media_id: str) -> FileLock:
+        return FileLock(os.path.join(self.root, "locks", f"{media_id}.lock"))
+
+    def _write_meta(self, media_id: str, meta: dict):
+        tmp_path = f"{self._meta_path(media_id)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(media_id))
+
+    def incoming_path(self, name: str) -> str:
+        """Scratch location for uploads that have not been hashed yet"""
+        return os.path.join(self.root, "incoming", name)
+
+    def get(self, media_id: str) -> Optional[dict]:
+        if not is_valid_media_id(media_id):
+            return None
+        try:
+            with open(self._meta_path(media_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _holders(meta: dict) -> List[str]:
+        # Entries from before references had owners only have a count
+        return meta.setdefault("holders", [LEGACY_OWNER] * meta.get("refs", 0))
+
+    @staticmethod
+    def public(meta: dict) -> dict:
+        """Metadata safe to return to clients; holders include upload tokens"""
+        return {k: v for k, v in meta.items() if k not in ("holders", "deduplicated")}
+
+    def exists(self, media_id: str) -> bool:
+        return self.get(media_id) is not None
+
+    def object_path(self, media_id: str) -> Optional[str]:
+        meta = self.get(media_id)
+        if not meta:
+            return None
+        return os.path.join(self.root, meta["path"])
+
+    def add_file(self, source_path: str, filename: str = "", content_type: str = "",
+                 owner: str = LEGACY_OWNER) -> dict:
+        """
+        Move a file into the library and take a reference on it for `owner`.
+        If the same content is already stored, the source is discarded and
+        the existing entry is reused.
+        """
+        media_id = hash_file(source_path)
+        with self._lock(media_id):
+            meta = self.get(media_id)
+            if meta:
+                os.remove(source_path)
+                self._holders(meta).append(owner)
+                meta["refs"] = len(meta["holders"])
+                meta["deduplicated"] = True
+            else:
+                _, ext = os.path.splitext(filename or source_path)
+                relative_path = os.path.join("objects", media_id[:2], f"{media_id}{ext.lower()}")
+                os.makedirs(os.path.join(self.root, "objects", media_id[:2]), exist_ok=True)
+                shutil.move(source_path, os.path.join(self.root, relative_path))
+                meta = {
+                    "id": media_id,
+                    "path": relative_path,
+                    "filename": filename,
+                    "content_type": content_type,
+                    "size": os.path.getsize(os.path.join(self.root, relative_path)),
+                    "created": datetime.utcnow().isoformat(),
+                    "refs": 1,
+                    "holders": [owner],
+                    "deduplicated": False
+                }
+            self._write_meta(media_id, {k: v for k, v in meta.items() if k != "deduplicated"})
+        return meta
+
+    def acquire(self, media_id: str, owner: str) -> bool:
+        """Take a reference on existing media, e.g. for the lifetime of a job"""
+        with self._lock(media_id):
+            meta = self.get(media_id)
+            if not meta:
+                return False
+            self._holders(meta).append(owner)
+            meta["refs"] = len(meta["holders"])
+            self._write_meta(media_id, meta)
+        return True
+
+    def release(self, media_id: str, owner: str) -> bool:
+        """
+        Drop a reference held by `owner` and delete the media once nothing
+        references it. Returns False if `owner` holds no reference.
+        """
+        with self._lock(media_id):
+            meta = self.get(media_id)
+            if not meta or owner not in self._holders(meta):
+                return False
+            meta["holders"].remove(owner)
+            meta["refs"] = len(meta["holders"])
+            if meta["refs"] > 0:
+                self._write_meta(media_id, meta)
+                return True
+
+            try:
+                os.remove(os.path.join(self.root, meta["path"]))
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(os.path.join(self.root, "derived", media_id), ignore_errors=True)
+            os.remove(self._meta_path(media_id))
+            print(f"Removed unreferenced media {media_id}")
+        return True
+
+    def derived_path(self, media_id: str, name: str) -> str:
+        derived_dir = os.path.join(self.root, "derived", media_id)
+        os.makedirs(derived_dir, exist_ok=True)
+        return os.path.join(derived_dir, name)
+
+    def load_derived_json(self, media_id: str, name: str) -> Optional[dict]:
+        try:
+            with open(self.derived_path(media_id, name)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save_derived_json(self, media_id: str, name: str, data: dict):
+        path = self.derived_path(media_id, name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def get_probe(self, media_id: str) -> dict:
+        """Duration, size and fps of a video, probed once and stored"""
+        from moviepy import VideoFileClip
+
+        probe = self.load_derived_json(media_id, "probe.json")
+        if probe:
+            return probe
+
+        clip = VideoFileClip(self.object_path(media_id), audio=False)
+        try:
+            probe = {"duration": clip.duration, "size": list(clip.size), "fps": clip.fps}
+        finally:
+            clip.close()
+        self.save_derived_json(media_id, "probe.json", probe)
+        return probe
+
+    def get_proxy(self, media_id: str) -> str:
+        """
+        Path to an HD proxy of a video that the sync renderer can use without
+        resizing every frame. The proxy is rendered once and then reused.
+        """
+        from moviepy import VideoFileClip
+
+        proxy_path = self.derived_path(media_id, f"proxy_{PROXY_RESOLUTION[0]}x{PROXY_RESOLUTION[1]}.mp4")
+        if os.path.exists(proxy_path):
+            return proxy_path
+
+        with FileLock(f"{proxy_path}.lock", timeout=600):
+            if os.path.exists(proxy_path):
+                return proxy_path
+
+            clip = VideoFileClip(self.object_path(media_id), audio=False)
+            try:
+                if tuple(clip.size) == PROXY_RESOLUTION:
+                    return self.object_path(media_id)
+                tmp_path = f"{proxy_path}.{os.getpid()}.tmp.mp4"
+                clip.resized(PROXY_RESOLUTION).write_videofile(
+                    tmp_path, codec="libx264", audio=False, preset="veryfast", logger=None)
+                os.replace(tmp_path, proxy_path)
+            finally:
+                clip.close()
+
+        print(f"Created proxy for media {media_id}")
+        return proxy_path
+
+
+library = MediaLibrary()
@@ -0,0 +1,301 @@
+import json
+import os
+import threading
+import time
+import traceback
+import numpy as np
+import soundfile as sf
+from multiprocessing import Process
+from typing import List, Optional
+from .job_storage import JobStorage
+from .media_library import FileLock, pid_alive
+
+# "stub" selects a tiny stand-in model that synthesizes tones, for tests
+MUSICGEN_MODEL = os.getenv("MUSICGEN_MODEL", "facebook/musicgen-small")
+MUSICGEN_MAX_BATCH = int(os.getenv("MUSICGEN_MAX_BATCH", "4"))
+# Prompts whose durations differ by at most this many seconds share a batch
+MUSICGEN_DURATION_TOLERANCE = float(os.getenv("MUSICGEN_DURATION_TOLERANCE", "5"))
+MUSICGEN_BATCH_WAIT = float(os.getenv("MUSICGEN_BATCH_WAIT", "0.5"))
+MUSICGEN_THREADS = int(os.getenv("MUSICGEN_THREADS", "4"))
+MUSICGEN_POLL_INTERVAL = float(os.getenv("MUSICGEN_POLL_INTERVAL", "0.2"))
+# Pause before a worker that exited is restarted for requests still waiting
+MUSICGEN_RESTART_DELAY = float(os.getenv("MUSICGEN_RESTART_DELAY", "5"))
+
+
+class StubMusicGen:
+    """Stand-in with the MusicGen interface that renders a short chord per prompt"""
+    sample_rate = 16000
+
+    def __init__(self):
+        self.duration = 8.0
+
+    def set_generation_params(self, duration: float = 8.0, **kwargs):
+        self.duration = duration
+
+    def generate(self, descriptions: List[str], progress: bool = False):
+        t = np.arange(int(self.duration * self.sample_rate)) / self.sample_rate
+        wavs = []
+        for description in descriptions:
+            root = 110 + (sum(map(ord, description)) % 220)
+            wav = sum(np.sin(2 * np.pi * root * ratio * t) for ratio in (1, 1.25, 1.5)) / 3
+            wavs.append(0.3 * wav[None, :])
+        return np.stack(wavs).astype(np.float32)
+
+
+def load_music_model():
+    if MUSICGEN_MODEL == "stub":
+        return StubMusicGen()
+
+    import torch
+    from audiocraft.models import MusicGen
+
+    torch.set_num_threads(MUSICGEN_THREADS)
+    return MusicGen.get_pretrained(MUSICGEN_MODEL, device="cpu")
+
+
+def _take_batch(pending: List[dict]) -> List[dict]:
+    """Oldest request plus queued requests of a similar duration"""
+    first = pending[0]
+    batch = [first]
+    for request in pending[1:]:
+        if len(batch) >= MUSICGEN_MAX_BATCH:
+            break
+        if abs(request["duration"] - first["duration"]) <= MUSICGEN_DURATION_TOLERANCE:
+            batch.append(request)
+    for request in batch:
+        pending.remove(request)
+    return batch
+
+
+def update_job(job_id: str, message: str, **changes):
+    job = JobStorage.load_job(job_id)
+    if not job:
+        return
+    for key, value in changes.items():
+        setattr(job, key, value)
+    job.progress_messages.append(message)
+    JobStorage.save_job(job_id, job)
+
+
+class MusicQueue:
+    """
+    Request queue shared by every server process on the host, kept as files:
+    pending/ holds submitted requests in order, active/{pid}/ the requests a
+    worker process has taken. Taking a request is an atomic rename, so
+    requests submitted while a worker drains the queue stay pending.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.pending_dir = os.path.join(root, "pending")
+        self.active_root = os.path.join(root, "active")
+        os.makedirs(self.pending_dir, exist_ok=True)
+        os.makedirs(self.active_root, exist_ok=True)
+
+    def worker_lock(self) -> FileLock:
+        """Held by the one worker process running on the host"""
+        return FileLock(os.path.join(self.root, "worker.lock"))
+
+    def worker_running(self) -> bool:
+        try:
+            owner = self.worker_lock()._owner()
+        except FileNotFoundError:
+            return False
+        # No PID yet means the lock was just created by a starting worker
+        return owner is None or pid_alive(owner)
+
+    def put(self, request: dict):
+        name = f"{time.time_ns()}_{request['job_id']}.json"
+        tmp_path = os.path.join(self.root, f"{name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(request, f)
+        os.replace(tmp_path, os.path.join(self.pending_dir, name))
+
+    def has_pending(self) -> bool:
+        return any(name.endswith(".json") for name in os.listdir(self.pending_dir))
+
+    def take(self, limit: Optional[int] = None) -> List[dict]:
+        """Move up to `limit` of the oldest pending requests to this process's active directory"""
+        active_dir = os.path.join(self.active_root, str(os.getpid()))
+        os.makedirs(active_dir, exist_ok=True)
+        taken = []
+        for name in sorted(os.listdir(self.pending_dir)):
+            if limit is not None and len(taken) >= limit:
+                break
+            if not name.endswith(".json"):
+                continue
+            try:
+                os.replace(os.path.join(self.pending_dir, name), os.path.join(active_dir, name))
+            except FileNotFoundError:
+                continue
+            with open(os.path.join(active_dir, name)) as f:
+                taken.append({**json.load(f), "file": name})
+        return taken
+
+    def done(self, request: dict):
+        try:
+            os.remove(os.path.join(self.active_root, str(os.getpid()), request["file"]))
+        except FileNotFoundError:
+            pass
+
+    def fail_abandoned(self) -> int:
+        """Fail the requests taken by worker processes that are no longer running"""
+        failed = 0
+        for pid in os.listdir(self.active_root):
+            if not pid.isdigit() or pid_alive(int(pid)):
+                continue
+            active_dir = os.path.join(self.active_root, pid)
+            # The server process that started the worker and a newly started
+            # worker may both get here; whoever removes a request fails it
+            for name in os.listdir(active_dir) if os.path.isdir(active_dir) else []:
+                path = os.path.join(active_dir, name)
+                try:
+                    with open(path) as f:
+                        job_id = json.load(f)["job_id"]
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Could not read abandoned music request {name}: {e}")
+                    continue
+                update_job(job_id, "Music worker stopped unexpectedly", status="failed", progress=0,
+                           error="Music worker stopped unexpectedly")
+                failed += 1
+            try:
+                os.rmdir(active_dir)
+            except OSError:
+                pass
+        if failed:
+            print(f"Failed {failed} music jobs of a stopped worker")
+        return failed
+
+
+def musicgen_worker(queue_root: str, output_dir: str):
+    """
+    Long-lived process that keeps the MusicGen model warm. Only one runs per
+    host: it holds the queue's worker lock, and a second one exits at once.
+    Queued prompts of similar duration are generated together in one call,
+    then each result is trimmed to its requested length and written to
+    {output_dir}/{job_id}.wav. If the model can't be loaded, the requests
+    queued so far are failed and the process exits.
+    """
+    requests = MusicQueue(queue_root)
+    lock = requests.worker_lock()
+    if not lock.acquire(blocking=False):
+        print("MusicGen worker already running on this host")
+        return
+    try:
+        # Requests left behind by a worker that died before this one started
+        requests.fail_abandoned()
+        _run_worker(requests, output_dir)
+    finally:
+        lock.release()
+
+
+def _run_worker(requests: MusicQueue, output_dir: str):
+    def finish(request: dict, message: str, **changes):
+        update_job(request["job_id"], message, **changes)
+        requests.done(request)
+
+    start = time.time()
+    try:
+        model = load_music_model()
+    except Exception as e:
+        print(f"MusicGen worker could not load {MUSICGEN_MODEL}: {e}")
+        traceback.print_exc()
+        for request in requests.take():
+            finish(request, "Music generation failed", status="failed", progress=0,
+                   error=f"Could not load music model: {e}")
+        return
+    print(f"MusicGen worker ready ({MUSICGEN_MODEL}) in {time.time() - start:.1f}s")
+
+    def receive(limit: int) -> List[dict]:
+        taken = requests.take(limit)
+        for request in taken:
+            # Taken off the queue: if this process dies now, the job is failed
+            update_job(request["job_id"], "Waiting for a generation batch", status="processing", progress=5)
+        return taken
+
+    pending = []
+    while True:
+        if not pending:
+            pending = receive(MUSICGEN_MAX_BATCH * 2)
+            if not pending:
+                time.sleep(MUSICGEN_POLL_INTERVAL)
+                continue
+
+        # Give concurrent requests a moment to arrive so they can share a batch
+        deadline = time.time() + MUSICGEN_BATCH_WAIT
+        while len(pending) < MUSICGEN_MAX_BATCH * 2 and time.time() < deadline:
+            taken = receive(MUSICGEN_MAX_BATCH * 2 - len(pending))
+            pending.extend(taken)
+            if not taken:
+                time.sleep(min(MUSICGEN_POLL_INTERVAL, max(0, deadline - time.time())))
+
+        batch = _take_batch(pending)
+        for request in batch:
+            update_job(request["job_id"], f"Generating in a batch of {len(batch)}",
+                       status="processing", progress=10)
+
+        try:
+            start = time.time()
+            model.set_generation_params(duration=max(r["duration"] for r in batch))
+            wavs = model.generate([r["prompt"] for r in batch], progress=False)
+            if hasattr(wavs, "cpu"):
+                wavs = wavs.cpu().numpy()
+            print(f"Generated {len(batch)} tracks in {time.time() - start:.1f}s")
+
+            for request, wav in zip(batch, wavs):
+                samples = int(request["duration"] * model.sample_rate)
+                output_path = os.path.join(output_dir, f"{request['job_id']}.wav")
+                sf.write(output_path, wav[:, :samples].T, model.sample_rate)
+                finish(request, "Music generation completed",
+                       status="completed", progress=100, output_path=output_path)
+        except Exception as e:
+            print(f"Error in musicgen_worker: {e}")
+            traceback.print_exc()
+            for request in batch:
+                finish(request, "Music generation failed", status="failed", progress=0, error=str(e))
+
+
+class MusicGenService:
+    """
+    Feeds requests to the host's MusicGen worker, starting it on first use.
+    Every server process submits to the same file queue and at most one
+    worker (one copy of the model) runs per host. The process that started
+    the worker watches it: when it exits, the jobs it had taken are failed
+    right away, and it is restarted if requests are still waiting.
+    """
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.queue = MusicQueue(os.path.join(output_dir, "music_queue"))
+        self.process = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self.process is not None and self.process.is_alive():
+                return
+            if self.queue.worker_running():
+                # Started by another server process
+                return
+            self.process = Process(target=musicgen_worker, args=(self.queue.root, self.output_dir),
+                                   name="musicgen-worker", daemon=True)
+            self.process.start()
+            threading.Thread(target=self._monitor, args=(self.process,), name="musicgen-monitor",
+                             daemon=True).start()
+
+    def _monitor(self, process: Process):
+        process.join()
+        if process.exitcode:
+            print(f"MusicGen worker exited with code {process.exitcode}")
+        try:
+            self.queue.fail_abandoned()
+        except Exception as e:
+            print(f"Could not fail music jobs of the stopped worker: {e}")
+        if self.queue.has_pending():
+            time.sleep(MUSICGEN_RESTART_DELAY)
+            self._ensure_worker()
+
+    def submit(self, job_id: str, prompt: str, duration: float):
+        self.queue.put({"job_id": job_id, "prompt": prompt, "duration": duration})
+        self._ensure_worker()
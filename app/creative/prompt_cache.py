@@ -0,0 +1,80 @@
+import asyncio
+import os
+import re
+import unicodedata
+from cachetools import TTLCache
+from typing import Awaitable, Callable, Tuple
+
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "86400"))  # seconds
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "2048"))
+
+
+def normalize_text(text: str) -> str:
+    """Case, unicode form, whitespace and trailing punctuation don't change the concept"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" .!?,;:")
+
+
+def concept_key(title: str, description: str, style: str) -> Tuple[str, str, str]:
+    return (normalize_text(title), normalize_text(description), normalize_text(style))
+
+
+class PromptCache:
+    """
+    In-process TTL cache for LLM results. Concurrent misses for the same key
+    share a single LLM call instead of each making their own.
+    """
+    def __init__(self, maxsize: int = PROMPT_CACHE_SIZE, ttl: int = PROMPT_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self._cache.get(key)
+        if value is not None:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._cache[key] = value
+
+    async def get_or_create(self, key, factory: Callable[[], Awaitable]):
+        """Return (value, cached)"""
+        value = self.get(key)
+        if value is not None:
+            return value, True
+
+        if key in self._inflight:
+            self.hits += 1
+            return await asyncio.shield(self._inflight[key]), True
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await factory()
+            self.put(key, value)
+            future.set_result(value)
+            return value, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters get the error; mark it retrieved so it isn't logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "ttl": self._cache.ttl
+        }
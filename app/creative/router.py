@@ -1,33 +1,35 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Body, Request
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks, Body, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import shutil
 import os
+import asyncio
 from typing import List, Optional
 import uuid
 import multiprocessing
 from multiprocessing import Process, Manager
-import pickle 
-from pydantic import BaseModel
-from .BeatSyncVideoGenerator import BeatSyncVideoGenerator
-from groq import Groq
+from pydantic import BaseModel, Field
+from .schemas import BEAT_SOURCES, MusicRequest, ThumbnailRequest
+from .job_storage import JobStorage, VideoJob
+from .media_library import library, is_valid_media_id, LEGACY_OWNER
+from .image_backends import get_image_backend
+from .prompt_cache import PromptCache, concept_key
+from .thumbnail_compositor import render_variants, LAYOUTS, THUMBNAIL_DIR
+from .waveform import build_waveform, load_grid, select_level, read_peaks, delete_waveform
+from app.llm_gateway import gateway
 from dotenv import load_dotenv
 import json
 import re
 import random
 from datetime import datetime, timedelta
-from gradio_client import Client
 import requests
 from fastapi.staticfiles import StaticFiles
-
-# Add imports for MusicGen
-from audiocraft.models import musicgen
 import time
 import traceback
 
 load_dotenv()
 
 router = APIRouter(prefix="/creative", tags=["Creative task APIs"])
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 
 TEMP_DIR = "temp_uploads"
 OUTPUT_DIR = "temp_outputs"
@@ -37,41 +39,23 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 # Create directory for storing generated images
 os.makedirs("static/thumbnails", exist_ok=True)
 
-# Using a simple file-based storage for job status
-# This avoids multiprocessing Manager issues on Windows
-class JobStorage:
-    @staticmethod
-    def _get_job_path(job_id):
-        return os.path.join(TEMP_DIR, f"{job_id}_status.pkl")
-        
-    @staticmethod
-    def save_job(job_id, job_data):
-        with open(JobStorage._get_job_path(job_id), 'wb') as f:
-            pickle.dump(job_data, f)
-            
-    @staticmethod
-    def load_job(job_id):
-        try:
-            with open(JobStorage._get_job_path(job_id), 'rb') as f:
-                return pickle.load(f)
-        except FileNotFoundError:
-            return None
-            
-    @staticmethod
-    def delete_job(job_id):
-        try:
-            os.remove(JobStorage._get_job_path(job_id))
-        except FileNotFoundError:
-            pass
-
-class VideoJob:
-    def __init__(self, job_id: str):
-        self.job_id = job_id
-        self.status = "processing"
-        self.progress = 0
-        self.output_path = None
-        self.error = None
-        self.progress_messages = []
+class BatchSyncJob(VideoJob):
+    """A batch of sync variants that share music analysis and loaded clips"""
+    def __init__(self, job_id: str, variants: List[dict]):
+        super().__init__(job_id)
+        self.status = "queued"
+        self.variants = [
+            {
+                "index": i,
+                "music": variant["music"],
+                "videos": variant["videos"],
+                "status": "queued",
+                "progress": 0,
+                "output_path": None,
+                "error": None
+            }
+            for i, variant in enumerate(variants)
+        ]
 
 
 async def save_upload_file(upload_file: UploadFile, destination: str):
@@ -82,9 +66,16 @@ async def save_upload_file(upload_file: UploadFile, destination: str):
         upload_file.file.close()
 
 
-def process_videos_worker(job_id: str, music_file: str, video_files: List[str]):
+def process_videos_worker(job_id: str, music_file: str, video_files: List[str],
+                          music_id: Optional[str] = None, video_ids: Optional[List[str]] = None,
+                          beat_source: str = "mix"):
     """Separate process function for video processing"""
+    from .BeatSyncVideoGenerator import BeatSyncVideoGenerator
+
     generator = None
+    video_ids = video_ids or []
+    # Only per-job uploads are deleted, library media is released instead
+    temp_files = list(video_files) + ([] if music_id else [music_file])
     try:
         # Load job from storage
         job = JobStorage.load_job(job_id)
@@ -102,14 +93,48 @@ def process_videos_worker(job_id: str, music_file: str, video_files: List[str]):
             # Save updated state
             JobStorage.save_job(job_id, job)
 
+        # Library videos are rendered from their stored HD proxies; the stored
+        # probe skips unreadable or empty videos before a proxy is rendered
+        library_videos = []
+        for media_id in video_ids:
+            try:
+                if not library.get_probe(media_id)["duration"]:
+                    print(f"Skipping media {media_id} with zero duration")
+                    continue
+            except Exception as e:
+                print(f"Error probing media {media_id}: {e}")
+                continue
+            try:
+                library_videos.append(library.get_proxy(media_id))
+            except Exception as e:
+                print(f"Warning: Could not create proxy for media {media_id}: {e}")
+                library_videos.append(library.object_path(media_id))
+
         # Create BeatSyncVideoGenerator instance with proper error handling
         generator = BeatSyncVideoGenerator(
             music_path=music_file,
-            video_clips_paths=video_files,
+            video_clips_paths=list(video_files) + library_videos,
             output_path=output_path,
-            progress_callback=progress_callback
+            progress_callback=progress_callback,
+            beat_source=beat_source
         )
 
+        # Analyze up front so the editor can draw the waveform while we render
+        progress_callback("Analyzing music...", 5)
+        analysis_name = f"analysis_{beat_source}.json"
+        analysis = library.load_derived_json(music_id, analysis_name) if music_id else None
+        if analysis:
+            generator.set_analysis(analysis)
+        else:
+            generator.analyze_music()
+            if music_id:
+                library.save_derived_json(music_id, analysis_name, generator.get_analysis())
+        try:
+            build_waveform(job_id, music_file, generator.beat_times,
+                           generator.hooks, generator.music_duration)
+        except Exception as e:
+            print(f"Warning: Could not build waveform for job {job_id}: {e}")
+
         # Generate the video
         generator.generate()
 
@@ -147,27 +172,86 @@ def process_videos_worker(job_id: str, music_file: str, video_files: List[str]):
         time.sleep(1)
         
         # Clean up files with better error handling
-        for file in video_files + [music_file]:
+        for file in temp_files:
             try:
                 if os.path.exists(file):
                     os.remove(file)
             except Exception as e:
                 print(f"Warning: Could not delete temporary file {file}: {e}")
 
+        # Drop the job's references on library media
+        for media_id in ([music_id] if music_id else []) + video_ids:
+            try:
+                library.release(media_id, f"job:{job_id}")
+            except Exception as e:
+                print(f"Warning: Could not release media {media_id}: {e}")
+
+
+def parse_media_ids(value: Optional[str]) -> List[str]:
+    """Accept media ids as a JSON list or a comma separated string"""
+    if not value:
+        return []
+    try:
+        ids = json.loads(value)
+        if isinstance(ids, str):
+            ids = [ids]
+    except json.JSONDecodeError:
+        ids = value.split(",")
+    return [str(media_id).strip() for media_id in ids if str(media_id).strip()]
+
 
 @router.post("/sync-videos")
-async def create_sync_video(music: UploadFile = File(...), videos: List[UploadFile] = File(...)):
+async def create_sync_video(
+    music: Optional[UploadFile] = File(None),
+    videos: Optional[List[UploadFile]] = File(None),
+    music_id: Optional[str] = Form(None),
+    video_ids: Optional[str] = Form(None),
+    beat_source: str = Form("mix")
+):
+    """
+    Start a sync job. Music and videos can be uploaded with the request or
+    referenced by media library id (see /creative/media). Use
+    beat_source="drums" to track beats on a separated drum stem, which is
+    more reliable for vocal-heavy tracks.
+    """
+    if beat_source not in BEAT_SOURCES:
+        raise HTTPException(status_code=400, detail=f"beat_source must be one of {', '.join(BEAT_SOURCES)}")
+
+    videos = videos or []
+    video_media_ids = parse_media_ids(video_ids)
+
+    if not music and not music_id:
+        raise HTTPException(status_code=400, detail="Provide either a music file or a music_id")
+    if not videos and not video_media_ids:
+        raise HTTPException(status_code=400, detail="Provide video files or video_ids")
+
     # Generate unique job ID
     job_id = str(uuid.uuid4())
+    owner = f"job:{job_id}"
+
+    # Reference library media for the lifetime of the job
+    acquired = []
+    for media_id in ([music_id] if music_id and not music else []) + video_media_ids:
+        # acquire takes a file lock that polls with time.sleep, so keep it off the event loop
+        if not is_valid_media_id(media_id) or not await run_in_threadpool(library.acquire, media_id, owner):
+            for held in acquired:
+                await run_in_threadpool(library.release, held, owner)
+            raise HTTPException(status_code=404, detail=f"Media not found: {media_id}")
+        acquired.append(media_id)
+
+    job_dir = os.path.join(TEMP_DIR, job_id)
 
     try:
         # Create job directory
-        job_dir = os.path.join(TEMP_DIR, job_id)
         os.makedirs(job_dir, exist_ok=True)
 
-        # Save music file
-        music_path = os.path.join(job_dir, "music.mp3")
-        await save_upload_file(music, music_path)
+        # Save music file, or use the stored library copy
+        if music:
+            music_path = os.path.join(job_dir, "music.mp3")
+            await save_upload_file(music, music_path)
+            music_id = None
+        else:
+            music_path = library.object_path(music_id)
 
         # Save video files
         video_paths = []
@@ -183,7 +267,7 @@ async def create_sync_video(music: UploadFile = File(...), videos: List[UploadFi
         # Start processing in a completely separate process
         p = Process(
             target=process_videos_worker,
-            args=(job_id, music_path, video_paths)
+            args=(job_id, music_path, video_paths, music_id, video_media_ids, beat_source)
         )
         p.daemon = True  # Daemonize the process
         p.start()
@@ -194,9 +278,67 @@ async def create_sync_video(music: UploadFile = File(...), videos: List[UploadFi
         # Clean up on error
         if os.path.exists(job_dir):
             shutil.rmtree(job_dir)
+        for held in acquired:
+            await run_in_threadpool(library.release, held, owner)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/media")
+async def upload_media(file: UploadFile = File(...)):
+    """
+    Store a clip or track in the media library. Content is deduplicated by its
+    SHA-256, so check /creative/media/lookup first to skip known uploads.
+    The returned upload_token is needed to release this upload's reference.
+    """
+    incoming_path = library.incoming_path(str(uuid.uuid4()))
+    upload_token = uuid.uuid4().hex
+    try:
+        await save_upload_file(file, incoming_path)
+        meta = await run_in_threadpool(library.add_file, incoming_path, file.filename or "",
+                                       file.content_type or "", f"upload:{upload_token}")
+    except Exception as e:
+        if os.path.exists(incoming_path):
+            os.remove(incoming_path)
+        raise HTTPException(status_code=500, detail=f"Error storing media: {str(e)}")
+
+    return {"media_id": meta["id"], **library.public(meta), "deduplicated": meta["deduplicated"],
+            "upload_token": upload_token}
+
+
+class MediaLookupRequest(BaseModel):
+    hashes: List[str]
+
+
+@router.post("/media/lookup")
+async def lookup_media(request: MediaLookupRequest):
+    """Check which SHA-256 hashes are already stored in the media library"""
+    known = [h.lower() for h in request.hashes if library.exists(h.lower())]
+    missing = [h for h in request.hashes if h.lower() not in known]
+    return {"known": known, "missing": missing}
+
+
+@router.get("/media/{media_id}")
+async def get_media(media_id: str):
+    meta = library.get(media_id)
+    if not meta:
+        raise HTTPException(status_code=404, detail="Media not found")
+    return {"media_id": media_id, **library.public(meta)}
+
+
+@router.delete("/media/{media_id}")
+async def delete_media(media_id: str, upload_token: Optional[str] = None):
+    """
+    Release the reference taken by an upload; the media is removed once
+    unreferenced. References held by running jobs can't be released here.
+    """
+    if not library.exists(media_id):
+        raise HTTPException(status_code=404, detail="Media not found")
+    owner = f"upload:{upload_token}" if upload_token else LEGACY_OWNER
+    if not await run_in_threadpool(library.release, media_id, owner):
+        raise HTTPException(status_code=403, detail="This upload token holds no reference to the media")
+    return {"message": "Media released"}
+
+
 @router.get("/status/{job_id}")
 async def get_job_status(job_id: str):
     job = JobStorage.load_job(job_id)
@@ -244,22 +386,414 @@ async def cleanup_job(job_id: str):
     if job.output_path and os.path.exists(job.output_path):
         os.remove(job.output_path)
 
+    delete_waveform(job_id)
     JobStorage.delete_job(job_id)
     return {"message": "Cleanup completed"}
 
 
-# Define request and response models
-class ThumbnailRequest(BaseModel):
-    video_title: str
-    video_description: Optional[str] = ""
-    style: Optional[str] = "Modern, Professional"
+def process_batch_worker(batch_id: str, music_files: List[str], video_files: List[str], beat_source: str = "mix"):
+    """
+    Separate process function for batch processing. Each distinct track is
+    analyzed once and each distinct clip is opened (and probed) once, then
+    every variant is rendered in turn from the shared analysis and clips.
+    """
+    from moviepy import VideoFileClip
+    from .BeatSyncVideoGenerator import BeatSyncVideoGenerator
+
+    clips = {}
+
+    def update_batch(**changes):
+        job = JobStorage.load_job(batch_id)
+        for key, value in changes.items():
+            setattr(job, key, value)
+        job.progress = round(sum(v["progress"] for v in job.variants) / len(job.variants), 1)
+        JobStorage.save_job(batch_id, job)
+        return job
+
+    def update_variant(index: int, message: Optional[str] = None, **changes):
+        job = JobStorage.load_job(batch_id)
+        job.variants[index].update(changes)
+        if message:
+            job.progress_messages.append(f"Variant {index}: {message}")
+        job.progress = round(sum(v["progress"] for v in job.variants) / len(job.variants), 1)
+        JobStorage.save_job(batch_id, job)
+
+    try:
+        job = update_batch(status="processing")
+        variants = job.variants
+
+        # Shared music analysis, one per distinct track
+        analyses = {}
+        for music_index in sorted({v["music"] for v in variants}):
+            analyzer = BeatSyncVideoGenerator(
+                music_path=music_files[music_index], video_clips_paths=[], output_path="",
+                beat_source=beat_source)
+            analyzer.analyze_music()
+            analyses[music_index] = analyzer.get_analysis()
+            job = JobStorage.load_job(batch_id)
+            job.progress_messages.append(f"Analyzed music {music_index}")
+            JobStorage.save_job(batch_id, job)
+
+        # Shared clips, each file is opened and probed once for all variants
+        for video_index in sorted({i for v in variants for i in v["videos"]}):
+            try:
+                clip = VideoFileClip(video_files[video_index], audio=False)
+                if clip.duration > 0:
+                    clips[video_index] = clip
+                else:
+                    clip.close()
+                    print(f"Skipping clip with zero duration: {video_files[video_index]}")
+            except Exception as e:
+                print(f"Error loading clip {video_files[video_index]}: {e}")
+
+        for variant in variants:
+            index = variant["index"]
+            output_path = os.path.join(OUTPUT_DIR, f"{batch_id}_{index}.mp4")
+
+            def progress_callback(stage: str, progress: float, index=index):
+                update_variant(index, f"{stage}: {progress}%", progress=progress)
+
+            try:
+                variant_clips = [clips[i] for i in variant["videos"] if i in clips]
+                if not variant_clips:
+                    raise ValueError("No valid video clips were loaded")
+
+                update_variant(index, "Rendering started", status="processing")
+                generator = BeatSyncVideoGenerator(
+                    music_path=music_files[variant["music"]],
+                    video_clips_paths=[video_files[i] for i in variant["videos"]],
+                    output_path=output_path,
+                    progress_callback=progress_callback
+                )
+                generator.set_analysis(analyses[variant["music"]])
+                generator.clips = variant_clips
+                generator.generate(close_clips=False)
+
+                update_variant(index, "Video generation completed",
+                               status="completed", progress=100, output_path=output_path)
+            except Exception as e:
+                print(f"Error rendering variant {index} of batch {batch_id}: {e}")
+                traceback.print_exc()
+                update_variant(index, "Failed", status="failed", error=str(e))
+
+        job = JobStorage.load_job(batch_id)
+        failed = [v for v in job.variants if v["status"] == "failed"]
+        if len(failed) == len(job.variants):
+            update_batch(status="failed", error="All variants failed")
+        else:
+            update_batch(status="completed")
+
+    except Exception as e:
+        print(f"Error in process_batch_worker: {e}")
+        traceback.print_exc()
+        update_batch(status="failed", error=str(e))
+    finally:
+        for clip in clips.values():
+            try:
+                clip.close()
+            except:
+                pass
+
+        time.sleep(1)
+
+        for file in video_files + music_files:
+            try:
+                if os.path.exists(file):
+                    os.remove(file)
+            except Exception as e:
+                print(f"Warning: Could not delete temporary file {file}: {e}")
+
+
+def parse_batch_variants(variants: Optional[str], music_count: int, video_count: int) -> List[dict]:
+    """
+    Parse the variants spec, a JSON list like [{"music": 0, "videos": [0, 2]}].
+    Without a spec every track is synced against all uploaded videos.
+    """
+    if not variants:
+        return [{"music": m, "videos": list(range(video_count))} for m in range(music_count)]
+
+    try:
+        parsed = json.loads(variants)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid variants JSON: {str(e)}")
+
+    if not isinstance(parsed, list) or not parsed:
+        raise HTTPException(status_code=400, detail="Variants must be a non-empty list")
+
+    result = []
+    for i, variant in enumerate(parsed):
+        music_index = variant.get("music", 0) if isinstance(variant, dict) else None
+        video_indexes = variant.get("videos") if isinstance(variant, dict) else None
+        if not isinstance(music_index, int) or not 0 <= music_index < music_count:
+            raise HTTPException(status_code=400, detail=f"Variant {i}: invalid music index")
+        if not video_indexes or not all(isinstance(v, int) and 0 <= v < video_count for v in video_indexes):
+            raise HTTPException(status_code=400, detail=f"Variant {i}: invalid video indexes")
+        result.append({"music": music_index, "videos": video_indexes})
+
+    return result
+
+
+@router.post("/sync-batch")
+async def create_sync_batch(
+    music: List[UploadFile] = File(...),
+    videos: List[UploadFile] = File(...),
+    variants: Optional[str] = Form(None),
+    beat_source: str = Form("mix")
+):
+    """
+    Render several sync variants (one track against many clip sets, or many
+    tracks against the same footage) as a single job.
+    """
+    batch_id = str(uuid.uuid4())
+    batch_dir = os.path.join(TEMP_DIR, batch_id)
+
+    if beat_source not in BEAT_SOURCES:
+        raise HTTPException(status_code=400, detail=f"beat_source must be one of {', '.join(BEAT_SOURCES)}")
+
+    variant_specs = parse_batch_variants(variants, len(music), len(videos))
+
+    try:
+        os.makedirs(batch_dir, exist_ok=True)
+
+        music_paths = []
+        for i, track in enumerate(music):
+            music_path = os.path.join(batch_dir, f"music_{i}.mp3")
+            await save_upload_file(track, music_path)
+            music_paths.append(music_path)
+
+        video_paths = []
+        for i, video in enumerate(videos):
+            video_path = os.path.join(batch_dir, f"video_{i}.mp4")
+            await save_upload_file(video, video_path)
+            video_paths.append(video_path)
+
+        job = BatchSyncJob(batch_id, variant_specs)
+        JobStorage.save_job(batch_id, job)
+
+        p = Process(
+            target=process_batch_worker,
+            args=(batch_id, music_paths, video_paths, beat_source)
+        )
+        p.daemon = True
+        p.start()
+
+        return {"batch_id": batch_id, "variant_count": len(variant_specs), "message": "Processing started"}
+
+    except Exception as e:
+        if os.path.exists(batch_dir):
+            shutil.rmtree(batch_dir)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/sync-batch/{batch_id}/status")
+async def get_batch_status(batch_id: str):
+    job = JobStorage.load_job(batch_id)
+    if not job or not isinstance(job, BatchSyncJob):
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    return {
+        "status": job.status,
+        "progress": job.progress,
+        "progress_messages": job.progress_messages,
+        "error": job.error,
+        "variants": [
+            {key: value for key, value in variant.items() if key != "output_path"}
+            for variant in job.variants
+        ]
+    }
+
+
+@router.get("/sync-batch/{batch_id}/download/{variant_index}")
+async def download_batch_variant(batch_id: str, variant_index: int):
+    job = JobStorage.load_job(batch_id)
+    if not job or not isinstance(job, BatchSyncJob):
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    if not 0 <= variant_index < len(job.variants):
+        raise HTTPException(status_code=404, detail="Variant not found")
+
+    variant = job.variants[variant_index]
+    if variant["status"] != "completed":
+        raise HTTPException(status_code=400, detail="Video not ready")
+
+    if not variant["output_path"] or not os.path.exists(variant["output_path"]):
+        raise HTTPException(status_code=404, detail="Output file not found")
+
+    return FileResponse(
+        variant["output_path"],
+        media_type="video/mp4",
+        filename=f"synced_video_{batch_id}_{variant_index}.mp4"
+    )
+
+
+@router.delete("/sync-batch/{batch_id}")
+async def cleanup_batch(batch_id: str):
+    job = JobStorage.load_job(batch_id)
+    if not job or not isinstance(job, BatchSyncJob):
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    batch_dir = os.path.join(TEMP_DIR, batch_id)
+    if os.path.exists(batch_dir):
+        shutil.rmtree(batch_dir)
+
+    for variant in job.variants:
+        if variant["output_path"] and os.path.exists(variant["output_path"]):
+            os.remove(variant["output_path"])
+
+    JobStorage.delete_job(batch_id)
+    return {"message": "Cleanup completed"}
 
-class ThumbnailResponse(BaseModel):
-    image_url: str
-    title_text: str
-    subtitle_text: Optional[str] = ""
-    download_url: str
 
+def analyze_waveform_worker(waveform_id: str, music_path: str) -> dict:
+    """Run beat analysis and build the peak pyramid for a standalone track"""
+    from .BeatSyncVideoGenerator import BeatSyncVideoGenerator
+
+    try:
+        generator = BeatSyncVideoGenerator(music_path=music_path, video_clips_paths=[], output_path="")
+        generator.analyze_music()
+        return build_waveform(waveform_id, music_path, generator.beat_times,
+                              generator.hooks, generator.music_duration)
+    finally:
+        try:
+            if os.path.exists(music_path):
+                os.remove(music_path)
+        except Exception as e:
+            print(f"Warning: Could not delete temporary file {music_path}: {e}")
+
+
+@router.post("/waveform")
+async def create_waveform(music: UploadFile = File(...)):
+    """
+    Precompute the waveform peaks and beat/hook grid for a track so the editor
+    timeline can render without decoding the audio in the browser.
+    """
+    waveform_id = str(uuid.uuid4())
+    _, ext = os.path.splitext(music.filename or "")
+    music_path = os.path.join(TEMP_DIR, f"{waveform_id}_waveform{ext or '.mp3'}")
+
+    try:
+        await save_upload_file(music, music_path)
+        grid = await run_in_threadpool(analyze_waveform_worker, waveform_id, music_path)
+    except Exception as e:
+        delete_waveform(waveform_id)
+        raise HTTPException(status_code=500, detail=f"Error analyzing music: {str(e)}")
+
+    return {
+        "waveform_id": waveform_id,
+        "duration": grid["duration"],
+        "levels": grid["levels"],
+        "beat_count": len(grid["beats"]),
+        "hook_count": len(grid["hooks"])
+    }
+
+
+@router.get("/waveform/{waveform_id}/grid")
+async def get_waveform_grid(waveform_id: str):
+    """
+    Get the beat/hook grid and the available peak levels for a waveform.
+    Sync jobs expose their waveform under the job ID.
+    """
+    if not re.match(r'^[0-9a-f-]+$', waveform_id):
+        raise HTTPException(status_code=400, detail="Invalid waveform ID format")
+
+    grid = load_grid(waveform_id)
+    if not grid:
+        raise HTTPException(status_code=404, detail="Waveform not found")
+    return grid
+
+
+@router.get("/waveform/{waveform_id}/peaks")
+async def get_waveform_peaks(
+    waveform_id: str,
+    start: float = 0.0,
+    end: Optional[float] = None,
+    width: Optional[int] = None,
+    level: Optional[int] = None
+):
+    """
+    Get binary min/max peaks for a time window. Either pass an explicit pyramid
+    `level` or the `width` in pixels and the coarsest sufficient level is used.
+    """
+    if not re.match(r'^[0-9a-f-]+$', waveform_id):
+        raise HTTPException(status_code=400, detail="Invalid waveform ID format")
+
+    grid = load_grid(waveform_id)
+    if not grid:
+        raise HTTPException(status_code=404, detail="Waveform not found")
+
+    if end is None:
+        end = grid["duration"]
+    if start < 0 or end <= start:
+        raise HTTPException(status_code=400, detail="Invalid time window")
+
+    if level is None:
+        level = select_level(grid, start, end, width) if width else 0
+    if level < 0 or level >= len(grid["levels"]):
+        raise HTTPException(status_code=400, detail=f"Level must be between 0 and {len(grid['levels']) - 1}")
+
+    payload = await run_in_threadpool(read_peaks, waveform_id, grid, level, start, end)
+    return Response(
+        content=payload,
+        media_type="application/octet-stream",
+        headers={"Cache-Control": "public, max-age=86400", "X-Peaks-Level": str(level)}
+    )
+
+
+_music_service = None
+
+
+def get_music_service():
+    """The MusicGen worker process is only started on the first music request"""
+    global _music_service
+    if _music_service is None:
+        from .music_generator import MusicGenService
+        _music_service = MusicGenService(OUTPUT_DIR)
+    return _music_service
+
+
+@router.post("/music")
+async def create_music(request: MusicRequest):
+    """
+    Queue script-to-music generation. Poll /creative/status/{job_id} and fetch
+    the result from /creative/music/download/{job_id}.
+    """
+    if not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt must not be empty")
+
+    job_id = str(uuid.uuid4())
+    try:
+        job = VideoJob(job_id)
+        job.status = "queued"
+        job.progress_messages.append("Queued for music generation")
+        JobStorage.save_job(job_id, job)
+
+        get_music_service().submit(job_id, request.prompt.strip(), request.duration)
+        return {"job_id": job_id, "message": "Music generation queued"}
+    except Exception as e:
+        JobStorage.delete_job(job_id)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/music/download/{job_id}")
+async def download_music(job_id: str):
+    job = JobStorage.load_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job.status != "completed":
+        raise HTTPException(status_code=400, detail="Music not ready")
+
+    if not job.output_path or not os.path.exists(job.output_path):
+        raise HTTPException(status_code=404, detail="Output file not found")
+
+    return FileResponse(
+        job.output_path,
+        media_type="audio/wav",
+        filename=f"music_{job_id}.wav"
+    )
+
+
+# Define request and response models
 def get_ist_time():
     utc_time = datetime.utcnow()
     ist_time = utc_time + timedelta(hours=5, minutes=30)
@@ -270,72 +804,152 @@ def clean_json(json_str: str) -> str:
     cleaned = re.sub(r',\s*([\]}])', r'\1', json_str)
     return cleaned
 
+def extract_llm_json(response_text: str) -> dict:
+    """Extract and parse the JSON object from an LLM response."""
+    # Try to extract JSON from triple-backticks
+    match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', response_text, re.DOTALL)
+    if match:
+        json_str = match.group(1).strip()
+    else:
+        # Fallback: extract the substring starting at the first '{' and ending at the last '}'
+        json_start = response_text.find('{')
+        json_end = response_text.rfind('}')
+        if json_start != -1 and json_end != -1:
+            json_str = response_text[json_start:json_end+1]
+        else:
+            raise HTTPException(status_code=500, detail="Failed to find JSON structure in the LLM response")
+    
+    cleaned_json_str = clean_json(json_str)
+    
+    try:
+        return json.loads(cleaned_json_str)
+    except json.JSONDecodeError as e:
+        # More advanced cleaning attempt for difficult JSON cases
+        try:
+            # Try to fix common JSON formatting issues
+            fixed_json_str = re.sub(r',\s*}', '}', cleaned_json_str)
+            fixed_json_str = re.sub(r',\s*]', ']', fixed_json_str)
+            return json.loads(fixed_json_str)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=500, detail=f"JSON parsing error: {str(e)}")
+
+# Used unless the caller asks for variety
+DEFAULT_THUMBNAIL_TEMPERATURE = 0.6
+
+concept_cache = PromptCache()
+
+async def generate_thumbnail_concept(request: ThumbnailRequest, temperature: float) -> dict:
+    """Ask the LLM for the image prompt and title text of a thumbnail."""
+    prompt = (
+        f"Act as a professional YouTube thumbnail designer. Create a compelling, high-quality thumbnail "
+        f"for a video with the following details:\n\n"
+        f"Video Title: {request.video_title}\n"
+        f"Video Description: {request.video_description}\n"
+        f"Style: {request.style}\n\n"
+        f"Remember that Stable Diffusion cannot render text natively, so focus on creating a visually "
+        f"striking scene description. Return the thumbnail details in the following JSON format:\n\n"
+        "{\n"
+        '  "imagePrompt": "detailed visual description for the thumbnail image without text",\n'
+        '  "titleText": "catchy title text for the thumbnail (keep it short, 3-5 words)",\n'
+        '  "subtitleText": "optional subtitle or tagline (if needed)"\n'
+        "}\n\n"
+        "Strictly reply with ONLY the JSON, no additional text."
+    )
+    
+    response_text = await gateway.chat_text(
+        model="deepseek-r1-distill-llama-70b",
+        messages=[
+            {"role": "system", "content": "You are a professional thumbnail designer who creates eye-catching, high-quality thumbnails for YouTube videos."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=temperature,
+        max_completion_tokens=1000,
+        top_p=0.95,
+        reasoning_format="raw"
+    )
+    
+    return extract_llm_json(response_text)
+
+async def render_thumbnail(thumbnail_data: dict, request: ThumbnailRequest, base_url: str) -> dict:
+    """Generate the image for a thumbnail concept, store it and render its variants."""
+    # Generate a unique filename for the thumbnail
+    file_id = str(uuid.uuid4())
+    output_path = f"static/thumbnails/{file_id}.webp"
+    
+    # Enhance the prompt for better thumbnail quality
+    enhanced_prompt = f"High quality YouTube thumbnail, professional photography, {thumbnail_data['imagePrompt']}, high resolution, detailed, vibrant colors, eye-catching, 4K"
+    
+    # Generate the image with the configured backend (Stable Cascade by default)
+    temp_file_path = await get_image_backend().generate(
+        prompt=enhanced_prompt,
+        negative_prompt="text, watermark, logo, blurry, low quality, amateur, distorted faces",
+        width=1536,
+        height=864  # 16:9 aspect ratio
+    )
+    
+    print(f"Temporary file path: {temp_file_path}")
+    
+    # Check if the file exists at the temporary location
+    if os.path.exists(temp_file_path):
+        # Copy the file to our static directory
+        shutil.copy2(temp_file_path, output_path)
+        print(f"Image copied from {temp_file_path} to {output_path}")
+    else:
+        raise HTTPException(status_code=500, detail=f"Generated file not found at {temp_file_path}")
+    
+    # Create URLs for viewing and downloading
+    view_url = f"{base_url}/static/thumbnails/{file_id}.webp"
+    download_url = f"{base_url}/creative/download/{file_id}"
+    
+    # Composite the title text and render the size/format variants
+    variants = None
+    if request.composite:
+        variant_paths = await render_variants(
+            output_path,
+            file_id,
+            thumbnail_data['titleText'],
+            thumbnail_data.get('subtitleText', ''),
+            request.layout
+        )
+        variants = {
+            size: {fmt: f"{base_url}/creative/thumbnail/{file_id}/{os.path.basename(path)}"
+                   for fmt, path in formats.items()}
+            for size, formats in variant_paths.items()
+        }
+    
+    return {
+        "title_text": thumbnail_data['titleText'],
+        "subtitle_text": thumbnail_data.get('subtitleText', ''),
+        "image_url": view_url,
+        "download_url": download_url,
+        "file_id": file_id,
+        "variants": variants
+    }
+
 @router.post("/thumbnail")
 async def generate_thumbnail(request: ThumbnailRequest, req: Request):
     """
     Generate a thumbnail based on video title, description and style.
     """
+    if request.layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Layout must be one of {', '.join(LAYOUTS)}")
+
     try:
-        temperature = round(random.uniform(0.4, 0.8), 2)
+        # Temperature is only randomized when the caller asks for variety
+        temperature = round(random.uniform(0.4, 0.8), 2) if request.variety else DEFAULT_THUMBNAIL_TEMPERATURE
         print(f"Temperature: {temperature}")
         
-        prompt = (
-            f"Act as a professional YouTube thumbnail designer. Create a compelling, high-quality thumbnail "
-            f"for a video with the following details:\n\n"
-            f"Video Title: {request.video_title}\n"
-            f"Video Description: {request.video_description}\n"
-            f"Style: {request.style}\n\n"
-            f"Remember that Stable Diffusion cannot render text natively, so focus on creating a visually "
-            f"striking scene description. Return the thumbnail details in the following JSON format:\n\n"
-            "{\n"
-            '  "imagePrompt": "detailed visual description for the thumbnail image without text",\n'
-            '  "titleText": "catchy title text for the thumbnail (keep it short, 3-5 words)",\n'
-            '  "subtitleText": "optional subtitle or tagline (if needed)"\n'
-            "}\n\n"
-            "Strictly reply with ONLY the JSON, no additional text."
-        )
-        
-        completion = client.chat.completions.create(
-            model="deepseek-r1-distill-llama-70b",
-            messages=[
-                {"role": "system", "content": "You are a professional thumbnail designer who creates eye-catching, high-quality thumbnails for YouTube videos."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature,
-            max_completion_tokens=1000,
-            top_p=0.95,
-            stream=False,
-            reasoning_format="raw"
-        )
-        
-        response_text = completion.choices[0].message.content
-        
-        # Try to extract JSON from triple-backticks
-        match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', response_text, re.DOTALL)
-        if match:
-            json_str = match.group(1).strip()
+        key = concept_key(request.video_title, request.video_description, request.style)
+        if request.variety:
+            thumbnail_data = await generate_thumbnail_concept(request, temperature)
+            cached = False
+        elif request.fresh:
+            thumbnail_data = await generate_thumbnail_concept(request, temperature)
+            concept_cache.put(key, thumbnail_data)
+            cached = False
         else:
-            # Fallback: extract the substring starting at the first '{' and ending at the last '}'
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}')
-            if json_start != -1 and json_end != -1:
-                json_str = response_text[json_start:json_end+1]
-            else:
-                raise HTTPException(status_code=500, detail="Failed to find JSON structure in the LLM response")
-        
-        cleaned_json_str = clean_json(json_str)
-        
-        try:
-            thumbnail_data = json.loads(cleaned_json_str)
-        except json.JSONDecodeError as e:
-            # More advanced cleaning attempt for difficult JSON cases
-            try:
-                # Try to fix common JSON formatting issues
-                fixed_json_str = re.sub(r',\s*}', '}', cleaned_json_str)
-                fixed_json_str = re.sub(r',\s*]', ']', fixed_json_str)
-                thumbnail_data = json.loads(fixed_json_str)
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=500, detail=f"JSON parsing error: {str(e)}")
+            thumbnail_data, cached = await concept_cache.get_or_create(
+                key, lambda: generate_thumbnail_concept(request, temperature))
         
         print("Thumbnail Generated for:", request.video_title)
         print("Generated on:", get_ist_time())
@@ -343,76 +957,133 @@ async def generate_thumbnail(request: ThumbnailRequest, req: Request):
         print("Title Text:", thumbnail_data['titleText'])
         print("Subtitle Text:", thumbnail_data.get('subtitleText', ''))
         
-        # Generate a unique filename for the thumbnail
-        file_id = str(uuid.uuid4())
-        output_path = f"static/thumbnails/{file_id}.webp"
-        
-        # Use Stable Cascade for image generation
-        stable_cascade_client = Client("multimodalart/stable-cascade")
-        
-        # Enhance the prompt for better thumbnail quality
-        enhanced_prompt = f"High quality YouTube thumbnail, professional photography, {thumbnail_data['imagePrompt']}, high resolution, detailed, vibrant colors, eye-catching, 4K"
-        
-        # Generate the image
-        result = stable_cascade_client.predict(
-            prompt=enhanced_prompt,
-            negative_prompt="text, watermark, logo, blurry, low quality, amateur, distorted faces",
-            seed=random.randint(1, 999999),
-            width=1536,
-            height=864,  # 16:9 aspect ratio
-            prior_num_inference_steps=20,
-            prior_guidance_scale=4,
-            decoder_num_inference_steps=10,
-            decoder_guidance_scale=0,
-            num_images_per_prompt=1,
-            api_name="/run"
-        )
-        
-        # Debug the result
-        print(f"Stable Cascade result: {result}")
-        
-        # Handle the result from Stable Cascade correctly - both single string and list formats
-        if result:
-            # If result is a string (direct file path)
-            if isinstance(result, str):
-                temp_file_path = result
-            # If result is a list of strings (multiple file paths)
-            elif isinstance(result, list) and len(result) > 0:
-                temp_file_path = result[0]
-            else:
-                raise HTTPException(status_code=500, detail=f"Unexpected result format: {type(result)}")
-            
-            print(f"Temporary file path: {temp_file_path}")
-            
-            # Check if the file exists at the temporary location
-            if os.path.exists(temp_file_path):
-                # Copy the file to our static directory
-                shutil.copy2(temp_file_path, output_path)
-                print(f"Image copied from {temp_file_path} to {output_path}")
-            else:
-                raise HTTPException(status_code=500, detail=f"Generated file not found at {temp_file_path}")
-        else:
-            raise HTTPException(status_code=500, detail="No result returned from image generation")
-        
-        # Get base URL from request
-        base_url = str(req.base_url).rstrip('/')
-        
-        # Create URLs for viewing and downloading
-        view_url = f"{base_url}/static/thumbnails/{file_id}.webp"
-        download_url = f"{base_url}/creative/download/{file_id}"
-        
-        return {
-            "title_text": thumbnail_data['titleText'],
-            "subtitle_text": thumbnail_data.get('subtitleText', ''),
-            "image_url": view_url,
-            "download_url": download_url,
-            "file_id": file_id
-        }
+        result = await render_thumbnail(thumbnail_data, request, str(req.base_url).rstrip('/'))
+        return {**result, "concept_cached": cached}
         
     except Exception as e:
         print(f"Error generating thumbnail: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating thumbnail: {str(e)}")
 
+class ThumbnailVariantsRequest(ThumbnailRequest):
+    count: int = Field(4, ge=2, le=8)
+
+async def generate_thumbnail_concepts(request: ThumbnailVariantsRequest) -> List[dict]:
+    """Ask the LLM for `count` distinct thumbnail concepts in a single call."""
+    prompt = (
+        f"Act as a professional YouTube thumbnail designer. Create {request.count} DISTINCT thumbnail concepts "
+        f"for A/B testing a video with the following details:\n\n"
+        f"Video Title: {request.video_title}\n"
+        f"Video Description: {request.video_description}\n"
+        f"Style: {request.style}\n\n"
+        f"Each concept must use a clearly different visual idea, composition and color palette, and a "
+        f"different title angle. Remember that Stable Diffusion cannot render text natively, so focus on "
+        f"visually striking scene descriptions. Return the concepts in the following JSON format:\n\n"
+        "{\n"
+        '  "concepts": [\n'
+        '    {"imagePrompt": "detailed visual description without text", '
+        '"titleText": "catchy title text (3-5 words)", "subtitleText": "optional subtitle"}\n'
+        "  ]\n"
+        "}\n\n"
+        "Strictly reply with ONLY the JSON, no additional text."
+    )
+    
+    response_text = await gateway.chat_text(
+        model="deepseek-r1-distill-llama-70b",
+        messages=[
+            {"role": "system", "content": "You are a professional thumbnail designer who creates eye-catching, high-quality thumbnails for YouTube videos."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.8,
+        max_completion_tokens=400 * request.count + 1000,
+        top_p=0.95,
+        reasoning_format="raw"
+    )
+    
+    concepts = [
+        concept for concept in extract_llm_json(response_text).get("concepts", [])
+        if isinstance(concept, dict) and concept.get("imagePrompt") and concept.get("titleText")
+    ]
+    if not concepts:
+        raise HTTPException(status_code=500, detail="LLM returned no usable thumbnail concepts")
+    return concepts[:request.count]
+
+@router.post("/thumbnail/variants")
+async def generate_thumbnail_variants(request: ThumbnailVariantsRequest, req: Request):
+    """
+    Generate several thumbnail candidates for A/B testing. One LLM call
+    produces all concepts, then the images are generated concurrently (within
+    the image backend's limit). Results stream back as NDJSON lines as each
+    variant finishes: a "concepts" line, one "variant" or "error" line per
+    candidate, and a final "done" line.
+    """
+    if request.layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Layout must be one of {', '.join(LAYOUTS)}")
+
+    try:
+        concepts = await generate_thumbnail_concepts(request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating thumbnail concepts: {str(e)}")
+
+    base_url = str(req.base_url).rstrip('/')
+
+    async def render_indexed(index: int, concept: dict):
+        try:
+            return index, await render_thumbnail(concept, request, base_url), None
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            print(f"Error rendering thumbnail variant {index}: {detail}")
+            return index, None, detail
+
+    async def stream_variants():
+        tasks = [asyncio.create_task(render_indexed(i, concept)) for i, concept in enumerate(concepts)]
+        try:
+            yield json.dumps({"type": "concepts", "count": len(concepts)}) + "\n"
+            completed = 0
+            for next_done in asyncio.as_completed(tasks):
+                index, result, error = await next_done
+                if error:
+                    yield json.dumps({"type": "error", "index": index, "detail": error}) + "\n"
+                else:
+                    completed += 1
+                    yield json.dumps({"type": "variant", "index": index, **result}) + "\n"
+            yield json.dumps({"type": "done", "completed": completed, "failed": len(concepts) - completed}) + "\n"
+        finally:
+            # Client went away: don't keep generating images nobody will see
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_variants(), media_type="application/x-ndjson")
+
+@router.get("/thumbnail/{file_id}/{variant}")
+async def get_thumbnail_variant(file_id: str, variant: str):
+    """
+    Serve a composited thumbnail variant, e.g. 640x360.webp. Variants never
+    change once rendered, so they are cached as immutable.
+    """
+    if not re.match(r'^[0-9a-f-]+$', file_id):
+        raise HTTPException(status_code=400, detail="Invalid file ID format")
+
+    match = re.match(r'^(\d+x\d+)\.(webp|jpg)$', variant)
+    if not match:
+        raise HTTPException(status_code=400, detail="Invalid variant, expected e.g. 640x360.webp")
+
+    file_path = os.path.join(THUMBNAIL_DIR, file_id, variant)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    return FileResponse(
+        path=file_path,
+        media_type="image/webp" if match.group(2) == "webp" else "image/jpeg",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+@router.get("/image-backend/stats")
+async def image_backend_stats():
+    """Concurrency, queue depth and latency of the image generation backend"""
+    return {**get_image_backend().stats(), "concept_cache": concept_cache.stats()}
+
 @router.get("/download/{file_id}")
 async def download_thumbnail(file_id: str):
     """
@@ -1,14 +1,26 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
+# Audio the beat tracker runs on: the full mix or a separated drum stem
+BEAT_SOURCES = ("mix", "drums")
+
 class ThumbnailRequest(BaseModel):
     video_title: str
     video_description: Optional[str] = ""
     style: Optional[str] = "Modern, Professional"
+    composite: bool = True  # Render the title text onto the image server-side
+    layout: str = "bottom_left"  # bottom_left, center, top_left
+    fresh: bool = False  # Skip the concept cache and ask the LLM again
+    variety: bool = False  # Randomize the temperature for a different concept
 
 class ThumbnailResponse(BaseModel):
     image_url: str
     title_text: str
     subtitle_text: Optional[str] = ""
-    download_url: Optional[str] = ""  # URL to download the image
-    file_id: Optional[str] = ""       # File ID for reference 
\ No newline at end of file
+    download_url: str
+    file_id: Optional[str] = ""       # File ID for reference
+    variants: Optional[dict] = None   # {"640x360": {"webp": url, "jpg": url}, ...}
+
+class MusicRequest(BaseModel):
+    prompt: str
+    duration: float = Field(10, ge=1, le=30)  # seconds
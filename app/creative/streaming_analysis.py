@@ -0,0 +1,167 @@
+import os
+import librosa
+import numpy as np
+from typing import Iterator, Tuple
+
+# Tracks longer than this are analyzed block by block instead of loaded whole
+STREAMING_THRESHOLD_SECONDS = float(os.getenv("STREAMING_ANALYSIS_THRESHOLD_SECONDS", "600"))
+
+# Rate of the in-memory path (librosa.load's default), so both give the same frames
+ANALYSIS_SR = 22050
+N_FFT = 2048
+HOP_LENGTH = 512
+BLOCK_SECONDS = 30.0  # audio decoded and resampled per block
+TOP_DB = 80.0
+
+
+def should_stream(music_path: str) -> bool:
+    try:
+        return librosa.get_duration(path=music_path) > STREAMING_THRESHOLD_SECONDS
+    except Exception as e:
+        print(f"Could not read duration of {music_path}: {e}")
+        return False
+
+
+def stream_resampled(music_path: str, block_seconds: float = BLOCK_SECONDS) -> Iterator[np.ndarray]:
+    """
+    Mono audio at ANALYSIS_SR, decoded in non-overlapping blocks of the
+    native rate and passed through one streaming soxr resampler (the
+    resampler librosa.load uses), so block edges leave no artefacts.
+    """
+    import soxr
+
+    native_sr = librosa.get_samplerate(music_path)
+    block_samples = max(N_FFT, int(block_seconds * native_sr))
+    blocks = librosa.stream(
+        music_path,
+        block_length=1,
+        frame_length=block_samples,
+        hop_length=block_samples,
+        mono=True,
+        fill_value=None
+    )
+    if native_sr == ANALYSIS_SR:
+        yield from blocks
+        return
+
+    resampler = soxr.ResampleStream(native_sr, ANALYSIS_SR, 1, dtype="float32", quality="HQ")
+    for block in blocks:
+        yield resampler.resample_chunk(np.ascontiguousarray(block, dtype=np.float32))
+    yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+
+def stream_onset_envelopes(music_path: str, block_seconds: float = BLOCK_SECONDS) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Compute onset strength envelopes without loading the whole track.
+
+    The track is resampled to ANALYSIS_SR block by block and framed with a
+    carried-over buffer, so a center=False mel spectrogram per block gives
+    the same frames as one over the full signal. The last spectrum column of
+    each block is carried over to compute the first spectral flux value of
+    the next one. Only the envelopes (one float per hop, ~620 KB each per hour of
+    audio) are kept in memory.
+
+    Returns (median envelope, mean envelope, sample rate): beat_track uses the
+    median aggregate and the hook detection uses the mean one, matching
+    librosa's defaults on the in-memory path.
+    """
+    sr = ANALYSIS_SR
+    median_parts, mean_parts = [], []
+    previous = None
+    running_max = None
+    buffer = np.zeros(0, dtype=np.float32)
+    total_samples = 0
+
+    def process(samples: np.ndarray):
+        nonlocal previous, running_max
+        S = librosa.feature.melspectrogram(y=samples, sr=sr, n_fft=N_FFT, hop_length=HOP_LENGTH, center=False)
+        S = librosa.power_to_db(S, ref=1.0, top_db=None)
+
+        # The full-signal path clips at 80 dB below the global peak; the
+        # loudest frame seen so far is the best estimate available here
+        block_max = float(S.max())
+        running_max = block_max if running_max is None else max(running_max, block_max)
+        S = np.maximum(S, running_max - TOP_DB)
+
+        if previous is not None:
+            S = np.hstack([previous, S])
+        flux = np.maximum(0.0, S[:, 1:] - S[:, :-1])
+        median_parts.append(np.median(flux, axis=0).astype(np.float32))
+        mean_parts.append(flux.mean(axis=0).astype(np.float32))
+        previous = S[:, -1:]
+
+    def frames_in(samples: np.ndarray) -> int:
+        return 0 if len(samples) < N_FFT else 1 + (len(samples) - N_FFT) // HOP_LENGTH
+
+    for block in stream_resampled(music_path, block_seconds):
+        total_samples += len(block)
+        buffer = np.concatenate([buffer, block])
+        n_frames = frames_in(buffer)
+        if n_frames:
+            process(buffer[:(n_frames - 1) * HOP_LENGTH + N_FFT])
+            # Keep the samples the next frames still need
+            buffer = buffer[n_frames * HOP_LENGTH:]
+
+    # Zero padding at the end, like onset_strength(center=True)
+    buffer = np.pad(buffer, (0, max(N_FFT // 2, N_FFT - len(buffer))))
+    if frames_in(buffer):
+        process(buffer[:(frames_in(buffer) - 1) * HOP_LENGTH + N_FFT])
+
+    if not mean_parts:
+        raise ValueError(f"No audio could be read from {music_path}")
+
+    # Same alignment as onset_strength(center=True): lag plus half a window,
+    # plus another half window because center=False frames start at sample 0
+    # where centered ones start half a window earlier
+    pad = 1 + 2 * (N_FFT // (2 * HOP_LENGTH))
+    n_frames = 1 + total_samples // HOP_LENGTH
+    median_env = np.pad(np.concatenate(median_parts), (pad, 0))[:n_frames]
+    mean_env = np.pad(np.concatenate(mean_parts), (pad, 0))[:n_frames]
+    return median_env, mean_env, sr
+
+
+def stream_beats(music_path: str):
+    """
+    Block-streaming equivalent of beat_track + onset_strength.
+    Returns (tempo, beat_frames, beat_times, mean onset envelope).
+    """
+    median_env, mean_env, sr = stream_onset_envelopes(music_path)
+    tempo, beat_frames = librosa.beat.beat_track(onset_envelope=median_env, sr=sr, hop_length=HOP_LENGTH)
+    beat_times = librosa.frames_to_time(beat_frames, sr=sr, hop_length=HOP_LENGTH)
+    return tempo, beat_frames, beat_times, mean_env
+
+
+def compare_with_in_memory(music_path: str, block_seconds: float = BLOCK_SECONDS) -> dict:
+    """
+    Beat times of the streaming path against the in-memory one used by
+    BeatSyncVideoGenerator, for checking a real file:
+    python -m app.creative.streaming_analysis track.mp3
+    """
+    y, sr = librosa.load(music_path)
+    _, expected_frames = librosa.beat.beat_track(y=y, sr=sr)
+    expected = librosa.frames_to_time(expected_frames, sr=sr)
+    del y
+
+    median_env, _, sr = stream_onset_envelopes(music_path, block_seconds)
+    _, beat_frames = librosa.beat.beat_track(onset_envelope=median_env, sr=sr, hop_length=HOP_LENGTH)
+    streamed = librosa.frames_to_time(beat_frames, sr=sr, hop_length=HOP_LENGTH)
+
+    # Offset of each in-memory beat to the nearest streamed one
+    offsets = np.abs(streamed[np.clip(np.searchsorted(streamed, expected), 0, len(streamed) - 1)] - expected)
+    offsets = np.minimum(offsets, np.abs(
+        streamed[np.clip(np.searchsorted(streamed, expected) - 1, 0, len(streamed) - 1)] - expected))
+    return {
+        "in_memory_beats": len(expected),
+        "streamed_beats": len(streamed),
+        "max_offset": float(offsets.max()) if len(offsets) else 0.0,
+        "matched": float(np.mean(offsets <= HOP_LENGTH / sr)) if len(offsets) else 1.0
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    report = compare_with_in_memory(sys.argv[1], *(float(arg) for arg in sys.argv[2:3]))
+    print(report)
+    # Beats may differ by one hop where the running dB floor differs from the global one
+    sys.exit(0 if report["matched"] >= 0.99 and abs(report["in_memory_beats"] - report["streamed_beats"]) <= 1 else 1)
@@ -0,0 +1,163 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from PIL import Image, ImageDraw, ImageFont
+
+THUMBNAIL_DIR = os.path.join("static", "thumbnails")
+THUMBNAIL_FONT_PATH = os.getenv("THUMBNAIL_FONT_PATH", "")
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "4"))
+
+# Text is laid out once on the largest size; smaller variants are downscaled
+BASE_SIZE = (1280, 720)
+VARIANT_SIZES = [(1280, 720), (640, 360), (320, 180)]
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 85, "method": 4}),
+    "jpg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf",
+    "/Library/Fonts/Arial Bold.ttf",
+    "C:\\Windows\\Fonts\\arialbd.ttf",
+]
+
+# Positions and sizes are fractions of the canvas
+LAYOUTS = {
+    "bottom_left": {"x": 0.05, "bottom": 0.92, "align": "left", "max_width": 0.70,
+                    "title_size": 0.11, "subtitle_size": 0.05, "band": "bottom"},
+    "center": {"x": 0.50, "bottom": 0.70, "align": "center", "max_width": 0.86,
+               "title_size": 0.13, "subtitle_size": 0.055, "band": None},
+    "top_left": {"x": 0.05, "top": 0.08, "align": "left", "max_width": 0.65,
+                 "title_size": 0.10, "subtitle_size": 0.05, "band": "top"},
+}
+
+_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail")
+
+
+@lru_cache(maxsize=1)
+def _font_path() -> Optional[str]:
+    for path in [THUMBNAIL_FONT_PATH] + FONT_CANDIDATES:
+        if path and os.path.exists(path):
+            return path
+    print("No TrueType font found, using Pillow's default font for thumbnails")
+    return None
+
+
+@lru_cache(maxsize=32)
+def get_font(size: int) -> ImageFont.FreeTypeFont:
+    """Loaded font faces are cached per size and shared by all renders"""
+    path = _font_path()
+    if path:
+        return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size=size)
+
+
+def _wrap(draw: ImageDraw.ImageDraw, text: str, font, max_width: int) -> List[str]:
+    lines, current = [], ""
+    for word in text.split():
+        candidate = f"{current} {word}".strip()
+        if current and draw.textlength(candidate, font=font) > max_width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+
+def _cover(image: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """Resize and center-crop to fill `size`"""
+    scale = max(size[0] / image.width, size[1] / image.height)
+    resized = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+    left = (resized.width - size[0]) // 2
+    top = (resized.height - size[1]) // 2
+    return resized.crop((left, top, left + size[0], top + size[1]))
+
+
+def compose(source_path: str, title: str, subtitle: str = "", layout: str = "bottom_left") -> Image.Image:
+    """Render the title and subtitle onto the generated image at BASE_SIZE"""
+    spec = LAYOUTS.get(layout, LAYOUTS["bottom_left"])
+    width, height = BASE_SIZE
+
+    with Image.open(source_path) as source:
+        canvas = _cover(source.convert("RGB"), BASE_SIZE).convert("RGBA")
+
+    # Darken the text area so light backgrounds stay readable
+    if spec["band"]:
+        band = Image.new("RGBA", BASE_SIZE, (0, 0, 0, 0))
+        band_draw = ImageDraw.Draw(band)
+        for y in range(height // 2):
+            alpha = int(170 * (1 - y / (height / 2)))
+            row = height - 1 - y if spec["band"] == "bottom" else y
+            band_draw.line([(0, row), (width, row)], fill=(0, 0, 0, alpha))
+        canvas = Image.alpha_composite(canvas, band)
+
+    draw = ImageDraw.Draw(canvas)
+    title_font = get_font(int(height * spec["title_size"]))
+    subtitle_font = get_font(int(height * spec["subtitle_size"]))
+    max_width = int(width * spec["max_width"])
+
+    blocks = [(line, title_font, (255, 255, 255)) for line in _wrap(draw, title.upper(), title_font, max_width)[:3]]
+    if subtitle:
+        blocks += [(line, subtitle_font, (255, 214, 0)) for line in _wrap(draw, subtitle, subtitle_font, max_width)[:2]]
+
+    line_heights = [int(font.size * 1.15) for _, font, _ in blocks]
+    if "top" in spec:
+        y = int(height * spec["top"])
+    else:
+        y = int(height * spec["bottom"]) - sum(line_heights)
+
+    for (line, font, color), line_height in zip(blocks, line_heights):
+        stroke = max(2, font.size // 14)
+        if spec["align"] == "center":
+            x = int(width * spec["x"] - draw.textlength(line, font=font) / 2)
+        else:
+            x = int(width * spec["x"])
+        draw.text((x, y), line, font=font, fill=color, stroke_width=stroke, stroke_fill=(0, 0, 0))
+        y += line_height
+
+    return canvas.convert("RGB")
+
+
+def _save_variant(image: Image.Image, size: Tuple[int, int], fmt: str, output_path: str) -> str:
+    variant = image if image.size == size else image.resize(size, Image.LANCZOS)
+    pil_format, options = VARIANT_FORMATS[fmt]
+    tmp_path = f"{output_path}.tmp"
+    variant.save(tmp_path, pil_format, **options)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def variant_name(size: Tuple[int, int], fmt: str) -> str:
+    return f"{size[0]}x{size[1]}.{fmt}"
+
+
+async def render_variants(source_path: str, file_id: str, title: str, subtitle: str = "",
+                          layout: str = "bottom_left") -> Dict[str, Dict[str, str]]:
+    """
+    Composite the text and write every size/format variant to
+    static/thumbnails/{file_id}/ using the thumbnail thread pool.
+    Returns {"1280x720": {"webp": path, "jpg": path}, ...}.
+    """
+    loop = asyncio.get_running_loop()
+    composed = await loop.run_in_executor(_executor, compose, source_path, title, subtitle, layout)
+
+    output_dir = os.path.join(THUMBNAIL_DIR, file_id)
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = []
+    for size in VARIANT_SIZES:
+        for fmt in VARIANT_FORMATS:
+            output_path = os.path.join(output_dir, variant_name(size, fmt))
+            jobs.append((size, fmt, loop.run_in_executor(_executor, _save_variant, composed, size, fmt, output_path)))
+
+    await asyncio.gather(*(job for _, _, job in jobs))
+
+    variants = {}
+    for size, fmt, job in jobs:
+        variants.setdefault(f"{size[0]}x{size[1]}", {})[fmt] = job.result()
+    return variants
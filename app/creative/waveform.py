@@ -0,0 +1,167 @@
+import json
+import os
+import shutil
+import struct
+import numpy as np
+from typing import List, Optional
+
+PEAKS_DIR = os.path.join("temp_outputs", "peaks")
+os.makedirs(PEAKS_DIR, exist_ok=True)
+
+# Level 0 holds one min/max pair per 256 samples; every further level halves
+# the resolution until only a screenful of peaks is left.
+BASE_SAMPLES_PER_PEAK = 256
+MIN_PEAKS_PER_LEVEL = 512
+
+# Binary peaks payload (little endian):
+#   4s  magic "AGPK"
+#   H   format version
+#   H   pyramid level
+#   I   sample rate of the analysed audio
+#   I   samples per peak at this level
+#   I   index of the first peak in the payload
+#   I   number of peaks in the payload
+#   f   scale to convert int8 values back to [-1, 1] amplitude
+# followed by `count` interleaved (min, max) int8 pairs.
+PEAKS_MAGIC = b"AGPK"
+PEAKS_VERSION = 1
+PEAKS_HEADER = struct.Struct("<4sHHIIIIf")
+
+
+def _waveform_dir(waveform_id: str) -> str:
+    return os.path.join(PEAKS_DIR, waveform_id)
+
+
+def build_peak_pyramid(y: np.ndarray, base_samples_per_peak: int = BASE_SAMPLES_PER_PEAK) -> List[np.ndarray]:
+    """Build min/max peak levels (float32, shape (n, 2)) from a mono signal"""
+    n_peaks = max(1, int(np.ceil(len(y) / base_samples_per_peak)))
+    padded = np.zeros(n_peaks * base_samples_per_peak, dtype=np.float32)
+    padded[:len(y)] = y
+    frames = padded.reshape(n_peaks, base_samples_per_peak)
+
+    level = np.stack([frames.min(axis=1), frames.max(axis=1)], axis=1)
+    return build_peak_pyramid_from_base(level)
+
+
+def build_peak_pyramid_from_base(level: np.ndarray) -> List[np.ndarray]:
+    """Derive the coarser levels by merging neighbouring min/max pairs"""
+    levels = [level]
+
+    while len(level) > MIN_PEAKS_PER_LEVEL:
+        if len(level) % 2:
+            level = np.vstack([level, level[-1:]])
+        pairs = level.reshape(-1, 2, 2)
+        level = np.stack([pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)], axis=1)
+        levels.append(level)
+
+    return levels
+
+
+def stream_base_peaks(music_path: str, base_samples_per_peak: int = BASE_SAMPLES_PER_PEAK, block_peaks: int = 4096):
+    """Level 0 min/max peaks computed block by block, without loading the whole track"""
+    import librosa
+
+    sr = librosa.get_samplerate(music_path)
+    blocks = librosa.stream(
+        music_path,
+        block_length=block_peaks,
+        frame_length=base_samples_per_peak,
+        hop_length=base_samples_per_peak,
+        mono=True
+    )
+    parts = [build_peak_pyramid(block, base_samples_per_peak)[0] for block in blocks]
+    return np.vstack(parts), sr
+
+
+def build_waveform(waveform_id: str, music_path: str, beat_times, hooks, music_duration: float) -> dict:
+    """
+    Precompute the peak pyramid and beat/hook grid for a track and store it
+    under temp_outputs/peaks/{waveform_id}
+    """
+    try:
+        base, sr = stream_base_peaks(music_path)
+        levels = build_peak_pyramid_from_base(base)
+    except Exception as e:
+        print(f"Streaming peaks failed ({e}), loading the whole track")
+        import librosa
+        y, sr = librosa.load(music_path, sr=None, mono=True)
+        levels = build_peak_pyramid(y)
+        del y
+
+    # Quantize every level against the same scale so zoom levels line up
+    scale = float(max(np.abs(levels[0]).max(), 1e-9))
+    quantized = {
+        f"level_{i}": np.clip(np.round(level / scale * 127), -127, 127).astype(np.int8)
+        for i, level in enumerate(levels)
+    }
+
+    output_dir = _waveform_dir(waveform_id)
+    os.makedirs(output_dir, exist_ok=True)
+    np.savez_compressed(os.path.join(output_dir, "peaks.npz"), **quantized)
+
+    grid = {
+        "waveform_id": waveform_id,
+        "duration": float(music_duration),
+        "sample_rate": int(sr),
+        "scale": scale,
+        "levels": [
+            {
+                "level": i,
+                "samples_per_peak": BASE_SAMPLES_PER_PEAK * (2 ** i),
+                "peak_count": int(len(level)),
+            }
+            for i, level in enumerate(levels)
+        ],
+        "beats": [round(float(t), 4) for t in beat_times],
+        "hooks": [round(float(t), 4) for t in hooks],
+    }
+    with open(os.path.join(output_dir, "grid.json"), "w") as f:
+        json.dump(grid, f)
+
+    print(f"Stored waveform {waveform_id}: {len(levels)} levels, {len(grid['beats'])} beats")
+    return grid
+
+
+def load_grid(waveform_id: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(_waveform_dir(waveform_id), "grid.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def select_level(grid: dict, start: float, end: float, width: int) -> int:
+    """Pick the coarsest level that still has at least `width` peaks in [start, end]"""
+    span_samples = max(end - start, 0) * grid["sample_rate"]
+    selected = 0
+    for level in grid["levels"]:
+        if span_samples / level["samples_per_peak"] >= width:
+            selected = level["level"]
+    return selected
+
+
+def read_peaks(waveform_id: str, grid: dict, level: int, start: float = 0.0, end: Optional[float] = None) -> bytes:
+    """Return the binary payload for `level` restricted to the [start, end] window in seconds"""
+    level_info = grid["levels"][level]
+    samples_per_peak = level_info["samples_per_peak"]
+    sample_rate = grid["sample_rate"]
+
+    with np.load(os.path.join(_waveform_dir(waveform_id), "peaks.npz")) as data:
+        peaks = data[f"level_{level}"]
+
+    first = max(0, int(start * sample_rate // samples_per_peak))
+    last = len(peaks) if end is None else min(len(peaks), int(np.ceil(end * sample_rate / samples_per_peak)))
+    last = max(first, last)
+    window = np.ascontiguousarray(peaks[first:last])
+
+    header = PEAKS_HEADER.pack(
+        PEAKS_MAGIC, PEAKS_VERSION, level, sample_rate,
+        samples_per_peak, first, len(window), grid["scale"] / 127
+    )
+    return header + window.tobytes()
+
+
+def delete_waveform(waveform_id: str):
+    output_dir = _waveform_dir(waveform_id)
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir, ignore_errors=True)
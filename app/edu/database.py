@@ -11,3 +11,8 @@ client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS)
 database = client.user_score_db
 
 skill_ratings_collection = database.get_collection("user_scores")
+
+question_bank_collection = database.get_collection("question_bank")
+
+# Lease that elects the one worker process running the question bank replenisher
+question_bank_lease_collection = database.get_collection("question_bank_lease")
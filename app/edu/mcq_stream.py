@@ -0,0 +1,124 @@
+import json
+import re
+from typing import List, Optional
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_tag_start(text: str, tag: str) -> int:
+    """Index where a possibly incomplete `tag` begins at the end of `text`, or len(text)"""
+    start = text.rfind("<", max(0, len(text) - len(tag) + 1))
+    if start != -1 and tag.startswith(text[start:]):
+        return start
+    return len(text)
+
+
+def validate_question(question) -> Optional[dict]:
+    """Return the question if it has everything the test UI needs, else None"""
+    if not isinstance(question, dict):
+        return None
+    options = question.get("options")
+    if not isinstance(question.get("question"), str) or not question["question"].strip():
+        return None
+    if not isinstance(options, list) or len(options) != 4 or not all(isinstance(o, str) for o in options):
+        return None
+    if not isinstance(question.get("correct_answer"), str) or not question["correct_answer"].strip():
+        return None
+    if not isinstance(question.get("characteristic"), str):
+        return None
+    return question
+
+
+class QuestionStreamParser:
+    """
+    Incremental parser for the MCQ response. Text is fed in as it streams
+    from the model; <think> sections are skipped and every question object
+    is returned from feed() as soon as its closing brace arrives.
+
+    Question objects are recognised structurally: any JSON object whose
+    parent is an array, so the surrounding {"questions": [...]} wrapper,
+    markdown fences or prose around the JSON don't matter.
+    """
+    def __init__(self):
+        self._carry = ""
+        self._in_think = False
+        # JSON scanner state
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._object_chars = None
+        self._object_depth = 0
+        self.invalid = 0
+
+    def feed(self, chunk: str) -> List[dict]:
+        questions = []
+        text = self._carry + chunk
+        self._carry = ""
+
+        while text:
+            tag = THINK_CLOSE if self._in_think else THINK_OPEN
+            index = text.find(tag)
+            if index != -1:
+                if not self._in_think:
+                    questions.extend(self._scan(text[:index]))
+                self._in_think = not self._in_think
+                text = text[index + len(tag):]
+                continue
+
+            # Hold back a partial tag split across chunks
+            split = _partial_tag_start(text, tag)
+            if not self._in_think:
+                questions.extend(self._scan(text[:split]))
+            self._carry = text[split:]
+            break
+
+        return questions
+
+    def close(self) -> List[dict]:
+        """Flush held-back text at the end of the stream"""
+        carry, self._carry = self._carry, ""
+        return [] if self._in_think else self._scan(carry)
+
+    def _scan(self, text: str) -> List[dict]:
+        questions = []
+        for char in text:
+            if self._object_chars is not None:
+                self._object_chars.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "[{":
+                if char == "{" and self._object_chars is None and self._stack and self._stack[-1] == "[":
+                    self._object_chars = [char]
+                    self._object_depth = len(self._stack)
+                self._stack.append(char)
+            elif char in "]}":
+                if self._stack:
+                    self._stack.pop()
+                if char == "}" and self._object_chars is not None and len(self._stack) == self._object_depth:
+                    question = self._parse_object("".join(self._object_chars))
+                    self._object_chars = None
+                    if question:
+                        questions.append(question)
+        return questions
+
+    def _parse_object(self, raw: str) -> Optional[dict]:
+        try:
+            question = json.loads(re.sub(r',\s*([\]}])', r'\1', raw))
+        except json.JSONDecodeError:
+            question = None
+        question = validate_question(question)
+        if question is None:
+            self.invalid += 1
+            print(f"Skipping malformed question in MCQ stream: {raw[:200]}")
+        return question
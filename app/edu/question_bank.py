@@ -0,0 +1,320 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import numpy as np
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from fastapi.concurrency import run_in_threadpool
+from app.embeddings import embed_texts
+from app.llm_gateway import gateway, LLMError
+from .database import question_bank_collection, question_bank_lease_collection
+from .mcq_stream import QuestionStreamParser, validate_question
+
+CHARACTERISTICS = ("creativity", "clarity", "engagement", "technical_proficiency", "strategic_thinking")
+
+QUESTION_BANK_MODEL = os.getenv("QUESTION_BANK_MODEL", "deepseek-r1-distill-llama-70b")
+# Refill a characteristic when its stock drops below the low watermark, up to the high one
+QUESTION_BANK_LOW_WATERMARK = int(os.getenv("QUESTION_BANK_LOW_WATERMARK", "20"))
+QUESTION_BANK_HIGH_WATERMARK = int(os.getenv("QUESTION_BANK_HIGH_WATERMARK", "60"))
+QUESTION_BANK_BATCH_SIZE = int(os.getenv("QUESTION_BANK_BATCH_SIZE", "8"))
+QUESTION_BANK_INTERVAL = float(os.getenv("QUESTION_BANK_INTERVAL", "300"))
+# A question is retired after it has appeared in this many tests
+QUESTION_BANK_MAX_SERVES = int(os.getenv("QUESTION_BANK_MAX_SERVES", "25"))
+# Cosine similarity above which a new question counts as a near-duplicate
+QUESTION_BANK_DEDUPE_THRESHOLD = float(os.getenv("QUESTION_BANK_DEDUPE_THRESHOLD", "0.9"))
+# Overlap when re-reading recent inserts, covering clock skew between workers
+QUESTION_BANK_SYNC_OVERLAP = timedelta(seconds=float(os.getenv("QUESTION_BANK_SYNC_OVERLAP", "300")))
+QUESTION_BANK_REPLENISH = os.getenv("QUESTION_BANK_REPLENISH", "1") == "1"
+# Only the worker holding the lease replenishes; another takes over once it expires
+QUESTION_BANK_LEASE_SECONDS = float(os.getenv("QUESTION_BANK_LEASE_SECONDS", str(2 * QUESTION_BANK_INTERVAL + 60)))
+# First pass is delayed so worker startup isn't slowed by embedding and LLM work
+QUESTION_BANK_STARTUP_DELAY = float(os.getenv("QUESTION_BANK_STARTUP_DELAY", "60"))
+
+
+def normalize_characteristic(value: str) -> Optional[str]:
+    characteristic = value.strip().lower().replace(" ", "_").replace("-", "_")
+    if characteristic == "creative":
+        characteristic = "creativity"
+    return characteristic if characteristic in CHARACTERISTICS else None
+
+
+def build_bank_prompt(characteristic: str, count: int) -> List[dict]:
+    label = characteristic.replace("_", " ")
+    prompt = (
+        f"Create {count} multiple-choice questions on 'Content Creation' that assess {label}. "
+        f"Each question must include 4 concise answer options labeled A, B, C, D, with one correct answer. "
+        f"\nGuidelines for high-quality questions:\n"
+        f"1. Focus on application of knowledge rather than simple recall\n"
+        f"2. Ensure all wrong answers (distractors) are plausible and of similar length to the correct answer\n"
+        f"3. Use clear, precise language without ambiguity\n"
+        f"4. Test higher-order thinking skills (analysis, evaluation, synthesis)\n"
+        f"5. Avoid negative phrasing like 'Which is NOT...'\n"
+        f"6. Include scenario-based questions that require critical thinking\n"
+        f"7. Cover a different scenario or sub-skill in every question\n"
+        f"\nOutput the result as a single valid JSON object using the following structure and nothing else:\n\n"
+        "{\"questions\": [\n"
+        f"    {{\"characteristic\": \"{characteristic}\", \"question\": \"...\", \"options\": [\"A. ...\", \"B. ...\", \"C. ...\", \"D. ...\"], "
+        "\"correct_answer\": \"...\", \"explanation\": \"Brief explanation of why this answer is correct\"},\n"
+        "    ...\n"
+        "]}"
+    )
+    return [
+        {"role": "system", "content": "You are an expert educator specializing in creating high-quality assessment questions that test deep understanding and critical thinking."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+class QuestionBank:
+    """
+    Mongo-backed stock of MCQ questions per characteristic. Tests are
+    assembled by sampling the bank; a background task tops each
+    characteristic back up to the high watermark whenever it falls below the
+    low one. With several workers, only the one holding a Mongo lease runs
+    it. New questions are embedded and dropped if they are too similar to
+    anything already in the bank, including questions other workers added.
+    """
+    def __init__(self):
+        self._embeddings = np.zeros((0, 0), dtype=np.float32)  # normalized vectors of every banked question
+        self._embedding_ids = set()
+        self._synced_at = None
+        self._embed_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task = None
+        self._worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_replenisher = False
+        self.stats = {"generated": 0, "added": 0, "duplicates": 0, "invalid": 0,
+                      "tests_served": 0, "last_replenish": None}
+
+    async def _sync_embeddings(self) -> np.ndarray:
+        """
+        Bring the dedupe vectors up to date. The first call loads the whole
+        bank; later calls only read questions inserted since the last sync
+        (by any worker), going by the creation time in their ObjectId.
+        """
+        now = datetime.utcnow()
+        query = {}
+        if self._synced_at is not None:
+            query = {"_id": {"$gte": ObjectId.from_datetime(self._synced_at - QUESTION_BANK_SYNC_OVERLAP)}}
+        vectors = []
+        async for doc in question_bank_collection.find(query, {"embedding": 1}):
+            if doc["_id"] in self._embedding_ids or not doc.get("embedding"):
+                continue
+            self._embedding_ids.add(doc["_id"])
+            vectors.append(doc["embedding"])
+        if vectors:
+            new = np.asarray(vectors, dtype=np.float32)
+            self._embeddings = np.vstack([self._embeddings, new]) if len(self._embeddings) else new
+        if self._synced_at is None:
+            print(f"Loaded {len(vectors)} question embeddings for deduplication")
+        self._synced_at = now
+        return self._embeddings
+
+    async def add_questions(self, questions: List[dict], source: str = "bank") -> int:
+        """Validate, deduplicate and store questions; returns how many were added"""
+        candidates = []
+        for question in questions:
+            question = validate_question(question)
+            characteristic = normalize_characteristic(question["characteristic"]) if question else None
+            if not characteristic:
+                self.stats["invalid"] += 1
+                continue
+            candidates.append({**question, "characteristic": characteristic})
+        if not candidates:
+            return 0
+
+        vectors = await run_in_threadpool(embed_texts, [q["question"] for q in candidates])
+
+        async with self._embed_lock:
+            known = await self._sync_embeddings()
+            accepted, accepted_vectors = [], []
+            for question, vector in zip(candidates, vectors):
+                if len(known) and float(np.max(known @ vector)) >= QUESTION_BANK_DEDUPE_THRESHOLD:
+                    self.stats["duplicates"] += 1
+                    continue
+                accepted.append(question)
+                accepted_vectors.append(vector)
+                # Also compare against questions accepted earlier in this batch
+                known = np.vstack([known, vector]) if len(known) else vector[None, :]
+
+            if not accepted:
+                return 0
+
+            now = datetime.utcnow()
+            result = await question_bank_collection.insert_many([
+                {
+                    "characteristic": q["characteristic"],
+                    "question": q["question"],
+                    "options": q["options"],
+                    "correct_answer": q["correct_answer"],
+                    "explanation": q.get("explanation", ""),
+                    "embedding": vector.tolist(),
+                    "source": source,
+                    "served_count": 0,
+                    "created_at": now
+                }
+                for q, vector in zip(accepted, accepted_vectors)
+            ])
+            self._embeddings = known
+            self._embedding_ids.update(result.inserted_ids)
+
+        self.stats["added"] += len(accepted)
+        return len(accepted)
+
+    async def generate(self, characteristic: str, count: int = QUESTION_BANK_BATCH_SIZE) -> int:
+        """Ask the LLM for a batch of questions on one characteristic and bank them"""
+        response_text = await gateway.chat_text(
+            model=QUESTION_BANK_MODEL,
+            messages=build_bank_prompt(characteristic, count),
+            temperature=0.8,
+            max_completion_tokens=300 * count + 1000,
+            top_p=0.95,
+            reasoning_format="raw"
+        )
+        parser = QuestionStreamParser()
+        questions = parser.feed(response_text) + parser.close()
+        self.stats["generated"] += len(questions)
+        self.stats["invalid"] += parser.invalid
+        # The prompt is per characteristic, so trust it over the model's label
+        return await self.add_questions([{**q, "characteristic": characteristic} for q in questions])
+
+    async def counts(self) -> Dict[str, int]:
+        """Questions still available for tests, per characteristic"""
+        counts = {characteristic: 0 for characteristic in CHARACTERISTICS}
+        pipeline = [
+            {"$match": {"served_count": {"$lt": QUESTION_BANK_MAX_SERVES}}},
+            {"$group": {"_id": "$characteristic", "count": {"$sum": 1}}}
+        ]
+        async for row in question_bank_collection.aggregate(pipeline):
+            if row["_id"] in counts:
+                counts[row["_id"]] = row["count"]
+        return counts
+
+    async def replenish(self):
+        """Top up every characteristic that is below the low watermark"""
+        counts = await self.counts()
+        for characteristic, count in counts.items():
+            if count >= QUESTION_BANK_LOW_WATERMARK:
+                continue
+            missing = QUESTION_BANK_HIGH_WATERMARK - count
+            print(f"Question bank: {characteristic} has {count} questions, generating {missing}")
+            # Cap the number of calls so a run of duplicates can't loop forever
+            for _ in range(2 * (missing // QUESTION_BANK_BATCH_SIZE + 1)):
+                if missing <= 0:
+                    break
+                try:
+                    added = await self.generate(characteristic, min(QUESTION_BANK_BATCH_SIZE, missing))
+                except LLMError as e:
+                    print(f"Question bank: generation for {characteristic} failed: {e}")
+                    break
+                missing -= added
+        self.stats["last_replenish"] = datetime.utcnow().isoformat()
+
+    async def assemble_test(self, per_characteristic: int = 4) -> Optional[List[dict]]:
+        """
+        Sample a test from the bank, or return None if any characteristic
+        doesn't have enough questions (the caller then falls back to the LLM).
+        """
+        questions = []
+        for characteristic in CHARACTERISTICS:
+            sampled = await question_bank_collection.aggregate([
+                {"$match": {"characteristic": characteristic, "served_count": {"$lt": QUESTION_BANK_MAX_SERVES}}},
+                {"$sample": {"size": per_characteristic}},
+                {"$project": {"embedding": 0, "source": 0, "served_count": 0, "created_at": 0}}
+            ]).to_list(per_characteristic)
+            if len(sampled) < per_characteristic:
+                self.trigger_replenish()
+                return None
+            questions.extend(sampled)
+
+        await question_bank_collection.update_many(
+            {"_id": {"$in": [q["_id"] for q in questions]}},
+            {"$inc": {"served_count": 1}}
+        )
+        for question in questions:
+            question["id"] = str(question.pop("_id"))
+
+        self.stats["tests_served"] += 1
+        self.trigger_replenish()
+        return questions
+
+    def trigger_replenish(self):
+        """Wake the background task early, e.g. after stock was consumed"""
+        self._wake.set()
+
+    async def _acquire_lease(self) -> bool:
+        """Take or renew the replenisher lease; False while another worker holds it"""
+        now = datetime.utcnow()
+        try:
+            await question_bank_lease_collection.find_one_and_update(
+                {"_id": "replenisher", "$or": [{"owner": self._worker_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self._worker_id,
+                          "expires_at": now + timedelta(seconds=QUESTION_BANK_LEASE_SECONDS)}},
+                upsert=True
+            )
+            acquired = True
+        except DuplicateKeyError:
+            # The lease document exists and is held by a live worker
+            acquired = False
+        if acquired != self.is_replenisher:
+            print(f"Question bank: {'acquired' if acquired else 'lost'} the replenisher lease ({self._worker_id})")
+        self.is_replenisher = acquired
+        return acquired
+
+    async def _release_lease(self):
+        if self.is_replenisher:
+            await question_bank_lease_collection.delete_one({"_id": "replenisher", "owner": self._worker_id})
+            self.is_replenisher = False
+
+    async def _replenish_loop(self):
+        await asyncio.sleep(QUESTION_BANK_STARTUP_DELAY)
+        index_ready = False
+        while True:
+            try:
+                if await self._acquire_lease():
+                    if not index_ready:
+                        await question_bank_collection.create_index([("characteristic", 1), ("served_count", 1)])
+                        index_ready = True
+                    start = time.perf_counter()
+                    await self.replenish()
+                    print(f"Question bank replenish pass took {time.perf_counter() - start:.1f}s")
+            except Exception as e:
+                print(f"Question bank replenish failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=QUESTION_BANK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start_replenisher(self):
+        if QUESTION_BANK_REPLENISH and self._task is None:
+            self._task = asyncio.create_task(self._replenish_loop())
+
+    async def stop_replenisher(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            try:
+                await self._release_lease()
+            except Exception as e:
+                print(f"Question bank: could not release the replenisher lease: {e}")
+
+    async def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "available": await self.counts(),
+            "low_watermark": QUESTION_BANK_LOW_WATERMARK,
+            "high_watermark": QUESTION_BANK_HIGH_WATERMARK,
+            "replenisher_running": self._task is not None and not self._task.done(),
+            "is_replenisher": self.is_replenisher
+        }
+
+
+question_bank = QuestionBank()
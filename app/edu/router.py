@@ -1,20 +1,32 @@
 from fastapi import APIRouter, HTTPException
-from app.edu.course_recommender import UserProfiledCourseRecommender
-from groq import Groq
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from functools import lru_cache
+from app.llm_gateway import gateway, LLMError
 from dotenv import load_dotenv
-import os
 import json
+import asyncio
 from .schemas import SkillRatings
 from pydantic import BaseModel
 from .crud import add_skill_ratings, retrieve_latest_skill_ratings
+from .mcq_stream import QuestionStreamParser
+from .question_bank import question_bank
 import re
+import time
 
 load_dotenv()
 
 router = APIRouter(prefix="/edu", tags=["Education task APIs"])
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 
-recommender = UserProfiledCourseRecommender('data/courses.csv')
+# Fire-and-forget tasks are referenced until done so they aren't garbage collected mid-run
+_background_tasks = set()
+
+
+@lru_cache(maxsize=1)
+def get_recommender():
+    """Build the recommender (embeddings model + FAISS index) on first use"""
+    from app.edu.course_recommender import UserProfiledCourseRecommender
+    return UserProfiledCourseRecommender('data/courses.csv')
 
 
 @router.get("/skill_ratings")
@@ -38,7 +50,8 @@ async def course_recommendation_endpoint():
         skill_ratings = await retrieve_latest_skill_ratings()
         
         # Generate recommendations with both user profile and skill ratings
-        recommendations = recommender.recommend_courses(skill_ratings)
+        recommender = await run_in_threadpool(get_recommender)
+        recommendations = await run_in_threadpool(recommender.recommend_courses, skill_ratings)
         
         # Convert the recommendations JSON string to a JSON object
         return json.loads(recommendations)
@@ -46,11 +59,11 @@ async def course_recommendation_endpoint():
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/mcq-test")
-async def generate_mcq_test():
-    # Parse categories and calculate questions per category
-    
+MCQ_MODEL = "deepseek-r1-distill-llama-70b"
+MCQ_SYSTEM_PROMPT = "You are an expert educator specializing in creating high-quality assessment questions that test deep understanding and critical thinking."
 
+
+def build_mcq_messages() -> list:
     prompt = (
         f"Create a 20-question multiple-choice test on 'Content Creation' with challenging, thought-provoking questions. "
         f"Divide the test evenly into 5 categories: creativity,clarity,engagement,technical_proficiency,strategic_thinking "
@@ -70,21 +83,58 @@ async def generate_mcq_test():
         "    ...\n"
         "]}"
     )
+    return [
+        {"role": "system", "content": MCQ_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
 
-    completion = client.chat.completions.create(
-        model="deepseek-r1-distill-llama-70b",
-        messages=[
-            {"role": "system", "content": "You are an expert educator specializing in creating high-quality assessment questions that test deep understanding and critical thinking."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.7,  # Slightly higher temperature for more creative questions
-        max_completion_tokens=3000,  # Increased for accommodating explanations
-        top_p=0.95,
-        stream=False,
-        reasoning_format="raw"
-    )
 
-    response_text = completion.choices[0].message.content
+MCQ_PARAMS = {
+    "temperature": 0.7,  # Slightly higher temperature for more creative questions
+    "max_completion_tokens": 3000,  # Increased for accommodating explanations
+    "top_p": 0.95,
+    "reasoning_format": "raw"
+}
+
+
+def bank_questions(questions: list):
+    """Add generated questions to the bank in the background"""
+    async def add():
+        try:
+            added = await question_bank.add_questions(questions, source="mcq-test")
+            print(f"Added {added} of {len(questions)} generated questions to the bank")
+        except Exception as e:
+            print(f"Failed to bank generated questions: {e}")
+    task = asyncio.create_task(add())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+@router.get("/question-bank/stats")
+async def question_bank_stats():
+    return await question_bank.get_stats()
+
+
+@router.get("/mcq-test")
+async def generate_mcq_test(fresh: bool = False):
+    # Serve from the pre-generated question bank unless a fresh test is requested
+    if not fresh:
+        try:
+            questions = await question_bank.assemble_test()
+        except Exception as e:
+            print(f"Question bank unavailable, generating with the LLM: {e}")
+            questions = None
+        if questions:
+            return {"response": {"questions": questions}, "source": "bank"}
+
+    try:
+        response_text = await gateway.chat_text(
+            model=MCQ_MODEL,
+            messages=build_mcq_messages(),
+            **MCQ_PARAMS
+        )
+    except LLMError as e:
+        raise HTTPException(status_code=502, detail=f"LLM request failed: {str(e)}")
 
     print(response_text)  # Keep this for debugging
 
@@ -109,10 +159,10 @@ async def generate_mcq_test():
         # Validate the structure of the response
         if "questions" not in extracted_json or not extracted_json["questions"]:
             return {"error": "Invalid response structure: missing questions array"}
-            
- 
-            
-        return {"response": extracted_json}
+
+        # Freshly generated questions also stock the bank
+        bank_questions(extracted_json["questions"])
+        return {"response": extracted_json, "source": "llm"}
     except json.JSONDecodeError as e:
         # More advanced cleaning attempt for difficult JSON cases
         try:
@@ -120,13 +170,59 @@ async def generate_mcq_test():
             fixed_json_str = re.sub(r',\s*}', '}', cleaned_json_str)
             fixed_json_str = re.sub(r',\s*]', ']', fixed_json_str)
             extracted_json = json.loads(fixed_json_str)
-            return {"response": extracted_json}
+            bank_questions(extracted_json.get("questions", []))
+            return {"response": extracted_json, "source": "llm"}
         except json.JSONDecodeError:
             return {"error": f"JSON parsing error: {str(e)}\n{response_text[:500]}..."}
 
     return {"response": extracted_json}
 
 
+@router.get("/mcq-test/stream")
+async def stream_mcq_test(format: str = "ndjson"):
+    """
+    Streaming variant of /mcq-test. The model output is parsed as it
+    arrives and each question is sent as soon as it is complete and valid,
+    as NDJSON lines (default) or server-sent events with ?format=sse.
+    Events: {"type": "question", "index", "question"}, then
+    {"type": "done", "count", "skipped"} or {"type": "error", "detail"}.
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+
+    def encode(event: dict) -> str:
+        if format == "sse":
+            return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        return json.dumps(event) + "\n"
+
+    async def stream_questions():
+        parser = QuestionStreamParser()
+        count = 0
+        start = time.perf_counter()
+        try:
+            async for chunk in gateway.stream_chat(MCQ_MODEL, build_mcq_messages(), **MCQ_PARAMS):
+                for question in parser.feed(chunk):
+                    if count == 0:
+                        print(f"First MCQ question after {time.perf_counter() - start:.2f}s")
+                    yield encode({"type": "question", "index": count, "question": question})
+                    count += 1
+            for question in parser.close():
+                yield encode({"type": "question", "index": count, "question": question})
+                count += 1
+        except LLMError as e:
+            yield encode({"type": "error", "detail": f"LLM request failed: {str(e)}"})
+            return
+
+        if count == 0:
+            yield encode({"type": "error", "detail": "No valid questions found in the LLM response."})
+        else:
+            yield encode({"type": "done", "count": count, "skipped": parser.invalid})
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream_questions(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 def clean_json(json_str: str) -> str:
     cleaned = re.sub(r',\s*([\]}])', r'\1', json_str)
     return cleaned
@@ -0,0 +1,19 @@
+from functools import lru_cache
+from typing import List
+import numpy as np
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+
+@lru_cache(maxsize=1)
+def get_embedder():
+    """Sentence embedding model shared by the question bank and screenshot retrieval"""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Unit-length float32 embeddings, so dot products are cosine similarities"""
+    vectors = np.asarray(get_embedder().embed_documents(texts), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
@@ -0,0 +1,54 @@
+"""
+Import-time profile of the API, to keep track of worker cold start.
+
+    python -m app.import_profile              # profile `import app.main`
+    python -m app.import_profile --top 40 app.creative.router
+
+Runs the import in a fresh interpreter with `-X importtime` and reports the
+total import time plus the slowest modules by cumulative time.
+"""
+import argparse
+import subprocess
+import sys
+
+
+def profile_imports(module: str = "app.main"):
+    """Return (total seconds, [(cumulative us, self us, module name), ...])"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            entries.append((int(cumulative_us), int(self_us), name.rstrip()))
+        except ValueError:
+            continue
+
+    # Top-level entries (no indentation) add up to the whole import
+    total_us = sum(cumulative for cumulative, _, name in entries if not name.startswith("  ", 1))
+    return total_us / 1e6, entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import-time cost of a module")
+    parser.add_argument("module", nargs="?", default="app.main")
+    parser.add_argument("--top", type=int, default=25, help="Number of slowest modules to show")
+    args = parser.parse_args()
+
+    total, entries = profile_imports(args.module)
+    print(f"Importing {args.module} took {total:.2f}s ({len(entries)} modules)\n")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative, self_time, name in sorted(entries, reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:>10.1f}ms {self_time / 1000:>8.1f}ms  {name.strip()}")
+
+
+if __name__ == "__main__":
+    main()
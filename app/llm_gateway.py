@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+import random
+import time
+import httpx
+from dotenv import load_dotenv
+from typing import AsyncIterator, Dict, List, Optional
+
+load_dotenv()
+
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_DEFAULT_CONCURRENCY = int(os.getenv("LLM_DEFAULT_CONCURRENCY", "4"))
+# Per-model overrides, e.g. "deepseek-r1-distill-llama-70b=2,llama-3.3-70b-versatile=8"
+LLM_MODEL_CONCURRENCY = os.getenv("LLM_MODEL_CONCURRENCY", "")
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Raised when an LLM call fails after all retries"""
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _parse_model_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            model, limit = item.rsplit("=", 1)
+            try:
+                limits[model.strip()] = int(limit)
+            except ValueError:
+                print(f"Ignoring invalid LLM concurrency setting: {item}")
+    return limits
+
+
+class LLMGateway:
+    """
+    Shared async client for Groq's OpenAI-compatible chat API. Keeps a pooled
+    HTTP client for the life of the process, limits in-flight calls per
+    model, retries 429/5xx with jittered exponential backoff and records
+    token and latency totals per model.
+    """
+    def __init__(self):
+        self._client = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._model_limits = _parse_model_limits(LLM_MODEL_CONCURRENCY)
+        self.stats: Dict[str, dict] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=GROQ_BASE_URL,
+                headers={"Authorization": f"Bearer {GROQ_API_KEY}"},
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            limit = self._model_limits.get(model, LLM_DEFAULT_CONCURRENCY)
+            self._semaphores[model] = asyncio.Semaphore(limit)
+        return self._semaphores[model]
+
+    def _model_stats(self, model: str) -> dict:
+        if model not in self.stats:
+            self.stats[model] = {
+                "requests": 0,
+                "failures": 0,
+                "retries": 0,
+                "in_flight": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_latency": 0.0,
+                "max_latency": 0.0
+            }
+        return self.stats[model]
+
+    def _record(self, model: str, latency: float, usage: Optional[dict] = None):
+        stats = self._model_stats(model)
+        stats["requests"] += 1
+        stats["total_latency"] += latency
+        stats["max_latency"] = max(stats["max_latency"], latency)
+        if usage:
+            stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            stats["completion_tokens"] += usage.get("completion_tokens", 0)
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), LLM_BACKOFF_MAX)
+            except ValueError:
+                pass
+        # Full jitter so retries from concurrent requests spread out
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+    async def _post_with_retries(self, model: str, payload: dict, stream: bool = False):
+        """POST a chat completion, returning the httpx response (open if streaming)"""
+        client = self._get_client()
+        stats = self._model_stats(model)
+        last_error = None
+
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            retry_after = None
+            try:
+                request = client.build_request("POST", "/chat/completions", json=payload)
+                response = await client.send(request, stream=stream)
+                if response.status_code < 400:
+                    return response
+
+                if stream:
+                    await response.aread()
+                    await response.aclose()
+                last_error = LLMError(
+                    f"LLM request failed with status {response.status_code}: {response.text[:300]}",
+                    response.status_code
+                )
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise last_error
+                retry_after = response.headers.get("retry-after")
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                last_error = LLMError(f"LLM request error: {type(e).__name__}: {e}")
+
+            if attempt < LLM_MAX_RETRIES:
+                stats["retries"] += 1
+                delay = self._backoff(attempt, retry_after)
+                print(f"LLM call to {model} failed ({last_error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+        raise last_error
+
+    async def chat(self, model: str, messages: List[dict], **params) -> dict:
+        """Run a chat completion and return the parsed response body"""
+        payload = {"model": model, "messages": messages, **params, "stream": False}
+        stats = self._model_stats(model)
+
+        async with self._semaphore(model):
+            stats["in_flight"] += 1
+            start = time.perf_counter()
+            try:
+                response = await self._post_with_retries(model, payload)
+                body = response.json()
+            except Exception:
+                stats["failures"] += 1
+                raise
+            finally:
+                stats["in_flight"] -= 1
+
+        latency = time.perf_counter() - start
+        self._record(model, latency, body.get("usage"))
+        print(f"LLM {model}: {latency:.2f}s, usage={body.get('usage', {}).get('total_tokens')} tokens")
+        return body
+
+    async def chat_text(self, model: str, messages: List[dict], **params) -> str:
+        """Run a chat completion and return the message content"""
+        body = await self.chat(model, messages, **params)
+        return body["choices"][0]["message"]["content"]
+
+    async def stream_chat(self, model: str, messages: List[dict], **params) -> AsyncIterator[str]:
+        """
+        Run a streaming chat completion and yield content deltas as they
+        arrive. Retries only apply before the first chunk is received.
+        """
+        payload = {"model": model, "messages": messages, **params, "stream": True}
+        stats = self._model_stats(model)
+
+        async with self._semaphore(model):
+            stats["in_flight"] += 1
+            start = time.perf_counter()
+            usage = None
+            try:
+                response = await self._post_with_retries(model, payload, stream=True)
+                try:
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        chunk = json.loads(data)
+                        # Groq reports usage on the final chunk under x_groq
+                        usage = chunk.get("usage") or chunk.get("x_groq", {}).get("usage") or usage
+                        for choice in chunk.get("choices", []):
+                            content = choice.get("delta", {}).get("content")
+                            if content:
+                                yield content
+                finally:
+                    await response.aclose()
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                stats["failures"] += 1
+                raise LLMError(f"LLM stream error: {type(e).__name__}: {e}")
+            except Exception:
+                stats["failures"] += 1
+                raise
+            finally:
+                stats["in_flight"] -= 1
+
+        latency = time.perf_counter() - start
+        self._record(model, latency, usage)
+        print(f"LLM {model} (stream): {latency:.2f}s, usage={(usage or {}).get('total_tokens')} tokens")
+
+    def get_stats(self) -> dict:
+        report = {}
+        for model, stats in self.stats.items():
+            report[model] = {
+                **stats,
+                "avg_latency": round(stats["total_latency"] / stats["requests"], 3) if stats["requests"] else None,
+                "total_latency": round(stats["total_latency"], 3),
+                "max_latency": round(stats["max_latency"], 3)
+            }
+        return report
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+gateway = LLMGateway()
@@ -1,3 +1,7 @@
+import time
+
+_import_start = time.perf_counter()
+
 from fastapi import FastAPI
 from app.edu.router import router as edu_router
 from app.creative.router import router as creative_router
@@ -6,6 +10,14 @@ from fastapi.staticfiles import StaticFiles
 from app.analytics.router import router as analytics_router
 from app.auth.router import router as auth_router
 from app.analytics.youtube_dashboard import router as youtube_router
+from app.warmup import start_warmup
+from app.llm_gateway import gateway
+from app.edu.question_bank import question_bank
+from app.analytics.url_fetcher import url_fetcher
+from app.analytics.report_jobs import report_jobs
+
+# Heavy ML backends are imported on first use; see `python -m app.import_profile`
+print(f"Routers imported in {time.perf_counter() - _import_start:.2f}s")
 
 app = FastAPI(title="AlphaGen")
 
@@ -28,6 +40,30 @@ app.include_router(auth_router)
 app.include_router(youtube_router)
 
 
+@app.on_event("startup")
+async def warm_up_backends():
+    # Optional background warm-up, configured with WARMUP_BACKENDS
+    start_warmup()
+    # Keeps the MCQ question bank stocked, configured with QUESTION_BANK_*
+    question_bank.start_replenisher()
+    # Removes expired and excess cached PDF reports, configured with REPORT_CACHE_*
+    report_jobs.start_cleaner()
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await question_bank.stop_replenisher()
+    await gateway.close()
+    await url_fetcher.close()
+    await report_jobs.stop()
+
+
 @app.get("/")
 def root():
     return {"message": "Welcome to the AlphaGen!"}
+
+
+@app.get("/llm/stats")
+def llm_stats():
+    """Token and latency totals per model for LLM calls made by this worker"""
+    return gateway.get_stats()
@@ -0,0 +1,58 @@
+import importlib
+import os
+import threading
+import time
+
+# Comma separated backends to load in the background at startup, or "all".
+# Anything not warmed up is loaded on first use instead.
+WARMUP_BACKENDS = os.getenv("WARMUP_BACKENDS", "")
+
+
+def _warm_recommender():
+    from app.edu.router import get_recommender
+    get_recommender()
+
+
+def _warm_embedder():
+    from app.embeddings import get_embedder
+    get_embedder()
+
+
+BACKENDS = {
+    "gemini": lambda: importlib.import_module("google.generativeai"),
+    "reportlab": lambda: importlib.import_module("reportlab.platypus"),
+    "gradio": lambda: importlib.import_module("gradio_client"),
+    "audio": lambda: [importlib.import_module(m) for m in ("librosa", "moviepy", "pydub")],
+    "recommender": _warm_recommender,
+    "embeddings": _warm_embedder,
+}
+
+
+def warm_up(names) -> dict:
+    """Load the given backends and return how long each one took"""
+    timings = {}
+    for name in names:
+        start = time.perf_counter()
+        try:
+            BACKENDS[name]()
+            timings[name] = round(time.perf_counter() - start, 3)
+            print(f"Warm-up: {name} loaded in {timings[name]:.2f}s")
+        except Exception as e:
+            timings[name] = None
+            print(f"Warm-up: {name} failed: {e}")
+    return timings
+
+
+def start_warmup():
+    """Warm the configured backends in a daemon thread so startup is not delayed"""
+    if not WARMUP_BACKENDS.strip():
+        return None
+
+    if WARMUP_BACKENDS.strip() == "all":
+        names = list(BACKENDS)
+    else:
+        names = [name.strip() for name in WARMUP_BACKENDS.split(",") if name.strip() in BACKENDS]
+
+    thread = threading.Thread(target=warm_up, args=(names,), name="backend-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,128 @@
+import importlib
+import multiprocessing
+import os
+import signal
+import time
+import pytest
+
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                                reason="the stub settings reach the worker process through fork")
+
+
+@pytest.fixture
+def music(tmp_path, monkeypatch):
+    """music_generator with the stub model, storing jobs and output under tmp_path"""
+    # media_library and job_storage create their directories relative to the cwd on import
+    monkeypatch.chdir(tmp_path)
+    music_generator = importlib.import_module("app.creative.music_generator")
+    job_storage = importlib.import_module("app.creative.job_storage")
+    os.makedirs(tmp_path / "jobs")
+    monkeypatch.setattr(job_storage, "JOB_STATUS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(music_generator, "MUSICGEN_MODEL", "stub")
+    monkeypatch.setattr(music_generator, "MUSICGEN_BATCH_WAIT", 0.2)
+    monkeypatch.setattr(music_generator, "MUSICGEN_POLL_INTERVAL", 0.02)
+    monkeypatch.setattr(music_generator, "MUSICGEN_RESTART_DELAY", 0.1)
+
+    service = music_generator.MusicGenService(str(tmp_path))
+    yield music_generator, job_storage, service
+    if service.process is not None and service.process.is_alive():
+        service.process.kill()
+        service.process.join()
+
+
+def new_job(job_storage, job_id):
+    job = job_storage.VideoJob(job_id)
+    job.status = "queued"
+    job_storage.JobStorage.save_job(job_id, job)
+
+
+def wait_for(job_storage, job_id, done=lambda job: job.status in ("completed", "failed"), timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = job_storage.JobStorage.load_job(job_id)
+        if done(job):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} still {job.status}: {job.progress_messages}")
+
+
+def test_batches_prompts_of_similar_duration(music):
+    music_generator, job_storage, service = music
+    for job_id, duration in (("short", 5), ("similar", 8), ("long", 20)):
+        new_job(job_storage, job_id)
+        # Queued before the worker starts, so they are all waiting together
+        service.queue.put({"job_id": job_id, "prompt": f"{job_id} tune", "duration": duration})
+    service._ensure_worker()
+
+    jobs = {job_id: wait_for(job_storage, job_id) for job_id in ("short", "similar", "long")}
+    assert all(job.status == "completed" for job in jobs.values())
+    assert "Generating in a batch of 2" in jobs["short"].progress_messages
+    assert "Generating in a batch of 2" in jobs["similar"].progress_messages
+    assert "Generating in a batch of 1" in jobs["long"].progress_messages
+
+    import soundfile as sf
+    # Each track is trimmed to its own duration, not the batch's longest
+    assert sf.info(jobs["short"].output_path).duration == pytest.approx(5)
+    assert sf.info(jobs["similar"].output_path).duration == pytest.approx(8)
+
+
+def test_worker_crash_fails_taken_jobs_and_keeps_queued_ones(music, monkeypatch):
+    music_generator, job_storage, service = music
+    generate = music_generator.StubMusicGen.generate
+
+    def hang_on_crash_prompt(self, descriptions, progress=False):
+        if "crash" in descriptions:
+            time.sleep(60)
+        return generate(self, descriptions, progress)
+
+    monkeypatch.setattr(music_generator.StubMusicGen, "generate", hang_on_crash_prompt)
+
+    new_job(job_storage, "taken")
+    service.submit("taken", "crash", 5)
+    wait_for(job_storage, "taken", lambda job: any("Generating" in m for m in job.progress_messages))
+    new_job(job_storage, "queued")
+    service.submit("queued", "fine", 5)
+
+    crashed = service.process
+    os.kill(crashed.pid, signal.SIGKILL)
+
+    taken = wait_for(job_storage, "taken")
+    assert taken.status == "failed"
+    assert taken.error == "Music worker stopped unexpectedly"
+    # The request still waiting in the queue is picked up by the restarted worker
+    assert wait_for(job_storage, "queued").status == "completed"
+    assert service.process is not crashed
+
+
+def test_model_load_failure_fails_queued_jobs(music, monkeypatch):
+    music_generator, job_storage, service = music
+
+    def broken_model():
+        raise RuntimeError("no weights")
+
+    monkeypatch.setattr(music_generator, "load_music_model", broken_model)
+    for job_id in ("first", "second"):
+        new_job(job_storage, job_id)
+        service.queue.put({"job_id": job_id, "prompt": job_id, "duration": 5})
+    service._ensure_worker()
+
+    for job_id in ("first", "second"):
+        job = wait_for(job_storage, job_id)
+        assert job.status == "failed"
+        assert "no weights" in job.error
+    service.process.join(5)
+    assert not service.queue.has_pending()
+
+
+def test_one_worker_per_host(music):
+    music_generator, job_storage, service = music
+    other = music_generator.MusicGenService(service.output_dir)
+
+    new_job(job_storage, "one")
+    service.submit("one", "tune", 5)
+    wait_for(job_storage, "one")
+    # A second server process sees the running worker and doesn't start its own
+    new_job(job_storage, "two")
+    other.submit("two", "tune", 5)
+    assert other.process is None
+    assert wait_for(job_storage, "two").status == "completed"